@@ -0,0 +1,123 @@
+"""
+Compare writing an image with pycdlib straight to a file and through the background writer.
+
+    python benchmarks/background_writer_benchmark.py --files 64 --size 16 --buffers 2 4 8
+
+The source files are written to a temporary directory first, size MB each, and dropped from the page cache where
+possible so they are read from the disk as they would be when mastering.  For each way of writing the wall time,
+the CPU time of the process and the throughput are shown and for the background writer how long its thread spent
+writing and how long pycdlib waited for a free buffer; the difference is the writing that was overlapped with
+reading.  Each image is checked to be byte for byte the same as pycdlib's.  Run it with the temporary directory on
+the file system of interest, eg TMPDIR=/mnt/scratch.
+"""
+from argparse import ArgumentParser
+import hashlib
+import os
+from pathlib import Path
+import sys
+import tempfile
+import time
+from unittest import mock
+
+import pycdlib
+
+sys.path.insert(0, str(Path(__file__).absolute().parents[1]))
+
+from odarchive.background_writer import BackgroundWriter, WRITE_BUFFER_SIZE
+
+MB = 1024 * 1024
+
+
+def make_files(work_dir, num_files, size):
+    block = os.urandom(MB)
+    filenames = []
+    for i in range(num_files):
+        filename = os.path.join(work_dir, f"file{i:05}.bin")
+        with open(filename, "wb") as f:
+            for j in range(size):
+                f.write(block[j:] + block[:j])  # Each MB different so nothing is deduplicated
+            f.flush()
+            os.fsync(f.fileno())
+        filenames.append(filename)
+    return filenames
+
+
+def drop_cache(filenames):
+    if hasattr(os, "posix_fadvise"):
+        for filename in filenames:
+            fd = os.open(filename, os.O_RDONLY)
+            try:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            finally:
+                os.close(fd)
+
+
+def build(filenames):
+    iso = pycdlib.PyCdlib()
+    iso.new(interchange_level=3, udf="2.60")
+    iso.add_directory("/DATA", udf_path="/DATA")
+    for i, filename in enumerate(filenames):
+        iso.add_file(filename, f"/DATA/{i:08}", udf_path=f"/DATA/{os.path.basename(filename)}")
+    return iso
+
+
+def file_hash(filename):
+    hasher = hashlib.sha512()
+    with open(filename, "rb") as f:
+        for data in iter(lambda: f.read(4 * MB), b""):
+            hasher.update(data)
+    return hasher.hexdigest()
+
+
+def timed(label, size, function, filenames):
+    drop_cache(filenames)
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    writer = function()
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+    line = f"{label:<28} {elapsed:8.2f} s {cpu:8.2f} s CPU {size / MB / elapsed:10.1f} MB/s"
+    if writer is not None:
+        overlapped = max(0.0, writer.write_time - writer.wait_time)
+        line += (f"   writing {writer.write_time:6.2f} s, waiting {writer.wait_time:6.2f} s, "
+                 f"overlapped {overlapped:6.2f} s")
+    print(line)
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--files", type=int, default=64)
+    parser.add_argument("--size", type=int, default=16, help="MB in each file")
+    parser.add_argument("--buffers", type=int, nargs="+", default=[2, 4, 8], help="Buffers in the ring")
+    parser.add_argument("--direct", action="store_true", help="Also write with O_DIRECT")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as work_dir:
+        filenames = make_files(work_dir, args.files, args.size)
+        total = args.files * args.size * MB
+        iso = build(filenames)  # The same image each time so the times in it are the same
+        # Apart from the time it is written, which pycdlib puts in the volume descriptor
+        with mock.patch("pycdlib.headervd.time") as fake_time:
+            fake_time.time.return_value = time.time()
+            expected = os.path.join(work_dir, "pycdlib.iso")
+            timed("pycdlib write", total, lambda: iso.write(expected, blocksize=WRITE_BUFFER_SIZE), filenames)
+            expected_hash = file_hash(expected)
+            os.remove(expected)
+
+            def background(filename, buffers, direct):
+                with BackgroundWriter(filename, direct=direct, num_buffers=buffers) as f:
+                    iso.write_fp(f, blocksize=WRITE_BUFFER_SIZE)
+                return f
+
+            for direct in (False, True) if args.direct else (False,):
+                for buffers in args.buffers:
+                    filename = os.path.join(work_dir, f"buffers{buffers}.iso")
+                    label = f"background {buffers} buffers{' direct' if direct else ''}"
+                    timed(label, total, lambda: background(filename, buffers, direct), filenames)
+                    if file_hash(filename) != expected_hash:
+                        print("  image differs from pycdlib's")
+                    os.remove(filename)
+        iso.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Compare saving and loading the working state of an archive with dill and with a checkpoint.
+
+    python benchmarks/checkpoint_benchmark.py --entries 1000000
+
+The archive is synthetic, no files are read, so only the cost of serialisation is measured.
+"""
+from argparse import ArgumentParser
+import hashlib
+import os
+from pathlib import Path, PurePosixPath
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(Path(__file__).absolute().parents[1]))
+
+from odarchive import Archiver, load_archiver_from_checkpoint, load_archiver_from_dill
+from odarchive.hash_db import HashDatabase
+from odarchive.hash_file_entry import HashFileEntry
+
+
+def make_archiver(num_entries):
+    ar = Archiver()
+    ar.source_path = Path("/media/usb")
+    ar.hash_db = HashDatabase(None, ar.iso_path_root)
+    entries = ar.hash_db.entries
+    entries.path = ar.source_path
+    for i in range(num_entries):
+        file_hash = hashlib.sha512(i.to_bytes(8, "little")).hexdigest()
+        filename = PurePosixPath(f"/DATA/dir{i // 1000:05}/file{i:08}.txt")
+        entries[file_hash] = HashFileEntry(
+            entries, file_hash, filename, size=i * 7 % 100000, mtime=1.5e9 + i, disc_num=i // 20000
+        )
+    ar.hash_db.last_disc_number = (num_entries - 1) // 20000
+    return ar
+
+
+def timed(label, function):
+    start = time.perf_counter()
+    result = function()
+    print(f"{label:<32} {time.perf_counter() - start:8.2f} s")
+    return result
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--entries", type=int, default=1000000)
+    args = parser.parse_args()
+    ar = timed(f"Build {args.entries:,} entries", lambda: make_archiver(args.entries))
+    with tempfile.TemporaryDirectory() as work_dir:
+        dill_file = os.path.join(work_dir, "archiver.dill")
+        checkpoint_file = os.path.join(work_dir, "archiver.checkpoint")
+        timed("dill save", lambda: ar.save_as_dill(dill_file))
+        timed("dill load", lambda: load_archiver_from_dill(dill_file))
+        timed("checkpoint save", lambda: ar.save_checkpoint(checkpoint_file))
+        timed("checkpoint load", lambda: load_archiver_from_checkpoint(checkpoint_file))
+        timed("checkpoint load one disc", lambda: load_archiver_from_checkpoint(checkpoint_file, disc_num=0))
+        print(f"{'dill size':<32} {os.path.getsize(dill_file):12,} bytes")
+        print(f"{'checkpoint size':<32} {os.path.getsize(checkpoint_file):12,} bytes")
+
+
+if __name__ == "__main__":
+    main()
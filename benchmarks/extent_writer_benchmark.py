@@ -0,0 +1,91 @@
+"""
+Compare writing an image with pycdlib and with the file data copied in parallel by extent_writer.
+
+    python benchmarks/extent_writer_benchmark.py --files 64 --size 16 --threads 1 4
+
+The source files are written to a temporary directory first, size MB each, and added to the image as write_iso
+adds them.  Each image is checked to be byte for byte the same as pycdlib's.  Run it with the temporary directory
+on the file system of interest, eg TMPDIR=/mnt/scratch, as copy_file_range may share blocks rather than copy them.
+"""
+from argparse import ArgumentParser
+import hashlib
+import os
+from pathlib import Path
+import sys
+import tempfile
+import time
+from unittest import mock
+
+import pycdlib
+
+sys.path.insert(0, str(Path(__file__).absolute().parents[1]))
+
+from odarchive.extent_writer import write_image
+
+MB = 1024 * 1024
+
+
+def make_files(work_dir, num_files, size):
+    block = os.urandom(MB)
+    filenames = []
+    for i in range(num_files):
+        filename = os.path.join(work_dir, f"file{i:05}.bin")
+        with open(filename, "wb") as f:
+            for j in range(size):
+                f.write(block[j:] + block[:j])  # Each MB different so nothing is deduplicated
+        filenames.append(filename)
+    return filenames
+
+
+def build(filenames):
+    iso = pycdlib.PyCdlib()
+    iso.new(interchange_level=3, udf="2.60")
+    iso.add_directory("/DATA", udf_path="/DATA")
+    for i, filename in enumerate(filenames):
+        iso.add_file(filename, f"/DATA/{i:08}", udf_path=f"/DATA/{os.path.basename(filename)}")
+    return iso
+
+
+def file_hash(filename):
+    hasher = hashlib.sha512()
+    with open(filename, "rb") as f:
+        for data in iter(lambda: f.read(4 * MB), b""):
+            hasher.update(data)
+    return hasher.hexdigest()
+
+
+def timed(label, size, function):
+    start = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<24} {elapsed:8.2f} s {size / MB / elapsed:10.1f} MB/s")
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--files", type=int, default=64)
+    parser.add_argument("--size", type=int, default=16, help="MB in each file")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4])
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as work_dir:
+        filenames = make_files(work_dir, args.files, args.size)
+        total = args.files * args.size * MB
+        iso = build(filenames)  # The same image each time so the times in it are the same
+        # Apart from the time it is written, which pycdlib puts in the volume descriptor
+        with mock.patch("pycdlib.headervd.time") as fake_time:
+            fake_time.time.return_value = time.time()
+            expected = os.path.join(work_dir, "pycdlib.iso")
+            timed("pycdlib write", total, lambda: iso.write(expected))
+            expected_hash = file_hash(expected)
+            os.remove(expected)
+            for threads in args.threads:
+                filename = os.path.join(work_dir, f"threads{threads}.iso")
+                timed(f"extent writer {threads} threads", total, lambda: write_image(iso, filename, threads))
+                if file_hash(filename) != expected_hash:
+                    print("  image differs from pycdlib's")
+                os.remove(filename)
+        iso.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Compare mastering and reading an image with all the numbered files in one ISO 9660 directory and fanned out.
+
+    python benchmarks/fan_out_benchmark.py --files 1000 10000 50000
+
+The images are synthetic, each file is a few bytes from memory, so only the cost of the directory layout is
+measured.  The lookup times are for finding a sample of the files by their ISO 9660 path in the written image
+and the list times for listing the directory each of them is in.
+"""
+from argparse import ArgumentParser
+from io import BytesIO
+import os
+from pathlib import Path
+import random
+import sys
+import tempfile
+import time
+
+import pycdlib
+
+sys.path.insert(0, str(Path(__file__).absolute().parents[1]))
+
+from odarchive.iso_names import FAN_OUT, FanOut
+
+
+def master(filename, num_files, fan_out):
+    """Returns the ISO 9660 path of each file and the seconds taken to add them and to write the image"""
+    iso = pycdlib.PyCdlib()
+    iso.new(interchange_level=3, udf="2.60")
+    start = time.perf_counter()
+    iso.add_directory("/DATA", udf_path="/DATA")
+    layout = FanOut("/DATA", "F", num_files, fan_out)
+    paths = []
+    for number in range(num_files):
+        buckets, iso_path = layout.place(number)
+        for bucket in buckets:
+            iso.add_directory(bucket)
+        data = f"{number}".encode("ascii")
+        iso.add_fp(BytesIO(data), len(data), iso_path, udf_path=f"/DATA/file{number}")
+        paths.append(iso_path)
+    added = time.perf_counter()
+    iso.write(filename)
+    written = time.perf_counter()
+    iso.close()
+    return paths, added - start, written - added
+
+
+def lookup(filename, paths, samples):
+    """Seconds to open the image, seconds per lookup of a random sample of the paths and seconds per listing of
+    the directory each is in, as a reader walking the tree would"""
+    start = time.perf_counter()
+    iso = pycdlib.PyCdlib()
+    iso.open(filename)
+    opened = time.perf_counter()
+    sample = random.Random(1).sample(paths, min(samples, len(paths)))
+    for iso_path in sample:
+        iso.get_record(iso_path=iso_path)
+    looked_up = time.perf_counter()
+    for iso_path in sample:
+        for child in iso.list_children(iso_path=iso_path.rsplit("/", 1)[0]):
+            child.file_identifier()
+    listed = time.perf_counter()
+    iso.close()
+    return opened - start, (looked_up - opened) / len(sample), (listed - looked_up) / len(sample)
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--files", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--samples", type=int, default=1000, help="files looked up in each image")
+    args = parser.parse_args()
+    print(f"{'files':>8} {'layout':<8} {'add s':>8} {'write s':>8} {'open s':>8} {'lookup ms':>10} {'list ms':>10}")
+    with tempfile.TemporaryDirectory() as work_dir:
+        filename = os.path.join(work_dir, "benchmark.iso")
+        for num_files in args.files:
+            for label, fan_out in (("flat", max(num_files, 1)), ("fan-out", FAN_OUT)):
+                paths, add_time, write_time = master(filename, num_files, fan_out)
+                open_time, lookup_time, list_time = lookup(filename, paths, args.samples)
+                print(f"{num_files:>8,} {label:<8} {add_time:8.2f} {write_time:8.2f} {open_time:8.2f} "
+                      f"{lookup_time * 1000:10.3f} {list_time * 1000:10.3f}")
+                os.remove(filename)
+
+
+if __name__ == "__main__":
+    main()
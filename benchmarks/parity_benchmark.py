@@ -0,0 +1,75 @@
+"""
+Compare how fast Reed-Solomon parity is added to an image with how fast the image is written.
+
+    python benchmarks/parity_benchmark.py --size 512 --parity 0.02 0.05 0.1
+
+An image of size MB of random data is written through the background writer, as write_iso does, then for each
+fraction of parity the parity is added to a copy of it and the copy damaged with a scratch of as many sectors as
+can be repaired and repaired again.  For each the wall time, the CPU time and the throughput over the image are
+shown.  Adding parity keeps up with mastering if its throughput is at least that of writing.  Run it with the
+temporary directory on the file system of interest, eg TMPDIR=/mnt/scratch.
+"""
+from argparse import ArgumentParser
+import os
+from pathlib import Path
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(Path(__file__).absolute().parents[1]))
+
+from odarchive.background_writer import BackgroundWriter, WRITE_BUFFER_SIZE
+from odarchive.parity import add_parity, repair_image, SECTOR_SIZE
+
+MB = 1024 * 1024
+
+
+def timed(label, size, function):
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    result = function()
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+    print(f"{label:<28} {elapsed:8.2f} s {cpu:8.2f} s CPU {size / MB / elapsed:10.1f} MB/s")
+    return result
+
+
+def write_image(filename, size):
+    block = os.urandom(WRITE_BUFFER_SIZE)
+    with BackgroundWriter(filename) as f:
+        for i in range(size * MB // WRITE_BUFFER_SIZE):
+            f.write(block[i % SECTOR_SIZE:] + block[:i % SECTOR_SIZE])  # Each block different
+        f.fsync()
+
+
+def scratch(filename, start, num_sectors):
+    with open(filename, "r+b") as f:
+        f.seek(start * SECTOR_SIZE)
+        f.write(bytes(num_sectors * SECTOR_SIZE))
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", type=int, default=512, help="MB in the image")
+    parser.add_argument("--parity", type=float, nargs="+", default=[0.02, 0.05, 0.1],
+                        help="Fractions of the disc that are parity")
+    args = parser.parse_args()
+    total = args.size * MB
+    with tempfile.TemporaryDirectory() as work_dir:
+        image = os.path.join(work_dir, "image.iso")
+        timed("write image", total, lambda: write_image(image, args.size))
+        for fraction in args.parity:
+            filename = os.path.join(work_dir, f"parity.iso")
+            shutil.copyfile(image, filename)
+            layout = timed(f"add {fraction:.0%} parity", total, lambda: add_parity(filename, fraction))
+            lost = layout.groups * layout.parity_rows
+            scratch(filename, layout.data_sectors // 3, lost)
+            report = timed(f"repair {lost:,} sectors", total, lambda: repair_image(filename))
+            if not report.passed:
+                print(f"  {report.summary()}")
+            os.remove(filename)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,5 +4,6 @@
 from ._version import *
 
 from .archive import *
+from .catalogue_index import *
 from .disc_info import *
 from .cli import *
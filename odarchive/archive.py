@@ -1,4 +1,5 @@
 # -*- encoding: utf-8 -*-
+from concurrent.futures import as_completed, ProcessPoolExecutor, ThreadPoolExecutor
 import datetime as dt
 import dateutil.parser
 
@@ -7,17 +8,39 @@ try:
 except ImportError:
     from io import BytesIO
 import logging
+import multiprocessing
 import os
+import shutil
 from os import lstat
 import dill
 
 import pycdlib
 
+from .background_writer import BackgroundWriter, WRITE_BUFFER_SIZE
+from .catalogue_index import CatalogueIndex, estimate_index_growth, estimate_index_size
+from .checkpoint import Checkpoint, write_checkpoint
 from .consts import *
 from .disc_info import DiscInfo
 from .file_db import FileDatabase
+from .extent_writer import write_image
+from .file_parts import FileSlice
 from .hash_db import *
 from .hash_file_entry import iso9660_dir, HashFileEntry
+from .image_size import ImageLayout
+from .iso_names import FanOut
+from .journal import Journal, JOURNAL_SUFFIX
+from .manifest import manifest_line
+from .packing import PackFile
+from .parity import add_parity, parity_rows, parity_size
+from .path_index import PATH_INDEX_FILENAME, write_path_index
+from .planner import DiscPlanner
+from .priority import PriorityRules
+from .production import produce_images
+from .restore import BulkRestore, Disc, RESTORE_THREADS
+from .stream import ImageStream, STREAM_BUFFER_SIZE
+from .scrub import SAMPLE_BYTES, SCRUB_WORKERS, scrub_image
+from .segmenter import NEXT_FIT, SEGMENT_STRATEGIES
+from .verify import FileCheck, verify_image
 
 
 # import tarfile
@@ -133,6 +156,45 @@ def load_archiver_from_dill(filename="archiver.dill"):
     return archiver
 
 
+def load_archiver_from_checkpoint(filename=CHECKPOINT_FILENAME, disc_num=None):
+    """Load an archive from a checkpoint written by save_checkpoint.
+    If disc_num is given then only the entries for that disc are loaded eg for writing a single iso.  An
+    archive loaded like this is partial and cannot be saved."""
+    with Checkpoint(filename) as cp:
+        meta = cp.meta
+        if meta["version"] != DATABASE_VERSION:
+            raise odarchiveError(f"Version of Catalogue ({meta['version']}) does not match that of software "
+                                 f"({DATABASE_VERSION}).")
+        ar = Archiver()
+        for attribute in ('client_name', 'job_name', 'version'):
+            setattr(ar, attribute, meta[attribute])
+        ar.iso_path_root = PurePosixPath(meta['iso_path_root'])
+        ar.job_id = uuid.UUID(meta['job_id'])
+        if meta['guid'] is not None:
+            ar.guid = uuid.UUID(meta['guid'])
+        if meta['source_path'] is not None:
+            ar.source_path = Path(meta['source_path'])
+        if meta['locked']:
+            ar.locked = True
+        ar.catalogue_mode = meta['catalogue_mode']
+        ar.hash_db = HashDatabase(None, ar.iso_path_root)
+        entries = ar.hash_db.entries
+        if meta['entries_path'] is not None:
+            entries.path = Path(meta['entries_path'])
+        for attribute in ('segment_size', 'str_segment_size', 'int_segment_size', 'catalogue_size',
+                          'last_disc_number', 'sharded', 'strategy', 'pending', 'priority_rules', 'pack_threshold',
+                          'manifest', 'parity'):
+            if attribute in meta:
+                setattr(ar.hash_db, attribute, meta[attribute])
+        ar.priority_rules = list(ar.hash_db.priority_rules)
+        for file_hash, size, mtime, this_disc_num, filenames, parts, pack_offset in cp.rows(disc_num):
+            entries[file_hash] = HashFileEntry(entries, file_hash, filenames, size, mtime, this_disc_num,
+                                               parts=parts, pack_offset=pack_offset)
+        entries.load_bridge_names(meta.get('iso9660_names'))  # Once the entries they are the names of are there
+    ar.partial_disc_num = disc_num
+    return ar
+
+
 def load_archiver_from_json(filename=None, json_data=None):
     """Load an archive from a catalogue.jsno file eg from an written CD.
     If filename is none, can load the json directly.  Note the filename takes precedence over json_data"""
@@ -145,12 +207,17 @@ def load_archiver_from_json(filename=None, json_data=None):
             except KeyError:
                 pass
         try:
-            ar.client_name = uuid.UUID(d["job_id"])
+            ar.job_id = uuid.UUID(d["job_id"])
         except KeyError:
-            pass  # Ignore missing client names.  Missisn from frist version
+            pass  # Ignore missing job_id.  Missing from first version
+        ar.catalogue_mode = d.get('catalogue_mode', CATALOGUE_FULL)
+        ar.shard = d.get('shard')  # None for a full catalogue
         # fill the has_db from the d['files'] entry.
         ar.hash_db = HashDatabase(None, ar.iso_path_root)
+        ar.hash_db.manifest = d.get('manifest', False)
+        ar.hash_db.parity = d.get('parity', 0)
         ar.hash_db.entries = HashFileEntries.create_from_json(ar.iso_path_root, d['files'], ar.hash_db)
+        ar.hash_db.entries.load_bridge_names(d.get('iso9660_names'))
         """Save the current catalogue to file as a JSON file.
         It should be possible to reread this file later and recreate this record."""
         ar.guid = uuid.UUID(d["guid"])
@@ -172,6 +239,8 @@ def load_archiver_from_json(filename=None, json_data=None):
             ar.hash_db.int_segment_size = d['segment_size_int']
         except:
             ar.hash_db.int_segment_size = 25000000000
+        if ar.shard is not None:  # A shard only has its own files but knows how many discs there are
+            ar.hash_db.last_disc_number = int(d['num_discs']) - 1
     if filename:
         with open(filename) as json_data_from_file:
             parse_json(json.load(json_data_from_file))
@@ -182,6 +251,74 @@ def load_archiver_from_json(filename=None, json_data=None):
     return ar
 
 
+def load_archiver_from_shards(filenames=None, json_datas=None):
+    """Reconstruct the full catalogue of a sharded archive by merging the catalogue from each disc.
+    Either give the filenames of all the catalogues or their json contents."""
+    if filenames:
+        shards = [load_archiver_from_json(filename) for filename in filenames]
+    else:
+        shards = [load_archiver_from_json(json_data=json_data) for json_data in json_datas]
+    shards.sort(key=lambda shard: -1 if shard.shard is None else shard.shard)
+    ar = shards[0]
+    for shard in shards:
+        if shard.shard is None:
+            raise odarchiveError('Can only merge sharded catalogues but found a full catalogue.')
+        if shard.job_id != ar.job_id:
+            raise odarchiveError(f'Catalogue for disc {shard.shard} is from a different job {shard.job_id}.')
+    found = [shard.shard for shard in shards]
+    expected = list(range(ar.num_discs))
+    if found != expected:
+        raise odarchiveError(f'Need catalogues for discs {expected} to merge but have {found}.')
+    for shard in shards[1:]:
+        ar.hash_db.entries.update(shard.hash_db.entries)
+        for entry in shard.hash_db.entries.values():
+            entry.parent = ar.hash_db.entries
+    ar.hash_db.last_disc_number = ar.num_discs - 1
+    ar.shard = None
+    return ar
+
+
+def load_archiver_from_discs(sources):
+    """Load the catalogue from written discs, ISO images or the directories they are mounted on.
+    For a sharded archive the catalogues of all the discs are merged so all the discs are needed.
+    Returns the archive and a dictionary of disc number to source."""
+    catalogues = []
+    discs = {}
+    for source in sources:
+        with Disc(source) as disc:
+            discs[disc.disc_num] = source
+            catalogues.append(disc.read(f"/{DB_FILENAME}").decode("utf-8"))
+    ar = load_archiver_from_json(json_data=catalogues[0])
+    if ar.shard is not None:
+        ar = load_archiver_from_shards(json_datas=catalogues)
+    return ar, discs
+
+
+_mastering_io_lock = None  # Shared by the worker processes of write_all_isos
+
+
+def _init_mastering_worker(io_lock):
+    global _mastering_io_lock
+    _mastering_io_lock = io_lock
+
+
+def _selected(path, patterns):
+    """True if a path relative to the data directory is, or is under, one of patterns or matches it as a glob"""
+    text = str(path)
+    for pattern in patterns:
+        pattern = str(pattern).strip("/")
+        if text == pattern or text.startswith(pattern + "/") or fnmatch(text, pattern):
+            return True
+    return False
+
+
+def _master_disc(checkpoint, disc_num, filename):
+    """Writes the ISO of one disc in a worker process of write_all_isos
+    :return: the size and hash of the image"""
+    ar = load_archiver_from_checkpoint(checkpoint, disc_num=disc_num)
+    return ar.master_iso(filename, disc_num, io_lock=_mastering_io_lock)
+
+
 class Archiver:
     """This holds the information on the archiving project - potentially should keep state over multiple
     invocations.  This means that you do not have to hold in memory a temporary copy of all discs but
@@ -195,6 +332,8 @@ class Archiver:
         self.job_id = uuid.uuid4()  # The job_id should only be changed when reading a job from an old catalogue.
         self.version = DATABASE_VERSION
         self.guid = None
+        self.catalogue_mode = CATALOGUE_FULL
+        self.priority_rules = []  # See set_priority_rules
 
 
     def save_as_dill(self, filename="archiver.dill"):
@@ -206,14 +345,108 @@ class Archiver:
             # Pickle the 'data' dictionary using the highest protocol available.
             dill.dump(self, f, dill.HIGHEST_PROTOCOL)
 
-    def save(self, catalogue_name=DB_FILENAME):
-        """Save the current catalogue to file as a JSON file.
-        It should be possible to reread this file later and recreate this record and a complete archive."""
+    def save_checkpoint(self, filename=CHECKPOINT_FILENAME):
+        """Save the working state of the archive so that it can be carried on with by another command.
+        Unlike save_as_dill only the data needed to rebuild the hash database is kept and the format is
+        versioned.  Use load_archiver_from_checkpoint to read it back."""
+        self._check_can_save()
+        hash_db = self.hash_db
+        meta = {
+            "client_name": self.client_name,
+            "job_name": self.job_name,
+            "job_id": str(self.job_id),
+            "guid": None if self.guid is None else str(self.guid),
+            "iso_path_root": str(self.iso_path_root),
+            "source_path": str(self.source_path) if hasattr(self, "source_path") else None,
+            "entries_path": None if hash_db.entries.path is None else str(hash_db.entries.path),
+            "locked": self.is_locked,
+            "catalogue_mode": self.catalogue_mode,
+            "version": self.version,
+            "segment_size": hash_db.segment_size,
+            "last_disc_number": hash_db.last_disc_number,
+            "iso9660_names": hash_db.entries.bridge_names.changed(),
+        }
+        for attribute in ('str_segment_size', 'int_segment_size', 'catalogue_size', 'sharded', 'strategy',
+                          'pending', 'priority_rules', 'pack_threshold', 'manifest', 'parity'):
+            if hasattr(hash_db, attribute):
+                meta[attribute] = getattr(hash_db, attribute)
+        rows = (
+            (entry.file_hash, entry.size, entry.mtime, entry.disc_num, list(entry.filenames),
+             entry.parts if entry.is_split else None, entry.pack_offset if entry.is_packed else None)
+            for entry in hash_db.entries.values()
+        )
+        write_checkpoint(filename, meta, rows)
+
+    def _check_can_save(self):
         if not hasattr(self, "hash_db"):
             raise odarchiveError('Trying to save an archive which has not yet calculated the hashes for all the files.')
+        if getattr(self, "partial_disc_num", None) is not None:
+            raise odarchiveError(f'Archive was only loaded for disc {self.partial_disc_num} so cannot be saved.')
+        if getattr(self, "shard", None) is not None:
+            raise odarchiveError(f'Archive was loaded from the catalogue shard of disc {self.shard} so cannot be '
+                                 f'saved, merge the shards with load_archiver_from_shards first.')
+
+    @property
+    def is_sharded(self):
+        """A sharded archive has a catalogue on each disc of only the files on that disc plus a global index"""
+        try:
+            return self.catalogue_mode == CATALOGUE_SHARDED
+        except AttributeError:  # Saved before there were catalogue modes
+            return False
+
+    @property
+    def num_discs(self):
+        return self.hash_db.last_disc_number + 1
+
+    def save(self, catalogue_name=DB_FILENAME, disc_num=None):
+        """Save the current catalogue to file as a JSON file.
+        It should be possible to reread this file later and recreate this record and a complete archive.
+        If disc_num is given then only a shard of the catalogue, the files on that disc, is saved."""
+        self._check_can_save()
         self.guid = uuid.uuid4()  # a second save will have a different guid as the structure is mutable and this
         # ensures that each saved file is uniquely identifiable.
         filename = Path(getcwd()) / catalogue_name
+        with filename.open("w", encoding="utf-8") as f:
+            json.dump(self._catalogue_data(disc_num), f, ensure_ascii=False, sort_keys=True, indent=4)
+
+    def catalogue_json(self, disc_num=None):
+        """Returns the catalogue as it is saved, eg to write directly to an iso."""
+        return json.dumps(self._catalogue_data(disc_num), ensure_ascii=False, sort_keys=True, indent=4)
+
+    def estimate_catalogue_size(self, disc_num=None):
+        """Upper estimate of the size of the saved catalogue, or if sharded of the header of a catalogue shard, once
+        the archive is segmented.  Worked out from the entries so the catalogue doesn't have to be saved first."""
+        header = self._catalogue_header(disc_num)
+        header["files"] = {}
+        size = len(json.dumps(header, ensure_ascii=False, sort_keys=True, indent=4).encode("utf-8"))
+        size += 100  # The guid, date, segment size and number of discs are filled in later
+        if not self.is_sharded:
+            # The disc number can't be larger than the number of entries
+            num_entries = len(self.hash_db.entries)
+            size += sum(entry.catalogue_size(num_entries, self.hash_db.will_pack(entry))
+                        for entry in self.hash_db.files())
+        return size
+
+    def save_index(self, index_name=INDEX_FILENAME):
+        """Save the global index of a segmented archive"""
+        filename = Path(getcwd()) / index_name
+        with filename.open("w", encoding="utf-8") as f:
+            f.write(CatalogueIndex.create(self.hash_db, self.job_id).to_json())
+
+    def save_path_index(self, filename=PATH_INDEX_FILENAME):
+        """Save the index of where each file of a segmented archive is for getting one at a time, see
+        path_index.py"""
+        if not self.is_segmented:
+            raise odarchiveError("Archive has not been segmented so the files have no discs yet")
+        write_path_index(self.hash_db, self.iso_path_root, Path(getcwd()) / filename)
+
+    def _catalogue_data(self, disc_num):
+        data = self._catalogue_header(disc_num)
+        data["files"] = json.loads(self.hash_db.entries.to_json(disc_num))
+        return data
+
+    def _catalogue_header(self, disc_num):
+        """Everything in the catalogue apart from the files"""
         data = {
             "client_name": self.client_name,  # date of saving the file
             "date": str(dt.datetime.utcnow().isoformat()),  # date of saving the file
@@ -224,11 +457,27 @@ class Archiver:
             "segment_size" : self.hash_db.segment_size,
             "source_path" : str(self.source_path), # Where did the data come from
             "version": self.version,
-            "files": json.loads(self.hash_db.entries.to_json()),
             # List of directories are derived from file paths
         }
-        with filename.open("w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, sort_keys=True, indent=4)
+        if self.is_sharded:
+            data["catalogue_mode"] = CATALOGUE_SHARDED
+            if disc_num is not None:
+                data["shard"] = disc_num
+                data["num_discs"] = self.num_discs
+        if getattr(self.hash_db, "manifest", False):
+            data["manifest"] = True
+        if getattr(self.hash_db, "parity", 0):
+            data["parity"] = self.hash_db.parity
+        entries = self.hash_db.entries
+        if disc_num is None or not self.is_sharded:
+            iso9660_names = entries.bridge_names.changed()
+        else:
+            iso9660_names = entries.bridge_names.changed(
+                str(entry.parent.iso_path_root / filename)
+                for entry in entries.files_on_disc(disc_num) for filename in entry.filenames)
+        if iso9660_names:  # Only the names that had to be made unique, see iso_names.py
+            data["iso9660_names"] = iso9660_names
+        return data
 
     def create_file_database(self, usb_path, job_name=None, client_name = None):
         # Create database
@@ -245,23 +494,77 @@ class Archiver:
         )  # Scan directory to add files
         # Need to load the hash files into the Has list
 
-    def convert_to_hash_database(self, verbose=False):
+    def set_priority_rules(self, specs):
+        """Sets the rules, written TIER:KIND:VALUE, that put files into priority tiers.  Each tier is segmented onto
+        its own discs with tier 0 first, see priority.py."""
+        specs = PriorityRules(specs).specs  # Check they are valid
+        self.priority_rules = specs
+        if hasattr(self, "hash_db"):
+            self.hash_db.priority_rules = specs
+
+    def _tier_filter(self, max_tier):
+        """Returns a function that is True for a FileEntry to be hashed now"""
+        if max_tier is None:
+            return lambda file_entry: True
+        rules = PriorityRules(getattr(self, "priority_rules", []))
+        return lambda file_entry: rules.tier([file_entry.relative_path], file_entry.mtime) <= max_tier
+
+    def convert_to_hash_database(self, verbose=False, max_tier=None):
+        """Hashes the files and creates the hash database.
+        :param max_tier: if given only files in this priority tier or before are hashed and added.  Once those have
+          been segmented and their discs written the rest can be added with add_new_files."""
         if not self.is_locked:
+            wanted = self._tier_filter(max_tier)
+            for filename, file_entry in list(self.file_db.entries.items()):
+                if not wanted(file_entry):
+                    del self.file_db.entries[filename]
             self.file_db.calculate_file_hash(verbose)
             # Create database
             self.hash_db = HashDatabase(self.file_db, self.iso_path_root)
+            self.hash_db.priority_rules = list(getattr(self, "priority_rules", []))
         else:
             raise odarchiveError('Archive locked so cannot calculate hashes')
 
+    def add_new_files(self, verbose=False, max_tier=None):
+        """Scans the source path again and adds new and changed files to the catalogue.  This can be done once the
+        archive is locked as files already in the catalogue keep their disc, see segment_new_files.  Only files
+        whose path, size or mtime are not in the catalogue are hashed.  A changed file is added as a new entry and
+        its old contents are kept as they are already on a disc.  Files that have been removed are also kept.
+        If max_tier is given only files in that priority tier or before are added.  Returns the number of files
+        added."""
+        try:
+            source_path = self.hash_db.entries.path
+        except AttributeError:
+            raise odarchiveError('Archive has no hash database to add files to')
+        if not source_path:
+            raise odarchiveError('Archive was loaded without its source path so cannot add files')
+        known = {}
+        for entry in self.hash_db.files():
+            for filename in entry.filenames:
+                known[filename] = (entry.size, entry.mtime)
+        file_db = FileDatabase(Path(source_path))
+        added, _, _ = file_db._find_changes()  # As file_db is empty every file is found
+        wanted = self._tier_filter(max_tier)
+        count = 0
+        for file_entry in sorted(added, key=lambda file_entry: file_entry.filename):
+            udf_path = str(self.hash_db.entries.entry_to_path(file_entry))
+            if known.get(udf_path) == (file_entry.size, file_entry.mtime) or not wanted(file_entry):
+                continue
+            file_entry.update_type()
+            file_entry.calculate_file_hash()
+            if self.hash_db.add_new_file(file_entry):
+                count += 1
+                if verbose:
+                    print(f"Added {udf_path}")
+        return count
+
     def create_catalogue(self, verbose=False):
         """Creates a catalogue file catalogue.json on disc."""
-        self.hash_db.save()  # Creates catalogue.json
-        self.save()
+        self.save()  # Creates catalogue.json
 
 
-    def write_iso(self, pretend=False, disc_num=None, job_name="new"):
-        """No ISO file will be created if there are not files in it.  Eg using a disc num that is
-        not being used."""
+    def _build_iso(self, disc_num):
+        """Returns a new pycdlib image with everything for a disc added and whether it has any files"""
         try:
             if disc_num is None and self.hash_db.last_disc_number is not None:
                 raise odarchiveError("disc_num is None but archive has been segmented")
@@ -276,11 +579,7 @@ class Archiver:
                     seqnum = 0
                 else:
                     seqnum = disc_num
-                if self.last_disc_num is None:  # Has not been segmented
-                    set_size = 1
-                else:
-                    set_size = self.last_disc_num
-                print(f'Disc num = |{disc_num}|')
+                set_size = self._set_size
                 iso.new(
                     interchange_level=3,
                     udf="2.60",
@@ -295,70 +594,41 @@ class Archiver:
                 f"Probably have not yet created hash db"
             )
 
-        # The readme file is created fresh for each disc created.  It should consist of specific information about
-        # this disc and also information about the archive process
-        readme = f"""# Archive File created by www.drummonds.net
-This archive was created {dt.datetime.now().strftime('%Y-%m-%dT%H:%M:%S')}
-
-The data for this archive is stored in the directory /DATA.
-There is a catalogue of this archive stored in catalogue.json.  
-This catalogue has a list of all the files archived in this run 
-and on which disc they are stored.  
-The same catalogue is written to each disc in the archive series."""
-        readme_bytes = readme.encode("utf-8")
-        iso.add_fp(
-            BytesIO(readme_bytes),
-            len(readme_bytes),
-            "/README.MKD;1",
-            udf_path="/readme.mkd",
-        )
-        iso.add_file(
-            str(DB_FILENAME),
-            f"/{DB_FILENAME.upper()};1",
-            udf_path=f"/{DB_FILENAME}"  # Same catalogue for each disc
-            # So that you can go to single disc and then find where to go next - which disc to read rather than
-            # having to read all the files.
-        )
-        di = DiscInfo()
-        di.setup(disc_num, set_size)
-        disk_info_bytes = di.get_json().encode("utf-8")
-        iso.add_fp(
-            BytesIO(disk_info_bytes),
-            len(disk_info_bytes),
-            f"/{DISC_INFO_FILENAME.upper()};1",
-            udf_path=f"/{DISC_INFO_FILENAME}",
-        )
-        dir_count = 0
-        for this_dir in self.hash_db.entries.dir_entries(disc_num=disc_num):
-            # Todo add Bridge format and iso9660
-            # iso.add_directory(iso9660_dir(this_dir), udf_path=this_dir)
-            # After 10^8 directories (which breaks a standard ISO 9660 the formatting will vary
-            if this_dir == "/DATA":
-                iso.add_directory(
-                    "/DATA", udf_path="/DATA"
-                )  # Add root data directory to both ISO and UDF
-            else:
-                iso.add_directory(
-                    f"/DATA/{dir_count:08}", udf_path=this_dir
-                )  # Note can't use "/" as ISO 9660 root as we are adding
-                # a directory and this would only be the root
-            dir_count += 1
+        for name, content in self._root_files(disc_num).items():
+            if isinstance(content, bytes):
+                iso.add_fp(BytesIO(content), len(content), f"/{name.upper()};1", udf_path=f"/{name}")
+            elif isinstance(content, PackFile):  # Streamed from the small files
+                iso.add_fp(content, content.size, f"/{name.upper()};1", udf_path=f"/{name}")
+            else:  # Already saved to a file
+                iso.add_file(content, f"/{name.upper()};1", udf_path=f"/{name}")
         any_files = False
-        file_count = 0
-        for this_file in self.hash_db.files(disc_num=disc_num):
-            # Todo add Bridge format and iso9660
-            # iso.add_file(
-            #     str(this_file.filename),
-            #     this_file.iso9660_path,
-            #     udf_path=str(this_file.udf_absolute_path),
-            # )
-            iso.add_file(
-                str(this_file.file_system_path),
-                f"/DATA/{file_count:08}",  # All data files in same directory and anonymise names :(
-                udf_path=str(this_file.udf_absolute_path),
-            )
-            any_files = True
-            file_count += 1
+        for source, size, iso_path, udf_path in self._data_contents(disc_num):
+            if source is None:
+                iso.add_directory(iso_path, udf_path=udf_path)
+            elif isinstance(source, FileSlice):
+                iso.add_fp(source, size, iso_path, udf_path=udf_path)
+                any_files = True
+            else:
+                iso.add_file(source, iso_path, udf_path=udf_path)
+                any_files = True
+        for udf_path, link_path in self._links(disc_num):
+            iso.add_hard_link(udf_old_path=udf_path, udf_new_path=link_path)
+        return iso, any_files
+
+    def write_iso(self, pretend=False, disc_num=None, job_name="new", io_lock=None, copy_threads=None,
+                  direct_io=False):
+        """No ISO file will be created if there are not files in it.  Eg using a disc num that is
+        not being used.
+        :param io_lock: optional lock held while the image is written, which is when the source files are read
+        :param copy_threads: if given pycdlib only writes the metadata and the file data is copied by this many
+          threads, see extent_writer.py
+        :param direct_io: otherwise the image is written from a background thread, with O_DIRECT if direct_io, see
+          background_writer.py
+        If the archive was segmented with parity it is added to the end of the image, see parity.py.
+        :return: the filename of the ISO or None if it wasn't written"""
+        iso, any_files = self._build_iso(disc_num)
+        print(f'Disc num = |{disc_num}|')
+        filename = None
         if (
             not pretend and any_files
         ):  # Will not write out a cataloge with no files in it
@@ -371,8 +641,345 @@ The same catalogue is written to each disc in the archive series."""
                 os.remove(filename)
             except FileNotFoundError:
                 pass
-            iso.write(filename)
+            if io_lock is None:
+                self._write_image(iso, filename, copy_threads, direct_io)
+            else:
+                with io_lock:
+                    self._write_image(iso, filename, copy_threads, direct_io)
+            if getattr(self.hash_db, "parity", 0):
+                add_parity(filename, self.hash_db.parity)
+        iso.close()
+        return filename
+
+    @staticmethod
+    def _write_image(iso, filename, copy_threads, direct_io=False):
+        if copy_threads is None:
+            with BackgroundWriter(filename, direct=direct_io) as f:
+                iso.write_fp(f, blocksize=WRITE_BUFFER_SIZE)
+        else:
+            write_image(iso, filename, copy_threads)
+
+    def stream_iso(self, outfp, disc_num=None, buffer_size=STREAM_BUFFER_SIZE, io_lock=None, without_parity=False):
+        """Writes the ISO image of a disc to outfp, eg stdout, a named pipe or a socket, as it is mastered rather
+        than to a file first.  See stream.py.  The parity can't be added as it is worked out from the whole image.
+        :param io_lock: optional lock held while the image is written, as for write_iso
+        :param without_parity: stream the image of an archive segmented with parity anyway, otherwise that is an
+          error
+        :return: the ImageStream, which has the size and hash of the image, or None if there are no files"""
+        if getattr(self.hash_db, "parity", 0) and not without_parity:
+            raise odarchiveError(f"The discs have {self.hash_db.parity} of parity which can't be added to a "
+                                 f"streamed image, use write_iso or stream it without_parity")
+        iso, any_files = self._build_iso(disc_num)
+        try:
+            if not any_files:
+                return None
+            layout = self._image_layout(disc_num)
+            stream = ImageStream(outfp, layout.data_start(), layout.size(), buffer_size)
+            # Lay out the image now so the file data can be written in extent order
+            iso.force_consistency()
+            iso.inodes.sort(key=lambda ino: ino.extent_location())
+            if io_lock is None:
+                iso.write_fp(stream, blocksize=buffer_size)
+            else:
+                with io_lock:
+                    iso.write_fp(stream, blocksize=buffer_size)
+            stream.close()
+        finally:
             iso.close()
+        return stream
+
+    def master_iso(self, filename, disc_num=None, io_lock=None):
+        """Writes the ISO of a disc to filename, hashing it as it is written.  It is written under a temporary name
+        and only renamed once complete so a partly written image is never taken for a finished one.  Any parity is
+        added before it is renamed.
+        :return: the size and hash of the image"""
+        temp_filename = f"{filename}.part"
+        with BackgroundWriter(temp_filename) as f:
+            stream = self.stream_iso(f, disc_num, io_lock=io_lock, without_parity=True)  # Added below
+            f.fsync()
+        if stream is None:
+            os.remove(temp_filename)
+            raise odarchiveError(f"Disc {disc_num} has no files to write")
+        size = stream.size
+        if getattr(self.hash_db, "parity", 0):
+            size = add_parity(temp_filename, self.hash_db.parity, stream.hasher).size
+        os.replace(temp_filename, filename)
+        return size, stream.hexdigest()
+
+    def _check_ready_to_master(self):
+        if not self.is_segmented:
+            raise odarchiveError("Archive has not been segmented so use write_iso")
+        if self.guid is None or (not self.is_sharded and not os.path.isfile(DB_FILENAME)):
+            raise odarchiveError(f"Save the catalogue to {DB_FILENAME} before writing the ISOs")
+
+    def write_all_isos(self, job_name="new", processes=None, max_io=2, checkpoint=CHECKPOINT_FILENAME,
+                       verify=False):
+        """Writes the ISO of every disc of a segmented archive, several at a time in worker processes.
+        The disc index gives the discs to write and each worker loads just the entries of its disc from the
+        checkpoint, which is saved first, rather than every disc scanning every entry.  Building an image only
+        touches the catalogue so all the workers do that at once but only max_io of them write their image, and
+        so read their source files, at the same time.  The largest discs are started first.
+
+        Progress is kept in the job journal, job_name + JOURNAL_SUFFIX, so if it is run again the discs that are
+        already complete are skipped, see journal.py.
+        :param processes: number of worker processes, defaults to the number of CPUs
+        :param max_io: most images written at once so that the source disk isn't thrashed
+        :param verify: hash the images of complete discs again before skipping them rather than only checking
+          their size
+        :return: list of the ISO filenames of every disc in disc order"""
+        self._check_ready_to_master()
+        disc_bytes = {disc_num: self.hash_db.disc_totals(disc_num).size
+                      for disc_num in self.hash_db.entries.disc_nums() if disc_num is not None}
+        filenames = {disc_num: f"{job_name}_{disc_num:04}.iso" for disc_num in disc_bytes}
+        contents_hashes = {disc_num: self.disc_contents_hash(disc_num) for disc_num in disc_bytes}
+        journal = Journal(f"{job_name}{JOURNAL_SUFFIX}")
+        complete = {disc_num: journal.is_complete(disc_num, contents_hashes[disc_num], verify)
+                    for disc_num in disc_bytes}  # Once each as with verify it reads every image
+        incomplete = [disc_num for disc_num in sorted(disc_bytes) if not complete[disc_num]]
+        if not incomplete:
+            print(f"All {len(disc_bytes)} discs are already complete")
+            return [filenames[disc_num] for disc_num in sorted(disc_bytes)]
+        if incomplete[0] > 0:
+            print(f"Resuming from disc {incomplete[0]}")
+        to_write = sorted(incomplete, key=lambda disc_num: -disc_bytes[disc_num])
+        self.save_checkpoint(checkpoint)
+        io_lock = multiprocessing.Semaphore(max(1, max_io))
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_mastering_worker,
+                                 initargs=(io_lock,)) as executor:
+            futures = {}
+            for disc_num in to_write:
+                journal.record(disc_num, contents_hashes[disc_num], filenames[disc_num])
+                futures[executor.submit(_master_disc, checkpoint, disc_num, filenames[disc_num])] = disc_num
+            for future in as_completed(futures):
+                disc_num = futures[future]
+                size, image_hash = future.result()  # Raises any error from the worker
+                journal.record(disc_num, contents_hashes[disc_num], filenames[disc_num], size, image_hash,
+                               complete=True)
+        return [filenames[disc_num] for disc_num in sorted(disc_bytes)]
+
+    def produce_isos(self, consume, budget, job_name="new"):
+        """Masters the discs of a segmented archive in order, each while the one before is consumed, keeping the
+        images on disk within budget bytes, see production.py.  Progress is kept in the job journal as for
+        write_all_isos.
+        :param consume: called with the disc num and filename of each image in turn, returns True if it succeeded
+          and the image can be deleted
+        :return: the disc nums consumed"""
+        self._check_ready_to_master()
+        discs = [(disc_num, f"{job_name}_{disc_num:04}.iso", self.image_size(disc_num),
+                  self.disc_contents_hash(disc_num))
+                 for disc_num in sorted(self.hash_db.entries.disc_nums() - {None})]
+        return produce_images(discs, lambda disc_num, filename: self.master_iso(filename, disc_num), consume,
+                              budget, Journal(f"{job_name}{JOURNAL_SUFFIX}"))
+
+    def disc_contents_hash(self, disc_num):
+        """Hash of what is planned to go on a disc.  This changes if the archive is segmented or saved again."""
+        hasher = HASH_FUNCTION()
+        hasher.update(f"{self.guid} {self.catalogue_mode} {disc_num} of {self._set_size}\n".encode("utf-8"))
+        for entry in self.hash_db.files(disc_num):
+            hasher.update(entry.to_json_entry().encode("utf-8"))
+        return hasher.hexdigest()
+
+    @property
+    def _set_size(self):
+        if self.last_disc_num is None:  # Has not been segmented
+            return 1
+        else:
+            return self.last_disc_num
+
+    def _readme_bytes(self):
+        """The readme file is created fresh for each disc created.  It should consist of specific information about
+        this disc and also information about the archive process"""
+        if self.is_sharded:
+            catalogue_description = f"""There is a catalogue of the files on this disc stored in {DB_FILENAME}.
+There is an index of all the discs in the archive series stored in
+{INDEX_FILENAME}.  This has the disc number each file (by hash prefix)
+and each directory is stored on."""
+        else:
+            catalogue_description = f"""There is a catalogue of this archive stored in {DB_FILENAME}.  
+This catalogue has a list of all the files archived in this run 
+and on which disc they are stored.  
+The same catalogue is written to each disc in the archive series."""
+        readme = f"""# Archive File created by www.drummonds.net
+This archive was created {dt.datetime.now().strftime('%Y-%m-%dT%H:%M:%S')}
+
+The data for this archive is stored in the directory /DATA.
+{catalogue_description}"""
+        return readme.encode("utf-8")
+
+    def _root_files(self, disc_num):
+        """The files in the root of a disc as a dictionary of UDF name to either their contents, the file they
+        have been saved to or the PackFile of the small files packed on the disc."""
+        result = {README_FILENAME: self._readme_bytes()}
+        if self.is_sharded:
+            # Catalogue of just this disc and an index so that you can go from a single disc and then find
+            # where to go next.
+            result[DB_FILENAME] = self.catalogue_json(disc_num).encode("utf-8")
+            result[INDEX_FILENAME] = str(INDEX_FILENAME)  # Same index for each disc, see save_index
+        else:
+            # Same catalogue for each disc so that you can go to single disc and then find where to go next - which
+            # disc to read rather than having to read all the files.
+            result[DB_FILENAME] = str(DB_FILENAME)
+        di = DiscInfo()
+        di.setup(disc_num, self._set_size)
+        result[DISC_INFO_FILENAME] = di.get_json().encode("utf-8")
+        if getattr(self.hash_db, "manifest", False):
+            result[HASH_FILENAME] = self.manifest(disc_num).encode("utf-8")
+        packed = self.hash_db.packed_files(disc_num)
+        if packed:
+            result[PACK_FILENAME] = PackFile([(str(entry.file_system_path), entry.size) for entry in packed])
+        return result
+
+    def _data_contents(self, disc_num):
+        """Yields (source, size, iso_path, udf_path) for each directory and file in the data directory of a disc in
+        the order they are added to the image.  source and size are None for a directory and udf_path is None for
+        the ISO 9660 bucket directories of the fan-out, see iso_names.FanOut.  source is a filename or, for a part
+        of a split file, a FileSlice.  Packed files are in the container in the root instead."""
+        data_dir = str(self.iso_path_root)
+        dirs = list(self.hash_db.entries.dir_entries(disc_num=disc_num))
+        unpacked = [(this_file, part) for this_file, part in self.hash_db.units(disc_num=disc_num)
+                    if not this_file.is_packed]
+        # The ISO 9660 names are anonymous, each directory and file is numbered and fanned out into buckets
+        dir_fan_out = FanOut(data_dir, "D", len(dirs))
+        for dir_count, this_dir in enumerate(dirs):
+            if this_dir == data_dir:
+                yield None, None, data_dir, data_dir  # Add root data directory to both ISO and UDF
+            else:
+                # Note can't use "/" as ISO 9660 root as we are adding a directory and this would only be the root
+                buckets, iso_path = dir_fan_out.place(dir_count)
+                for bucket in buckets:
+                    yield None, None, bucket, None
+                yield None, None, iso_path, this_dir
+        file_fan_out = FanOut(data_dir, "F", len(unpacked))
+        for file_count, (this_file, part) in enumerate(unpacked):
+            buckets, iso_path = file_fan_out.place(file_count)
+            for bucket in buckets:
+                yield None, None, bucket, None
+            if part is None:
+                yield str(this_file.file_system_path), this_file.size, iso_path, str(this_file.udf_absolute_path)
+            else:  # Streamed straight from the original file
+                yield (
+                    FileSlice(str(this_file.file_system_path), part.offset, part.size),
+                    part.size,
+                    iso_path,
+                    str(this_file.part_udf_path(part)),
+                )
+
+    def _links(self, disc_num):
+        """Yields (udf_path, link_path) for each duplicate of a file on a disc, which is added as a UDF hard link
+        to the stored file so the disc has every path without storing the data again.  Packed files only have
+        their first path in the catalogue."""
+        for entry, part in self.hash_db.units(disc_num=disc_num):
+            if entry.is_packed:
+                continue
+            if part is None:
+                udf_path = str(entry.udf_absolute_path)
+                link_paths = entry.link_paths()
+            else:
+                udf_path = str(entry.part_udf_path(part))
+                link_paths = entry.link_paths(part.part_num)
+            for link_path in link_paths:
+                yield udf_path, str(link_path)
+
+    def manifest(self, disc_num=None):
+        """The SHA512SUM manifest of the files in the data directory of a disc, see manifest.py"""
+        lines = []
+        for entry, part in self.hash_db.units(disc_num=disc_num):
+            if part is not None:
+                lines.append(manifest_line(part.file_hash, entry.part_udf_path(part)))
+            elif not entry.is_packed:
+                lines.append(manifest_line(entry.file_hash, entry.udf_absolute_path))
+        return "".join(lines)
+
+    def _file_checks(self, disc_num):
+        """A FileCheck for each file, part of a split file and packed file on a disc"""
+        for entry, part in self.hash_db.units(disc_num=disc_num):
+            if part is not None:
+                yield FileCheck(f"{entry.filename} part {part.part_num}", entry.part_udf_path(part), part.file_hash,
+                                part.size)
+            elif entry.is_packed:
+                yield FileCheck(str(entry.filename), f"/{PACK_FILENAME}", entry.file_hash, entry.size,
+                                entry.pack_offset)
+            else:
+                yield FileCheck(str(entry.filename), entry.udf_absolute_path, entry.file_hash, entry.size)
+
+    def verify_iso(self, filename, disc_num=None, threads=None):
+        """Checks a written ISO image against the catalogue.  Every file on the disc is read back in extent order
+        and hashed, and the SHA512SUM manifest on the disc checked if it has one, see verify.py.
+        :param threads: number of hashing threads, defaults to the number of CPUs
+        :return: VerifyReport, whose passed is True if the image is good"""
+        manifest = self.manifest(disc_num) if getattr(self.hash_db, "manifest", False) else None
+        return verify_image(filename, self._file_checks(disc_num), manifest, disc_num, threads)
+
+    def scrub(self, images, workers=SCRUB_WORKERS, sample_bytes=SAMPLE_BYTES):
+        """Reads all of each ISO image or disc and checks every file on it against the catalogue, several images at
+        once, see scrub.py.  The disc of each image is read from the image if the archive is segmented.
+        :param images: ISO images, block devices of discs or the directories discs are mounted on
+        :param workers: images scrubbed at once, each on its own device
+        :param sample_bytes: bytes read between throughput samples
+        :return: list of ScrubReport in the order of images"""
+
+        def scrub_one(image):
+            disc_num = None
+            if self.is_segmented:
+                try:
+                    with Disc(image) as disc:
+                        disc_num = disc.disc_num
+                except Exception as e:  # Still read it all for the unreadable sectors and the throughput
+                    report = scrub_image(image, [], None, sample_bytes)
+                    report.errors.insert(0, f"can't tell which disc it is: {e}")
+                    return report
+            return scrub_image(image, self._file_checks(disc_num), disc_num, sample_bytes)
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            return list(executor.map(scrub_one, images))
+
+    def image_size(self, disc_num=None):
+        """The exact size in bytes of the ISO image that write_iso creates for a disc, with its parity if any"""
+        size = self._image_layout(disc_num).size()
+        return size + parity_size(size, getattr(self.hash_db, "parity", 0))
+
+    def _image_layout(self, disc_num):
+        layout = ImageLayout()
+        for name, content in self._root_files(disc_num).items():
+            if isinstance(content, bytes):
+                size = len(content)
+            elif isinstance(content, PackFile):
+                size = content.size
+            else:
+                size = os.path.getsize(content)
+            layout.add_file(size, f"/{name.upper()};1", f"/{name}")
+        for source, size, iso_path, udf_path in self._data_contents(disc_num):
+            if source is None:
+                layout.add_directory(iso_path, udf_path)
+            else:
+                layout.add_file(size, iso_path, udf_path)
+        for udf_path, link_path in self._links(disc_num):
+            layout.add_hard_link(link_path)
+        return layout
+
+    def restore(self, discs, destination, paths=None, threads=RESTORE_THREADS, reflink=False):
+        """Restores every file whose data is on the given discs to under destination, keeping its path relative
+        to the data directory.  A split file is only restored if all the discs with its parts are given.  Each disc
+        is read once, see BulkRestore in restore.py.
+        :param discs: dictionary of disc number to either an ISO image or the directory a disc is mounted on
+        :param paths: only restore these paths relative to the data directory, directories or glob patterns
+        :param threads: writer threads
+        :param reflink: recreate duplicates as reflinks rather than hard links
+        :return: list of the files restored
+        """
+        return self.restore_plan(discs, destination, paths, threads, reflink).run()
+
+    def restore_plan(self, discs, destination, paths=None, threads=RESTORE_THREADS, reflink=False):
+        """The BulkRestore of restore, which gives the discs needed before anything is restored"""
+        destination = Path(destination)
+        selection = []
+        for entry in self.hash_db.files():
+            relative = [PurePosixPath(filename).relative_to(self.iso_path_root) for filename in entry.filenames]
+            if paths is not None:
+                relative = [path for path in relative if _selected(path, paths)]
+            if relative:
+                selection.append((entry, [destination / path for path in relative]))
+        return BulkRestore(selection, discs, threads, reflink)
 
     @property
     def is_locked(self):
@@ -383,16 +990,69 @@ The same catalogue is written to each disc in the archive series."""
         except AttributeError:  # NO hash db so not segmented
             return False
 
-    def segment(self, size):
-        """Segment an archive.  This is mainly"""
+    def segment(self, size, sharded=None, strategy=NEXT_FIT, balanced=False, pack_threshold=None, manifest=None,
+                parity=None, verbose=False):
+        """Segment an archive.  This is mainly
+        :param sharded: if True each disc will carry a catalogue of just its own files and a global index
+          rather than the full catalogue.  If None the current catalogue mode is kept.
+        :param strategy: how files are packed onto discs, one of SEGMENT_STRATEGIES.  next-fit keeps files in
+          catalogue order, first-fit and best-fit use fewer discs.
+        :param balanced: evenly fill the discs after packing
+        :param pack_threshold: files smaller than this many bytes are packed into a container on each disc, 0 to
+          not pack.  If None the current threshold is kept.
+        :param manifest: if True each disc has a SHA512SUM manifest of its files, see manifest.py.  If None it is
+          kept as it is.
+        :param parity: fraction of each disc to keep for Reed-Solomon parity, 0 for none, see parity.py.  If None it
+          is kept as it is.
+        :param verbose: print each file that is split over discs"""
         if not self.is_locked:
-            catalogue_size = (
-                (2048 + lstat(str(str(DB_FILENAME))).st_size) // 2048
-            ) * 2048  # Account for sector size
-            self.hash_db.segment(size, catalogue_size)
+            if manifest is not None:
+                self.hash_db.manifest = manifest
+            if parity is not None:
+                if parity:
+                    parity_rows(parity)  # Check it before segmenting
+                self.hash_db.parity = parity
+            if sharded is not None:
+                self.catalogue_mode = CATALOGUE_SHARDED if sharded else CATALOGUE_FULL
+            if pack_threshold is not None:  # Before reserving the catalogue as packed entries are larger
+                self.hash_db.pack_threshold = pack_threshold
+            self.hash_db.segment(size, self.reserved_catalogue_size(), sharded=self.is_sharded, strategy=strategy,
+                                 balanced=balanced, verbose=verbose)
         else:
             raise odarchiveError('Archive is locked so cannot resegment')
 
+    def reserved_catalogue_size(self):
+        """Bytes to reserve on every disc for the catalogue, or if sharded the index and catalogue header, when
+        segmenting in the current catalogue mode"""
+        reserved = self.estimate_catalogue_size()
+        if self.is_sharded:
+            reserved += estimate_index_size(self.hash_db)
+        return ((2048 + reserved) // 2048) * 2048  # Account for sector size
+
+    def plan(self, sizes=DISC_SIZES):
+        """Returns a DiscPlan, how many discs are needed and how full they are, for each disc size without
+        segmenting the archive"""
+        planner = DiscPlanner(self.hash_db, self.reserved_catalogue_size(), self.is_sharded)
+        return [planner.plan(size) for size in sizes]
+
+    def segment_new_files(self, strategy=None, balanced=False, verbose=False):
+        """Places the files added by add_new_files onto new discs after the last disc without moving any other file,
+        so discs that have been written stay valid.  The space reserved for the catalogue is grown by an estimate of
+        the new entries rather than worked out again from every entry.  In a sharded archive a new path for a file
+        that is already on a written disc is only in the full catalogue as the shard with it has been written.
+        :param verbose: print each file that is split over discs
+        :return: range of the new disc numbers"""
+        if not self.is_segmented:
+            raise odarchiveError('Archive has not been segmented so segment it instead')
+        pending = self.hash_db.pending_entries()
+        if self.is_sharded:
+            growth = estimate_index_growth(pending)
+        else:
+            num_entries = len(self.hash_db.entries)
+            growth = sum(entry.catalogue_size(num_entries, self.hash_db.will_pack(entry)) for entry in pending)
+        catalogue_size = ((self.hash_db.catalogue_size + growth + 2047) // 2048) * 2048  # Whole sectors
+        return self.hash_db.segment_new_files(catalogue_size, strategy=strategy, balanced=balanced, verbose=verbose)
+
     @property
     def is_segmented(self):
         try:
@@ -0,0 +1,199 @@
+"""
+A file object for mastering an image that does the writing in a background thread.
+
+pycdlib masters an image by writing to a file object from the same thread that reads the source files, so the
+disc image's disk is idle while the next data is read and the reading stops while each write blocks.
+BackgroundWriter copies what it is given into one of a ring of preallocated buffers and hands each full buffer to
+a writer thread, so the next buffer is filled while earlier ones are written.  When every buffer is waiting to be
+written, write blocks until one is free, which bounds the memory used.
+
+Writes that carry on from where the last one ended fill the same buffer.  A seek elsewhere, as pycdlib does for the
+metadata, sends the buffer so far and starts a new one there.  Buffers are written in the order they are sent, with
+os.pwrite at their offset, so a later write to the same place wins as it would writing straight to the file.
+
+With direct the buffers that start and end on a DIRECT_ALIGNMENT boundary are written with O_DIRECT, bypassing the
+page cache, which suits an image that is larger than memory and won't be read again soon.  Buffers are mmap'd so
+their memory is page aligned and a buffer that starts off a boundary is cut short at the next one so the buffers
+after it are aligned.  Anything else, and everything if the file system doesn't support O_DIRECT, is written
+through the page cache.
+
+The time the writer thread spends writing and the time write spends waiting for a free buffer are kept, the
+difference is how much writing was overlapped with preparing the data.
+"""
+import errno
+import mmap
+import os
+import queue
+import threading
+import time
+
+from .consts import *
+
+WRITE_BUFFER_SIZE = 4 * 1024 * 1024  # Bytes, a multiple of DIRECT_ALIGNMENT
+WRITE_BUFFERS = 4
+DIRECT_ALIGNMENT = 4096
+
+
+class BackgroundWriter:
+    """A write only file object for pycdlib's write_fp that writes to filename from a background thread"""
+
+    mode = "wb"  # pycdlib checks for a binary file object
+
+    def __init__(self, filename, direct=False, buffer_size=WRITE_BUFFER_SIZE, num_buffers=WRITE_BUFFERS):
+        """
+        :param direct: write aligned buffers with O_DIRECT if the file system supports it
+        :param num_buffers: buffers in the ring, at least 2 so one can be filled while another is written
+        """
+        if buffer_size <= 0 or buffer_size % DIRECT_ALIGNMENT:
+            raise odarchiveError(f"Write buffer size {buffer_size:,} must be a whole number of {DIRECT_ALIGNMENT} "
+                                 f"byte blocks")
+        if num_buffers < 2:
+            raise odarchiveError("BackgroundWriter needs at least two buffers")
+        self.name = str(filename)
+        self.fd = os.open(self.name, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+        self.direct_fd = self._open_direct() if direct else None
+        self.buffers = [mmap.mmap(-1, buffer_size) for _ in range(num_buffers)]
+        self.free = queue.Queue()
+        for index in range(num_buffers):
+            self.free.put(index)
+        self.pending = queue.Queue()
+        self.current = None  # Index of the buffer being filled
+        self.start = 0  # Offset in the file of the current buffer
+        self.filled = 0
+        self.limit = 0  # Bytes that go in the current buffer
+        self.position = 0
+        self.end = 0
+        self.error = None  # Raised from the writer thread
+        self.write_time = 0.0  # Seconds the writer thread spent writing
+        self.wait_time = 0.0  # Seconds write spent waiting for a free buffer
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _open_direct(self):
+        if not hasattr(os, "O_DIRECT"):
+            return None
+        try:
+            return os.open(self.name, os.O_WRONLY | os.O_DIRECT)
+        except OSError as e:
+            if e.errno in (errno.EINVAL, errno.EOPNOTSUPP):  # eg tmpfs
+                return None
+            raise
+
+    def seek(self, position, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            position += self.position
+        elif whence == os.SEEK_END:
+            position += self.end
+        self.position = position
+        return position
+
+    def tell(self):
+        return self.position
+
+    def write(self, data):
+        self._check()
+        view = memoryview(data).cast("B")
+        length = len(view)
+        while len(view):
+            if self.current is None or self.position != self.start + self.filled or self.filled == self.limit:
+                self._send()
+                self._new_buffer()
+            count = min(self.limit - self.filled, len(view))
+            self.buffers[self.current][self.filled:self.filled + count] = view[:count]
+            self.filled += count
+            self.position += count
+            view = view[count:]
+        self.end = max(self.end, self.position)
+        return length
+
+    def _new_buffer(self):
+        waited = time.perf_counter()
+        self.current = self.free.get()
+        self.wait_time += time.perf_counter() - waited
+        self.start = self.position
+        self.filled = 0
+        self.limit = len(self.buffers[self.current]) - self.start % DIRECT_ALIGNMENT
+
+    def _send(self):
+        if self.current is not None:
+            if self.filled:
+                self.pending.put((self.current, self.start, self.filled))
+            else:
+                self.free.put(self.current)
+            self.current = None
+
+    def _run(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                self.pending.task_done()
+                return
+            index, start, length = item
+            try:
+                if self.error is None:
+                    started = time.perf_counter()
+                    self._pwrite(memoryview(self.buffers[index])[:length], start)
+                    self.write_time += time.perf_counter() - started
+            except Exception as e:
+                self.error = e
+            finally:
+                self.free.put(index)
+                self.pending.task_done()
+
+    def _pwrite(self, view, offset):
+        fd = self.fd
+        if self.direct_fd is not None and offset % DIRECT_ALIGNMENT == 0 and len(view) % DIRECT_ALIGNMENT == 0:
+            fd = self.direct_fd
+        while len(view):
+            try:
+                written = os.pwrite(fd, view, offset)
+            except OSError as e:
+                if fd != self.direct_fd or e.errno != errno.EINVAL:
+                    raise
+                os.close(self.direct_fd)  # Alignment the device doesn't accept, so stop using O_DIRECT
+                self.direct_fd = None
+                fd = self.fd
+                continue
+            view = view[written:]
+            offset += written
+
+    def _check(self):
+        if self.closed:
+            raise ValueError(f"write to closed file {self.name}")
+        if self.error is not None:
+            raise self.error
+
+    def flush(self):
+        """Waits until everything written so far is in the file"""
+        self._check()
+        self._send()
+        self.pending.join()
+        self._check()
+
+    def fsync(self):
+        """Waits until everything written so far is on the disk"""
+        self.flush()
+        os.fsync(self.fd)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self._send()
+            self.pending.put(None)
+            self.thread.join()
+            if self.error is not None:
+                raise self.error
+        finally:
+            self.closed = True
+            for fd in (self.fd, self.direct_fd):
+                if fd is not None:
+                    os.close(fd)
+            self.buffers = []  # Freed once nothing has a view of them, which an exception from the thread may
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
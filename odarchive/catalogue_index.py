@@ -0,0 +1,110 @@
+"""
+A compact global index of a sharded archive.
+
+When an archive is written with sharded catalogues each disc only carries the catalogue of its own files.  The
+index is written to every disc as well so that from any single disc you can find out which disc to read next:
+
+- hash prefixes, the first INDEX_HASH_PREFIX_LENGTH characters of each file hash, grouped by disc
+- directories, mapped to the list of discs that have files in them
+"""
+import json
+from pathlib import PurePosixPath
+
+from .consts import *
+
+
+def load_index_from_json(filename=None, json_data=None):
+    """Load an index.json file eg from a written disc.
+    If filename is none, can load the json directly.  Note the filename takes precedence over json_data"""
+    if filename:
+        with open(filename, encoding="utf-8") as json_data_from_file:
+            d = json.load(json_data_from_file)
+    else:
+        d = json.loads(json_data)
+    if int(d['index_version']) != INDEX_VERSION:
+        raise odarchiveError(f"Version of index ({d['index_version']}) does not match that of software "
+                             f"({INDEX_VERSION}).")
+    index = CatalogueIndex()
+    index.job_id = d['job_id']
+    index.num_discs = int(d['num_discs'])
+    index.hash_prefix_length = int(d['hash_prefix_length'])
+    for disc_num, prefixes in d['hashes'].items():
+        for i in range(0, len(prefixes), index.hash_prefix_length):
+            index.hashes[prefixes[i:i + index.hash_prefix_length]] = int(disc_num)
+    index.dirs = {this_dir: set(disc_nums) for this_dir, disc_nums in d['dirs'].items()}
+    return index
+
+
+def estimate_index_size(hash_db):
+    """Upper estimate of the size of the index in bytes before an archive has been segmented"""
+    size = 1000  # Header
+    dirs = set()
+    for entry in hash_db.files():
+        size += INDEX_HASH_PREFIX_LENGTH
+        for filename in entry.filenames:
+            dirs.add(str(PurePosixPath(filename).parent))
+    # Allow for each directory being spread over a few discs
+    size += sum(len(this_dir.encode("utf-8")) + 30 for this_dir in dirs)
+    return size
+
+
+def estimate_index_growth(entries):
+    """Upper estimate of how much the index grows when entries are added to a segmented archive.  Each directory
+    they are in is counted as if it was new."""
+    size = 0
+    for entry in entries:
+        size += INDEX_HASH_PREFIX_LENGTH
+        for filename in entry.filenames:
+            size += len(str(PurePosixPath(filename).parent).encode("utf-8")) + 30
+    return size
+
+
+class CatalogueIndex:
+    """Maps hash prefixes and directories to disc numbers"""
+
+    def __init__(self):
+        self.job_id = None
+        self.num_discs = 0
+        self.hash_prefix_length = INDEX_HASH_PREFIX_LENGTH
+        self.hashes = {}  # hash prefix -> disc_num
+        self.dirs = {}  # directory -> set of disc_num
+
+    @classmethod
+    def create(cls, hash_db, job_id):
+        """Build from a segmented hash database"""
+        index = cls()
+        index.job_id = str(job_id)
+        index.num_discs = hash_db.last_disc_number + 1
+        for entry in hash_db.files():
+            # A split file is found by the disc with its first part, the catalogue on it has the rest
+            index.hashes[entry.file_hash[:index.hash_prefix_length]] = entry.disc_num
+            for filename in entry.filenames:
+                index.dirs.setdefault(str(PurePosixPath(filename).parent), set()).update(entry.disc_nums)
+        return index
+
+    def disc_for_hash(self, file_hash):
+        """Returns the disc a file is stored on or None if it is not in this archive"""
+        return self.hashes.get(file_hash[:self.hash_prefix_length])
+
+    def discs_for_path(self, path):
+        """Returns the sorted discs that have files in the directory path or any of its sub directories"""
+        path = str(path).rstrip("/")
+        result = set()
+        for this_dir, disc_nums in self.dirs.items():
+            if this_dir == path or this_dir.startswith(path + "/"):
+                result |= disc_nums
+        return sorted(result)
+
+    def to_json(self):
+        by_disc = {}
+        for prefix, disc_num in self.hashes.items():
+            by_disc.setdefault(disc_num, []).append(prefix)
+        data = {
+            "index_version": INDEX_VERSION,
+            "job_id": self.job_id,
+            "num_discs": self.num_discs,
+            "hash_prefix_length": self.hash_prefix_length,
+            "hashes": {str(disc_num): "".join(prefixes) for disc_num, prefixes in sorted(by_disc.items())},
+            "dirs": {this_dir: sorted(disc_nums) for this_dir, disc_nums in sorted(self.dirs.items())},
+        }
+        return json.dumps(data, ensure_ascii=False)
@@ -0,0 +1,145 @@
+"""
+A checkpoint is a compact, versioned store of the working state of an archive between command line
+invocations eg between segment and write_iso.
+
+It replaces pickling the whole Archiver with dill.  Only the columns needed to rebuild the hash
+database are kept (hash, size, mtime, disc_num, filenames and pack offset) in an SQLite file, so:
+
+- it does not depend on the in memory object graph and so survives software upgrades,
+- it can be loaded for a single disc without reading every entry (there is an index on disc_num).
+
+The parts of files split over several discs are in their own table, also indexed on disc_num.
+
+The archiver level fields are stored as JSON values in a meta table.
+"""
+import json
+import os
+import sqlite3
+
+from .consts import *
+from .file_parts import FilePart
+
+FILENAME_SEPARATOR = "\0"  # Can't appear in a file name
+
+
+def write_checkpoint(filename, meta, rows):
+    """Write a checkpoint.
+    :param filename: checkpoint file, this is replaced atomically
+    :param meta: dictionary of json serialisable archiver fields
+    :param rows: iterable of (file_hash, size, mtime, disc_num, filenames, parts, pack_offset) tuples, parts is
+      None or a list of FilePart and pack_offset is None unless the file is packed into a container
+    """
+    temp_filename = f"{filename}.tmp"
+    try:
+        os.remove(temp_filename)
+    except FileNotFoundError:
+        pass
+    con = sqlite3.connect(temp_filename)
+    try:
+        con.execute("PRAGMA journal_mode = OFF")  # Written once to a temporary file so no need for journal
+        con.execute("PRAGMA synchronous = OFF")
+        con.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        con.execute(
+            "CREATE TABLE entries (id INTEGER PRIMARY KEY, file_hash BLOB, size INTEGER, mtime REAL, "
+            "disc_num INTEGER, filenames TEXT, pack_offset INTEGER)"
+        )
+        con.execute(
+            "CREATE TABLE parts (entry_id INTEGER, part_num INTEGER, offset INTEGER, size INTEGER, "
+            "file_hash BLOB, disc_num INTEGER, PRIMARY KEY (entry_id, part_num))"
+        )
+        meta = dict(meta)
+        meta["checkpoint_version"] = CHECKPOINT_VERSION
+        con.executemany(
+            "INSERT INTO meta VALUES (?, ?)",
+            ((key, json.dumps(value)) for key, value in meta.items()),
+        )
+        parts = []
+        con.executemany(
+            "INSERT INTO entries (id, file_hash, size, mtime, disc_num, filenames, pack_offset) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            _entry_rows(rows, parts),
+        )
+        con.executemany(
+            "INSERT INTO parts VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                (entry_id, part.part_num, part.offset, part.size, bytes.fromhex(part.file_hash), part.disc_num)
+                for entry_id, part in parts
+            ),
+        )
+        # Built after the inserts as that is much quicker than maintaining it during them
+        con.execute("CREATE INDEX entries_disc_num ON entries (disc_num)")
+        con.execute("CREATE INDEX parts_disc_num ON parts (disc_num)")
+        con.commit()
+    finally:
+        con.close()
+    os.replace(temp_filename, filename)
+
+
+def _entry_rows(rows, parts):
+    """Numbers the entries and collects their parts to be inserted afterwards"""
+    for entry_id, (file_hash, size, mtime, disc_num, filenames, entry_parts, pack_offset) in enumerate(rows, 1):
+        if entry_parts:
+            parts.extend((entry_id, part) for part in entry_parts)
+        yield (entry_id, bytes.fromhex(file_hash), size, mtime, disc_num, FILENAME_SEPARATOR.join(filenames),
+               pack_offset)
+
+
+class Checkpoint:
+    """Read access to a checkpoint file.  Entries are only read when iterated over."""
+
+    def __init__(self, filename):
+        if not os.path.isfile(filename):
+            raise odarchiveError(f"Checkpoint {filename} not found")
+        self.filename = filename
+        self.con = sqlite3.connect(filename)
+        try:
+            self.meta = {key: json.loads(value) for key, value in self.con.execute("SELECT key, value FROM meta")}
+        except sqlite3.DatabaseError:
+            self.con.close()
+            raise odarchiveError(f"{filename} is not an odarchive checkpoint")
+        version = self.meta.get("checkpoint_version")
+        if version != CHECKPOINT_VERSION:
+            self.con.close()
+            raise odarchiveError(
+                f"Version of checkpoint ({version}) does not match that of software ({CHECKPOINT_VERSION})."
+            )
+
+    def rows(self, disc_num=None):
+        """Yields (file_hash, size, mtime, disc_num, filenames, parts, pack_offset) in the order they were saved.
+        If disc_num is given only the entries on that disc, including split files with a part on it, are read."""
+        if disc_num is None:
+            cursor = self.con.execute(
+                "SELECT id, file_hash, size, mtime, disc_num, filenames, pack_offset FROM entries ORDER BY id"
+            )
+            parts_cursor = self.con.execute(
+                "SELECT entry_id, part_num, offset, size, file_hash, disc_num FROM parts ORDER BY entry_id, part_num"
+            )
+        else:
+            cursor = self.con.execute(
+                "SELECT id, file_hash, size, mtime, disc_num, filenames, pack_offset FROM entries "
+                "WHERE disc_num = ? OR id IN (SELECT entry_id FROM parts WHERE disc_num = ?) ORDER BY id",
+                (disc_num, disc_num),
+            )
+            parts_cursor = self.con.execute(
+                "SELECT entry_id, part_num, offset, size, file_hash, disc_num FROM parts WHERE entry_id IN "
+                "(SELECT entry_id FROM parts WHERE disc_num = ?) ORDER BY entry_id, part_num",
+                (disc_num,),
+            )
+        parts = {}
+        for entry_id, part_num, offset, size, file_hash, this_disc_num in parts_cursor:
+            parts.setdefault(entry_id, []).append(FilePart(part_num, offset, size, file_hash.hex(), this_disc_num))
+        for entry_id, file_hash, size, mtime, this_disc_num, filenames, pack_offset in cursor:
+            yield (file_hash.hex(), size, mtime, this_disc_num, filenames.split(FILENAME_SEPARATOR),
+                   parts.get(entry_id), pack_offset)
+
+    def __len__(self):
+        return self.con.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def close(self):
+        self.con.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -1,7 +1,18 @@
 import click
 from pathlib import Path
+import socket
+import sys
 
-from .archive import Archiver, load_archiver_from_dill
+from .archive import Archiver, load_archiver_from_checkpoint, load_archiver_from_discs
+from .consts import CATALOGUE_FULL, CATALOGUE_SHARDED, DISC_SIZES, PACK_FILENAME, interpret_disc_capacity
+from .parity import repair_image
+from .path_index import DISC_IMAGE_PATTERN, get_file, PATH_INDEX_FILENAME
+from .planner import format_plan_table
+from .production import command_consumer
+from .restore import Disc, RESTORE_THREADS
+from .scrub import reports_json, SAMPLE_BYTES, SCRUB_WORKERS
+from .segmenter import NEXT_FIT, SEGMENT_STRATEGIES
+from .stream import STREAM_BUFFER_SIZE
 
 
 @click.group()
@@ -10,34 +21,265 @@ def cli():
 
 
 @click.command()
+@click.option("--priority", multiple=True,
+              help="Priority rule TIER:KIND:VALUE, KIND is path, ext, newer or older eg 0:path:Photos/*")
+@click.option("--max_tier", default=None, type=int,
+              help="Only hash files up to this priority tier, add the rest later with add")
 @click.argument("usb_path")  # , help='Path to USB drive which is to be backed up')
-def init(usb_path):
+def init(priority, max_tier, usb_path):
     ar = Archiver()
+    ar.set_priority_rules(priority)
     ar.create_file_database(Path(usb_path))
-    ar.convert_to_hash_database()
+    ar.convert_to_hash_database(max_tier=max_tier)
     ar.save()  # Creates catalogue.json
     ar.print_files()
     ar.save()
+    ar.save_checkpoint()
 
 
 @click.command()
+@click.option("--sharded/--full", default=None,
+              help="Each disc carries a catalogue of only its own files plus a global index")
+@click.option("--strategy", default=NEXT_FIT, type=click.Choice(SEGMENT_STRATEGIES),
+              help="How files are packed onto discs")
+@click.option("--balance", is_flag=True, default=False, help="Evenly fill discs after packing")
+@click.option("--priority", multiple=True, help="Replace the priority rules, see init")
+@click.option("--pack", default=None, type=int,
+              help=f"Pack files smaller than this many bytes into {PACK_FILENAME} on each disc, 0 to not pack")
+@click.option("--manifest/--no_manifest", default=None,
+              help="Write a SHA512SUM manifest of the files on each disc, default as now")
+@click.option("--parity", default=None, type=float,
+              help="Fraction of each disc to keep for Reed-Solomon parity eg 0.05, 0 for none, default as now")
+@click.option("--verbose", is_flag=True, default=False, help="List each file split over discs")
 @click.argument("size")  # , help='Max size in Bytes for segment')
-def segment(size):
+def segment(sharded, strategy, balance, priority, pack, manifest, parity, verbose, size):
     """Converts an archive into a segmented archive."""
     # Todo if an archive is modified eg adding new files then will need to be resegmented
     # However size parameter can't change
-    ar = load_archiver_from_dill()
+    ar = load_archiver_from_checkpoint()
+    if priority:
+        ar.set_priority_rules(priority)
     ar.create_catalogue()
-    ar.segment(size)
+    ar.segment(size, sharded=sharded, strategy=strategy, balanced=balance, pack_threshold=pack, manifest=manifest,
+               parity=parity, verbose=verbose)
+    print(ar.get_info())
+    print(ar.hash_db.get_directory_info())
+    ar.save()
+    if ar.is_sharded:
+        ar.save_index()
+    ar.save_path_index()
+    ar.save_checkpoint()
 
 
 @click.command()
-@click.option("--pretend", default=False, help="Won't create database if --pretend")
-def write_iso(pretend):
-    ar = load_archiver_from_dill()
-    ar.print_files()
-    ar.write_iso(pretend)
+@click.option("--sharded/--full", default=None, help="Plan for sharded or full catalogues, default as now")
+@click.option("--pack", default=None, type=int, help="Plan for packing files smaller than this many bytes")
+@click.option("--parity", default=None, type=float, help="Plan for this fraction of each disc being parity")
+@click.argument("sizes", nargs=-1)
+def plan(sharded, pack, parity, sizes):
+    """Shows how many discs are needed for each disc size, by default all the named sizes, with next-fit."""
+    ar = load_archiver_from_checkpoint()
+    if sharded is not None:
+        ar.catalogue_mode = CATALOGUE_SHARDED if sharded else CATALOGUE_FULL
+    if pack is not None:
+        ar.hash_db.pack_threshold = pack
+    if parity is not None:
+        ar.hash_db.parity = parity
+    print(format_plan_table(ar.plan(sizes or DISC_SIZES)))
+
+
+@click.command()
+@click.option("--verbose", is_flag=True, default=False, help="List each file added")
+@click.option("--max_tier", default=None, type=int, help="Only add files up to this priority tier")
+def add(verbose, max_tier):
+    """Adds new and changed files from the source path to an archive, even once it is locked."""
+    ar = load_archiver_from_checkpoint()
+    print(f"Added {ar.add_new_files(verbose, max_tier=max_tier):,} files")
+    ar.save_checkpoint()
+
+
+@click.command()
+@click.option("--strategy", default=None, type=click.Choice(SEGMENT_STRATEGIES),
+              help="How files are packed onto discs, defaults to the one used to segment")
+@click.option("--balance", is_flag=True, default=False, help="Evenly fill the new discs after packing")
+@click.option("--verbose", is_flag=True, default=False, help="List each file split over discs")
+def segment_new(strategy, balance, verbose):
+    """Places files added since the archive was segmented on new discs without moving any other file."""
+    ar = load_archiver_from_checkpoint()
+    new_discs = ar.segment_new_files(strategy=strategy, balanced=balance, verbose=verbose)
+    if len(new_discs):
+        print(f"Added discs {new_discs.start} to {new_discs.stop - 1}")
+    else:
+        print("No new files to place")
+    print(ar.get_info())
     ar.save()
+    if ar.is_sharded:
+        ar.save_index()
+    ar.save_path_index()
+    ar.save_checkpoint()
+
+
+@click.command()
+@click.option("--pretend", default=False, help="Won't create database if --pretend")
+@click.option("--disc_num", default=None, type=int, help="Disc to write for a segmented archive")
+@click.option("--verify", "verify_image", is_flag=True, help="Read the image back and check it once written")
+@click.option("--copy_threads", default=None, type=int,
+              help="Copy the file data into the image with this many threads rather than through pycdlib")
+@click.option("--direct_io", is_flag=True, help="Write the image with O_DIRECT, bypassing the page cache")
+def write_iso(pretend, disc_num, verify_image, copy_threads, direct_io):
+    if disc_num is None:
+        ar = load_archiver_from_checkpoint()
+        filename = ar.write_iso(pretend, copy_threads=copy_threads, direct_io=direct_io)
+        ar.save()
+    else:  # Only need to load the entries for this disc
+        ar = load_archiver_from_checkpoint(disc_num=disc_num)
+        filename = ar.write_iso(pretend, disc_num=disc_num, copy_threads=copy_threads, direct_io=direct_io)
+    if verify_image and filename is not None:
+        report = ar.verify_iso(filename, disc_num)
+        print(report.summary())
+        if not report.passed:
+            sys.exit(1)
+
+
+@click.command()
+@click.option("--disc_num", default=None, type=int, help="Disc the image is of, by default read from the image")
+@click.option("--threads", default=None, type=int, help="Hashing threads, defaults to the number of CPUs")
+@click.argument("images", nargs=-1, required=True)
+def verify(disc_num, threads, images):
+    """Checks written ISO IMAGES against the catalogue.  Every file is read back and checked against its hash
+    and the SHA512SUM manifest, if the discs have one, is checked.  Exits with 1 if any image fails."""
+    ar = load_archiver_from_checkpoint()
+    passed = True
+    for image in images:
+        this_disc_num = disc_num
+        if this_disc_num is None and ar.is_segmented:
+            with Disc(image) as disc:
+                this_disc_num = disc.disc_num
+        report = ar.verify_iso(image, this_disc_num, threads)
+        print(report.summary())
+        passed = passed and report.passed
+    if not passed:
+        sys.exit(1)
+
+
+@click.command()
+@click.option("--workers", default=SCRUB_WORKERS, type=int, help="Images scrubbed at once, each on its own device")
+@click.option("--sample_size", default=SAMPLE_BYTES, type=int, help="Bytes read between throughput samples")
+@click.option("--report", "report_file", default=None, help="Write the reports to this file as JSON")
+@click.argument("images", nargs=-1, required=True)
+def scrub(workers, sample_size, report_file, images):
+    """Reads the whole of each of IMAGES, ISO images, disc block devices or mounted discs, and checks every file
+    against the catalogue.  The throughput over time and any unreadable sectors are reported so a decaying disc
+    can be spotted.  Exits with 1 if any image fails."""
+    ar = load_archiver_from_checkpoint()
+    reports = ar.scrub(images, workers, sample_size)
+    for report in reports:
+        print(report.summary())
+    if report_file is not None:
+        with open(report_file, "w", encoding="utf-8") as f:
+            f.write(reports_json(reports))
+    if not all(report.passed for report in reports):
+        sys.exit(1)
+
+
+@click.command()
+@click.option("--output", default=None, help="Write the repaired image here rather than repairing IMAGE in place")
+@click.argument("image")
+def repair(output, image):
+    """Rebuilds the sectors of IMAGE, an ISO image or a disc block device written with parity, that can't be read
+    or are wrong.  A disc must be repaired to an --output file.  Exits with 1 if any sector can't be repaired."""
+    report = repair_image(image, output)
+    print(report.summary())
+    if not report.passed:
+        sys.exit(1)
+
+
+@click.command()
+@click.option("--disc_num", default=None, type=int, help="Disc to stream for a segmented archive")
+@click.option("--output", default="-", help="File or named pipe to write the image to, - for stdout")
+@click.option("--socket", "socket_path", default=None, help="Unix socket to send the image to instead")
+@click.option("--buffer_size", default=STREAM_BUFFER_SIZE, type=int, help="Bytes written at a time")
+@click.option("--without_parity", is_flag=True, default=False,
+              help="Stream the image even though the discs were segmented with parity, which it won't have")
+def stream_iso(disc_num, output, socket_path, buffer_size, without_parity):
+    """Streams the ISO image of a disc, eg into a burner or a compressor, without writing it to disc first.
+    The size and hash of the image are printed to stderr.  An image with parity can't be streamed."""
+    ar = load_archiver_from_checkpoint(disc_num=disc_num)
+    if socket_path is not None:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(socket_path)
+            with sock.makefile("wb") as f:
+                stream = ar.stream_iso(f, disc_num, buffer_size, without_parity=without_parity)
+    elif output == "-":
+        stream = ar.stream_iso(sys.stdout.buffer, disc_num, buffer_size, without_parity=without_parity)
+    else:
+        with open(output, "wb") as f:
+            stream = ar.stream_iso(f, disc_num, buffer_size, without_parity=without_parity)
+    if stream is None:
+        click.echo(f"Disc {disc_num} has no files", err=True)
+    else:
+        click.echo(f"{stream.hexdigest()}  {stream.size:,} bytes", err=True)
+
+
+@click.command()
+@click.option("--processes", default=None, type=int, help="Discs mastered at once, defaults to the number of CPUs")
+@click.option("--max_io", default=2, type=int, help="Most discs reading their source files at once")
+@click.option("--verify", is_flag=True, help="Hash the images of discs already written before skipping them")
+def write_all_isos(processes, max_io, verify):
+    """Writes the ISO of every disc of a segmented archive, several at a time.  If it is run again only the
+    discs not yet complete are written."""
+    ar = load_archiver_from_checkpoint()
+    for filename in ar.write_all_isos(processes=processes, max_io=max_io, verify=verify):
+        print(filename)
+
+
+@click.command()
+@click.option("--budget", required=True, help="Most bytes of images on disk at once, or a disc size eg bd")
+@click.argument("command")
+def produce_isos(budget, command):
+    """Masters the discs of a segmented archive in order and runs COMMAND on each image, with {path} and
+    {disc_num} replaced, while the next is mastered.  An image is deleted once COMMAND exits with 0.  If it is
+    run again the discs already consumed are skipped."""
+    ar = load_archiver_from_checkpoint()
+    for disc_num in ar.produce_isos(command_consumer(command), interpret_disc_capacity(budget)):
+        print(f"Disc {disc_num} consumed")
+
+
+@click.command()
+@click.option("--path", "paths", multiple=True, help="Only restore this path, a directory or glob pattern")
+@click.option("--threads", default=RESTORE_THREADS, type=int, help="Threads writing the restored files")
+@click.option("--reflink", is_flag=True, help="Recreate duplicates as reflinks rather than hard links")
+@click.argument("destination")
+@click.argument("discs", nargs=-1, required=True)
+def restore(paths, threads, reflink, destination, discs):
+    """Restores the files on DISCS, ISO images or mounted discs, to DESTINATION.  Each disc is read once, in
+    order.  Files split over several discs are joined back together and every file is checked against its
+    hash."""
+    ar, sources = load_archiver_from_discs(discs)
+    plan = ar.restore_plan(sources, destination, paths or None, threads, reflink)
+    if plan.missing_discs:
+        click.echo(f"Not restoring files on discs {', '.join(map(str, sorted(plan.missing_discs)))}", err=True)
+    for disc_num in plan.disc_order:
+        click.echo(f"Disc {disc_num}: {plan.disc_bytes(disc_num):,} bytes", err=True)
+    for filename in plan.run():
+        print(filename)
+
+
+@click.command()
+@click.option("--images", default=DISC_IMAGE_PATTERN,
+              help="The ISO image or mounted disc of each disc with {disc_num} replaced")
+@click.option("--output", default="-", help="File to write to, - for stdout")
+@click.option("--index", default=PATH_INDEX_FILENAME, help="Path index saved when the archive was segmented")
+@click.argument("path")
+def get(images, output, index, path):
+    """Writes the file at PATH, relative to the data directory, from the disc it is on.  Only that disc's image
+    is opened and the file is checked against its hash."""
+    if output == "-":
+        location = get_file(path, sys.stdout.buffer, images, index)
+    else:
+        with open(output, "wb") as f:
+            location = get_file(path, f, images, index)
+    click.echo(f"{location['size']:,} bytes from disc {location['disc_num']}", err=True)
 
 
 @click.command()
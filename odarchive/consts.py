@@ -6,6 +6,25 @@ import re
 DATABASE_VERSION = 2
 DB_FILENAME = "catalogue.json"
 DISC_INFO_FILENAME = "disc_info.json"
+README_FILENAME = "readme.mkd"
+PACK_FILENAME = "pack.bin"  # Container of the small files on a disc, see packing.py
+PACK_OFFSET_DIGITS = 15  # Allowed for an offset in a container before it is known
+# Largest that the readme and disc info written to each disc can be
+README_MAX_SIZE = 2048
+DISC_INFO_MAX_SIZE = 2048
+
+# A sharded catalogue only holds the files on its own disc plus a global index of all the discs
+CATALOGUE_FULL = "full"
+CATALOGUE_SHARDED = "sharded"
+INDEX_FILENAME = "index.json"
+INDEX_VERSION = 1
+INDEX_HASH_PREFIX_LENGTH = 16
+
+# 1: entries table with hash, size, mtime, disc_num and NUL separated filenames
+# 2: parts table for files split over several discs
+# 3: entries pack_offset column for small files packed into a container
+CHECKPOINT_VERSION = 3
+CHECKPOINT_FILENAME = "archiver.checkpoint"
 
 HASH_FUNCTION = hashlib.sha512
 # Mostly used for importing from saved hash files
@@ -22,6 +41,10 @@ HASH_FILENAME = "SHA512SUM"
 class odarchiveError(Exception):
     pass
 
+# Named disc sizes understood by interpret_disc_capacity
+DISC_SIZES = ("cd", "dvd", "bd", "bd-dl", "bd-xl", "bd-xx")
+
+
 def interpret_disc_capacity(size):
     """
     Converts a size parameter into a number of bytes
@@ -38,13 +61,14 @@ def interpret_disc_capacity(size):
     elif size_as_text == "dvd":  # DVD-R SL DVD+R is slightly bigger
         return p("4,707,319,808")
     elif size_as_text == "bluray" or size_as_text == "bd":
-        # return p("25,025,314,816   ")  # Theoretical maximum but ISO's are create slightly bigger
-        return p("23,000,000,000   ")  # Try < 99% 99% still too large
+        return p("25,025,314,816")  # Segmentation uses an upper bound of the image size so can use all of it
     elif size_as_text == "bd-dl":
         return p("50,050,629,632")
     elif size_as_text == "bd-xl":
         return p("100,103,356,416")
-    elif size_as_text == "bd - xx":
+    elif size_as_text == "bd-xx" or size_as_text == "bd - xx":
         return p("128,001,769,472")
-    else:
-        return size
+    try:
+        return int(size)  # From the command line a number of bytes is still text
+    except ValueError:
+        raise odarchiveError(f"Disc size {size!r} isn't a number of bytes or one of {', '.join(DISC_SIZES)}")
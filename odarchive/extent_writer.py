@@ -0,0 +1,111 @@
+"""
+Writing an ISO image with the file data copied in parallel rather than through pycdlib.
+
+pycdlib's write copies the data of every file through Python buffers one file after another.  write_image lays
+the image out first, so the extent of every file is known, and has pycdlib write only the metadata by taking the
+inodes away while it writes.  The image is already the full size by then, a sparse file of zeros, so the padding
+at the end of each extent is there.  The data of each file is then copied to its extent by a pool of threads.
+Where the data comes from a file, a whole file, a part of a split file or a file in the container of packed
+files, it is copied with os.copy_file_range so it doesn't pass through Python at all and on some file systems isn't
+copied at all.  Anything else, eg the README in memory, is read and written with os.pwrite.  Every write is
+positioned so the threads don't share a file position.
+
+The image is byte for byte the same as the one pycdlib writes.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import errno
+import os
+
+from .consts import *
+from .file_parts import FileSlice, READ_SIZE
+from .image_size import SECTOR_SIZE
+from .packing import PackFile
+
+COPY_SIZE = 64 * 1024 * 1024  # Most bytes asked of copy_file_range at once
+# copy_file_range isn't supported between these file systems or at all, so copy through memory instead
+_NO_COPY_FILE_RANGE = {errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.EBADF}
+
+
+def _copy_range(in_fd, in_offset, out_fd, out_offset, size, name):
+    """Copies size bytes between two files at the given offsets without moving either file position"""
+    use_copy_file_range = hasattr(os, "copy_file_range")
+    while size > 0:
+        copied = None
+        if use_copy_file_range:
+            try:
+                copied = os.copy_file_range(in_fd, out_fd, min(size, COPY_SIZE), in_offset, out_offset)
+            except OSError as e:
+                if e.errno not in _NO_COPY_FILE_RANGE:
+                    raise
+                use_copy_file_range = False
+        if copied is None:
+            data = os.pread(in_fd, min(size, READ_SIZE), in_offset)
+            copied = len(data)
+            os.pwrite(out_fd, data, out_offset)
+        if copied == 0:
+            raise odarchiveError(f"{name} is {size:,} bytes shorter than expected")
+        in_offset += copied
+        out_offset += copied
+        size -= copied
+
+
+def _copy_file(filename, offset, out_fd, out_offset, size):
+    with open(filename, "rb") as f:
+        _copy_range(f.fileno(), offset, out_fd, out_offset, size, filename)
+
+
+def _copy_fp(fp, offset, out_fd, out_offset, size):
+    """Copies from a file object that isn't a plain file"""
+    fp.seek(offset)
+    while size > 0:
+        data = fp.read(min(size, READ_SIZE))
+        if not data:
+            raise odarchiveError(f"Data for offset {out_offset:,} of the image is {size:,} bytes shorter than "
+                                 f"expected")
+        os.pwrite(out_fd, data, out_offset)
+        out_offset += len(data)
+        size -= len(data)
+
+
+def _copies(ino):
+    """Yields (function, source, offset, location, size) for copying the data of an inode to its extent with
+    function(source, offset, out_fd, location, size)"""
+    location = ino.extent_location() * SECTOR_SIZE
+    size = ino.get_data_length()
+    source = ino.data_fp
+    if ino.manage_fp:  # Added with add_file, data_fp is the filename
+        yield _copy_file, source, ino.fp_offset, location, size
+    elif isinstance(source, FileSlice):
+        yield _copy_file, source.filename, source.offset + ino.fp_offset, location, size
+    elif isinstance(source, PackFile) and ino.fp_offset == 0 and size == source.size:
+        for filename, offset, file_size in zip(source.filenames, source.offsets, source.sizes):
+            if file_size:
+                yield _copy_file, filename, 0, location + offset, file_size
+    else:
+        yield _copy_fp, source, ino.fp_offset, location, size
+
+
+def write_image(iso, filename, threads=None):
+    """Writes a pycdlib image to filename, copying the file data with threads
+    :param threads: number of copying threads, defaults to the number of CPUs"""
+    iso.force_consistency()
+    copies = [copy for ino in iso.inodes if ino.get_data_length() > 0 for copy in _copies(ino)]
+    copies.sort(key=lambda copy: -copy[-1])  # Largest first so the threads finish at about the same time
+    with open(filename, "wb") as f:
+        inodes = iso.inodes
+        iso.inodes = []  # Only the metadata
+        try:
+            iso.write_fp(f)
+        finally:
+            iso.inodes = inodes
+        f.flush()
+        out_fd = f.fileno()
+        with ThreadPoolExecutor(max_workers=max(1, threads or os.cpu_count() or 1)) as executor:
+            futures = []
+            for function, source, offset, location, size in copies:
+                if function is _copy_fp:  # File objects have a position so are copied here, one at a time
+                    _copy_fp(source, offset, out_fd, location, size)
+                else:
+                    futures.append(executor.submit(function, source, offset, out_fd, location, size))
+            for future in futures:
+                future.result()  # Raises any error from the thread
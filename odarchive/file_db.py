@@ -74,7 +74,7 @@ class FileDatabase(AbstractFileDatabase):
         if this_path is None:
             this_path = self.path
         added, removed, modified = self._find_changes()
-        for entry in added:
+        for entry in sorted(added, key=lambda entry: entry.filename):  # Same order each time it is run
             entry.update()  # Calculate hash
             self.entries[entry.filename] = entry
         for entry in removed:
@@ -0,0 +1,114 @@
+"""
+Files that are too large to fit on one disc are split into parts.
+
+Each part is a byte range of the original file with its own hash and disc number and is written to a disc as
+a separate file named after the original with a .partNNNN suffix.  Nothing is copied to split a file, the
+ISO is written straight from a FileSlice of the original.  On restore the parts are joined back together in
+offset order and each part and then the whole file are checked against their hashes.
+"""
+import os
+
+from .consts import *
+
+# Size of each read when hashing or copying parts
+READ_SIZE = 1024 * 1024
+
+
+class FilePart:
+    """A byte range of a split file"""
+
+    def __init__(self, part_num, offset, size, file_hash=None, disc_num=None):
+        self.part_num = part_num
+        self.offset = offset
+        self.size = size
+        self.file_hash = file_hash
+        self.disc_num = disc_num
+
+    def to_json(self):
+        return {
+            "disc_num": self.disc_num,
+            "hash": self.file_hash,
+            "offset": self.offset,
+            "size": self.size,
+        }
+
+    @classmethod
+    def from_json(cls, part_num, d):
+        disc_num = d.get("disc_num")
+        return cls(part_num, int(d["offset"]), int(d["size"]), d["hash"],
+                   None if disc_num is None else int(disc_num))
+
+
+def part_name(name, part_num):
+    """Name of a part on disc, eg video.mp4.part0001"""
+    return f"{name}.part{part_num:04}"
+
+
+def split_file(filename, size, part_size):
+    """Returns the parts of a file of size bytes, each of part_size bytes apart from the last.  The file is
+    read once to hash all the parts."""
+    parts = []
+    with open(filename, "rb") as f:
+        for part_num, offset in enumerate(range(0, size, part_size)):
+            part = FilePart(part_num, offset, min(part_size, size - offset))
+            hasher = HASH_FUNCTION()
+            left = part.size
+            while left > 0:
+                data = f.read(min(READ_SIZE, left))
+                if not data:
+                    raise odarchiveError(f"{filename} is shorter than the {size:,} bytes in the catalogue")
+                hasher.update(data)
+                left -= len(data)
+            part.file_hash = hasher.hexdigest()
+            parts.append(part)
+    return parts
+
+
+class FileSlice:
+    """A read only file object over a byte range of a file, so that a part can be written to an ISO without
+    copying it.  The file is only opened when it is read and is closed once the whole range has been read."""
+
+    mode = "rb"  # pycdlib checks for a binary file object
+
+    def __init__(self, filename, offset, size):
+        self.filename = filename
+        self.offset = offset
+        self.size = size
+        self.position = 0
+        self.f = None
+
+    def seek(self, position, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            position += self.position
+        elif whence == os.SEEK_END:
+            position += self.size
+        self.position = max(0, min(position, self.size))
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.size - self.position:
+            size = self.size - self.position
+        if size == 0:
+            return b""
+        if self.f is None:
+            self.f = open(self.filename, "rb")
+        self.f.seek(self.offset + self.position)
+        data = self.f.read(size)
+        self.position += len(data)
+        if self.position >= self.size:
+            self.close()
+        return data
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -17,7 +17,15 @@ from .consts import *
 from .abstract_file_db import AbstractFileDatabase
 from .file_db import FileDatabase
 from .file_entry import FileEntryType, FileEntry
+from .file_parts import FilePart, part_name, split_file
 from .hash_file_entry import HashFileEntries, HashFileEntry
+from .image_size import base_disc_size, directory_cost, fan_out_cost, file_cost, udf_fid_length, SECTOR_SIZE
+from .iso_names import FAN_OUT
+from .manifest import manifest_line_size
+from .packing import pack_cost, PACK_GROUP
+from .parity import image_capacity
+from .priority import PriorityRules
+from .segmenter import pack, NEXT_FIT
 
 
 class HashDatabase(AbstractFileDatabase):
@@ -31,6 +39,13 @@ class HashDatabase(AbstractFileDatabase):
         self.version = DATABASE_VERSION
         self.segment_size = None  # DB is started not segmented
         self.last_disc_number = None  # This starts as a non segmented archive
+        self.sharded = False
+        self.strategy = NEXT_FIT
+        self.pending = []  # Hashes of entries added since the archive was segmented, see segment_new_files
+        self.priority_rules = []  # Specs of PriorityRule, each tier is segmented onto its own discs
+        self.pack_threshold = 0  # Files smaller than this are packed into a container on their disc
+        self.manifest = False  # Each disc has a SHA512SUM manifest of its files, see manifest.py
+        self.parity = 0  # Fraction of each disc that is Reed-Solomon parity, see parity.py
         # segmented or not is None or not
         try:
             self.entries = HashFileEntries.create(self.iso_path_root, file_db.path)
@@ -38,11 +53,167 @@ class HashDatabase(AbstractFileDatabase):
         except AttributeError:
             self.entries = HashFileEntries.create(self.iso_path_root, None)
 
-    def segment(self, size, catalogue_size):
+    def root_files(self, catalogue_size=None, sharded=None):
+        """Upper bound of the size of each file in the root of every disc.  By default for the catalogue size and
+        mode the archive was segmented with."""
+        if catalogue_size is None:
+            catalogue_size = self.catalogue_size
+        if sharded is None:
+            sharded = self.sharded
+        result = {
+            README_FILENAME: README_MAX_SIZE,
+            DISC_INFO_FILENAME: DISC_INFO_MAX_SIZE,
+        }
+        if getattr(self, "manifest", False):
+            # The lines of the manifest are counted in size_on_disc so only allow for rounding up to a sector
+            result[HASH_FILENAME] = SECTOR_SIZE
+        if sharded:
+            # catalogue_size covers the index and the header of the catalogue shard.  The entries of the shard are
+            # counted in size_on_disc so only allow for rounding up the two files to whole sectors.
+            result[INDEX_FILENAME] = catalogue_size
+            result[DB_FILENAME] = 2 * 2048
+        else:
+            result[DB_FILENAME] = catalogue_size
+        return result
+
+    def disc_overhead(self, catalogue_size=None, sharded=None):
+        """This is the number of bytes of overhead that will be used on each disc for size of iso file"""
+        return base_disc_size(self.root_files(catalogue_size, sharded), PurePosixPath(self.iso_path_root).name)
+
+    def capacity(self):
+        """Bytes available for files and their directories on each disc.  Room is kept for the ISO 9660 bucket
+        directories a disc of the segment size could need, see image_size.fan_out_cost.  A disc must be left with at
+        least one byte free.  If the discs have parity it is kept off the image, see parity.image_capacity."""
+        image_size = image_capacity(self.segment_size, getattr(self, "parity", 0))
+        return image_size - self.disc_overhead() - fan_out_cost(self.segment_size) - 1
+
+    def size_on_disc(self, entry, disc_num=None, part=None):
+        """Bytes used by an entry, or a part of a split entry, on a disc not counting its directories or container.
+        This includes its line in the manifest if there is one.  For a sharded catalogue it also includes its
+        catalogue entry so the disc_num it goes on is needed (or a larger one as an upper estimate)."""
+        packed = self.will_pack(entry)
+        if packed:
+            result = entry.size  # Packed end to end so no padding, nor a line in the manifest
+        elif part is None:
+            result = (file_cost(entry.size, entry.filename.name) + self.manifest_cost(entry.udf_absolute_path)
+                      + self.link_cost(entry))
+        else:
+            result = file_cost(part.size, part_name(entry.filename.name, part.part_num)) + \
+                     self.manifest_cost(entry.part_udf_path(part)) + self.link_cost(entry, part.part_num)
+        if self.sharded:
+            result += entry.catalogue_size(disc_num, packed)
+        return result
+
+    def manifest_cost(self, udf_path):
+        """Bytes of the line for a file in the SHA512SUM manifest of its disc, if the discs have one"""
+        return manifest_line_size(udf_path) if getattr(self, "manifest", False) else 0
+
+    @staticmethod
+    def link_cost(entry, part_num=None):
+        """Bytes of the UDF hard links for the duplicates of an entry, or of a part of it, which are just their file
+        identifiers as they share its file entry and data"""
+        return sum(udf_fid_length(link_path.name) for link_path in entry.link_paths(part_num))
+
+    def will_pack(self, entry):
+        """True if an entry is small enough to be packed into the container on its disc when segmenting"""
+        return entry.size < getattr(self, "pack_threshold", 0) and not entry.is_split
+
+    def unit_groups(self, entry):
+        """The groups whose cost is charged once on each disc an entry is on, its directories or the container"""
+        if self.will_pack(entry):
+            return (PACK_GROUP,)
+        return self.entry_dirs(entry)
+
+    def unit_chain(self, entry):
+        """The directories of the path of an entry, nearest first, or the container, which the locality strategy
+        builds its directory tree from.  Unlike unit_groups the directories of hard links aren't included."""
+        if self.will_pack(entry):
+            return (PACK_GROUP,)
+        return self._path_dirs(entry.udf_absolute_path)
+
+    @staticmethod
+    def group_cost(group):
+        if group == PACK_GROUP:
+            return pack_cost()
+        return directory_cost(PurePosixPath(group).name)
+
+    def units(self, disc_num=None):
+        """Yields (entry, part) for each thing that is packed onto a disc.  part is None for a whole file, a
+        split file has a unit for each of its parts."""
+        for entry in self.files(disc_num):
+            if entry.is_split:
+                for part in entry.parts:
+                    if disc_num is None or part.disc_num == disc_num:
+                        yield entry, part
+            else:
+                yield entry, None
+
+    def split_large_files(self, capacity, num_entries, entries=None, verbose=False):
+        """Splits the entries that won't fit on an empty disc into parts that do and joins back together those
+        that now fit.  Splitting reads the file to hash the parts.  By default all the entries are looked at.
+        :param verbose: print each file as it is split"""
+        for entry in self.files() if entries is None else entries:
+            dirs_cost = sum(directory_cost(PurePosixPath(this_dir).name) for this_dir in self.entry_dirs(entry))
+            whole = (file_cost(entry.size, entry.filename.name) + self.manifest_cost(entry.udf_absolute_path)
+                     + self.link_cost(entry) + dirs_cost)
+            if self.sharded:
+                whole += entry.catalogue_size(num_entries)
+            if whole <= capacity or self.will_pack(entry):
+                if entry.is_split:
+                    entry.parts = None
+                    self.entries.reindex(entry)  # Back to being on one disc
+                continue
+            existing_parts = entry.parts
+            udf_path = entry.udf_absolute_path
+            available = (capacity - dirs_cost - file_cost(0, part_name(entry.filename.name, 9999))
+                         - self.manifest_cost(udf_path.parent / part_name(udf_path.name, 9999))
+                         - self.link_cost(entry, 9999))
+            if self.sharded:
+                # Allow for the catalogue entry listing the parts, there can't be more parts than this
+                max_parts = entry.size // (available // 2) + 1
+                entry.parts = [FilePart(i, entry.size, entry.size, "0" * 128) for i in range(max_parts)]
+                available -= entry.catalogue_size(num_entries)
+            part_size = (available // SECTOR_SIZE) * SECTOR_SIZE
+            if part_size <= 0:
+                raise odarchiveError(f"Disc too small {self.segment_size:,}, cannot fit any part of file "
+                                     f"{entry.filename}.")
+            if existing_parts and existing_parts[0].size == part_size:
+                entry.parts = existing_parts  # Already split to this size so no need to hash again
+            else:
+                if verbose:
+                    print(f"Splitting {entry.filename} into parts of {part_size:,} bytes")
+                entry.parts = split_file(str(entry.file_system_path), entry.size, part_size)
+            self.entries.reindex(entry)
+
+    def entry_dirs(self, entry):
+        """The directories below the iso path root that an entry, and the hard links for its duplicates, need on
+        its disc"""
+        result = {}
+        for udf_path in [entry.udf_absolute_path] + entry.link_paths():
+            result.update(dict.fromkeys(self._path_dirs(udf_path)))
+        return tuple(result)
+
+    def _path_dirs(self, udf_path):
+        """The directories of a UDF path below the iso path root, nearest first"""
+        parents = udf_path.parents
+        root_depth = len(PurePosixPath(self.iso_path_root).parts)
+        return tuple(str(this_dir) for this_dir in parents[:len(parents) - root_depth])
+
+    def segment(self, size, catalogue_size, sharded=False, strategy=NEXT_FIT, balanced=False, pack_threshold=None,
+                verbose=False):
         """
         For a catalogue will place each file onto a disc.
         This will overwrite the segments if carrie out repeatedly.
         :param size:
+        :param catalogue_size: bytes reserved on every disc for the catalogue (or if sharded the global index and
+          the header of the catalogue shard)
+        :param sharded: each disc carries a catalogue of just its own files so each file also uses its
+          catalogue entry on the disc it is placed on.
+        :param strategy: how files are packed onto discs, one of SEGMENT_STRATEGIES
+        :param balanced: move files between discs afterwards so that they are evenly filled
+        :param pack_threshold: files smaller than this many bytes are packed into a container on their disc, 0 to
+          not pack.  If None the current threshold is kept.
+        :param verbose: print each file that is split over discs
         :return:
         """
         # Deal with differing types of segment size
@@ -52,34 +223,170 @@ class HashDatabase(AbstractFileDatabase):
         self.segment_size = new_size
         # Store the size of the catalogue
         self.catalogue_size = catalogue_size
-        OVERHEAD = (
-            500000 + catalogue_size
-        )  # This is the number of bytes of overhead that will be used for size of iso file
-        # TODO needs a method to deal more accruately with directory sizes
-        FILE_OVERHEAD = (
-            2048
-        )  # This is the number of bytes of overhead this is allocated for each file in addition
-        # to the actual contents of the file.  Needs to cover directory entries.
-        min_size = OVERHEAD + FILE_OVERHEAD + next(iter(self.files())).size
-        if new_size <= min_size:
-            raise odarchiveError(f"Disc too small {new_size:,}, cannot fit first file on with overhead {min_size:,}.")
-
-        count = OVERHEAD # Count the number of bytes used
-        self.last_disc_number = 0
+        self.sharded = sharded
+        self.strategy = strategy
+        self.pending = []  # Every file is placed afresh
+        if pack_threshold is not None:
+            self.pack_threshold = pack_threshold
+        # A disc must be left with at least one byte free
+        capacity = self.capacity()
+        entries = list(self.files())
+        self.split_large_files(capacity, len(entries), verbose=verbose)
+        units = list(self.units())
+        self.last_disc_number = max(self._pack_tiers(units, capacity, len(entries), strategy, balanced, 0), 0)
+        self._assign_pack_offsets(entries)
+
+    def add_new_file(self, file_entry):
+        """Adds a hashed FileEntry to the catalogue.  If the archive is segmented the entry is left without a disc
+        and noted as pending for segment_new_files.  Returns False if the file was already in the catalogue."""
+        path = self.entries.entry_to_path(file_entry)
+        existing = self.entries.get(file_entry.file_hash)
+        if existing is not None and existing.has_file_path(path):
+            return False
+        self.entries.add_hash_file(file_entry)
+        if self.is_segmented:
+            self.pending.append(file_entry.file_hash)
+        return True
+
+    def pending_entries(self):
+        """The entries added or given another path since the archive was last segmented"""
+        pending = getattr(self, "pending", [])  # Pickled before files could be added
+        return [self.entries[file_hash] for file_hash in dict.fromkeys(pending) if file_hash in self.entries]
+
+    def segment_new_files(self, catalogue_size, strategy=None, balanced=False, verbose=False):
+        """
+        Places the files added since the archive was segmented onto new discs numbered after the last one.  No file
+        that is already on a disc is moved so this can be done once discs have been written.  Only the pending
+        entries are looked at so the time taken is in proportion to the files added rather than the whole archive.
+        A new path for a file that is already on a disc doesn't use any more space, it is only added to the
+        catalogue.
+        :param catalogue_size: bytes now reserved on every disc for the catalogue, only the new discs have it
+        :param strategy: how files are packed onto discs, defaults to the one last used
+        :param balanced: evenly fill the new discs after packing
+        :param verbose: print each file that is split over discs
+        :return: range of the new disc numbers
+        """
+        if not self.is_segmented:
+            raise odarchiveError("Archive has not been segmented so there are no discs to add to")
+        if strategy is None:
+            strategy = self.strategy
+        new_entries = [entry for entry in self.pending_entries() if entry.disc_nums == {None}]
+        self.pending = []
+        first_disc_num = self.last_disc_number + 1
+        if not new_entries:
+            return range(first_disc_num, first_disc_num)
+        self.catalogue_size = catalogue_size
+        capacity = self.capacity()
+        num_entries = len(self.entries)
+        self.split_large_files(capacity, num_entries, new_entries, verbose=verbose)
+        units = [(entry, part) for entry in new_entries for part in (entry.parts if entry.is_split else [None])]
+        self.last_disc_number = self._pack_tiers(units, capacity, num_entries, strategy, balanced, first_disc_num)
+        self._assign_pack_offsets(new_entries)  # Only on the new discs so their containers start empty
+        return range(first_disc_num, self.last_disc_number + 1)
+
+    def entry_tier(self, entry, rules):
+        """The priority tier of an entry, the lowest of any of its paths"""
+        return rules.tier([PurePosixPath(filename).relative_to(self.iso_path_root) for filename in entry.filenames],
+                          entry.mtime)
+
+    def _pack_tiers(self, units, capacity, num_entries, strategy, balanced, first_disc_num):
+        """Packs the units of each priority tier onto their own discs in tier order from first_disc_num, so the
+        discs of a tier are complete once it has been segmented.  Returns the last disc number used."""
+        rules = PriorityRules(getattr(self, "priority_rules", []))  # Pickled before there were priorities
+        tiers = {}
+        for unit in units:
+            tiers.setdefault(self.entry_tier(unit[0], rules) if rules else 0, []).append(unit)
+        disc_num = first_disc_num
+        for tier in sorted(tiers):
+            tier_units = tiers[tier]
+            assignment = self._pack_units(tier_units, capacity, num_entries, strategy, balanced)
+            self._assign_units(tier_units, assignment, disc_num)
+            disc_num += max(assignment) + 1
+        return disc_num - 1
+
+    def _pack_units(self, units, capacity, num_entries, strategy, balanced):
+        """Returns the disc, counting from 0, for each (entry, part) unit"""
+        # The disc number can't be larger than the number of entries so use that for the catalogue size
+        sizes = [self.size_on_disc(entry, num_entries, part) for entry, part in units]
+        # Each directory, and the container, is costed once on each disc that has files in it
+        groups = [self.unit_groups(entry) for entry, part in units]
+        group_costs = {}
+        for entry_groups in groups:
+            for group in entry_groups:
+                if group not in group_costs:
+                    group_costs[group] = self.group_cost(group)
+        largest = 0
+        for i, entry_size in enumerate(sizes):
+            needed = entry_size + sum(group_costs[this_dir] for this_dir in groups[i])
+            if needed > largest:
+                largest, entry = needed, units[i][0]
+        if largest > capacity:
+            # if file is too big to fit on a single disc with overhead
+            raise odarchiveError(f"Disc too small {self.segment_size:,}, cannot fit file {entry.filename} with "
+                                 f"overhead {self.disc_overhead() + largest:,}.")
+        chains = [self.unit_chain(entry) for entry, part in units]
+        return pack(sizes, capacity, strategy, balanced, groups, group_costs, chains)
+
+    def _assign_units(self, units, assignment, first_disc_num):
+        for (entry, part), disc_num in zip(units, assignment):
+            disc_num += first_disc_num
+            if part is None:
+                entry.disc_num = disc_num
+            else:
+                part.disc_num = disc_num
+                if part.part_num == 0:
+                    entry.disc_num = disc_num  # The catalogue index points at the first part
+                self.entries.reindex(entry)  # Setting the disc of a part doesn't update the disc index
+
+    def _assign_pack_offsets(self, entries):
+        """Lays out the packed entries end to end in the container of each disc in catalogue order"""
+        offsets = {}
+        for entry in entries:
+            if self.will_pack(entry):
+                entry.pack_offset = offsets.get(entry.disc_num, 0)
+                offsets[entry.disc_num] = entry.pack_offset + entry.size
+            else:
+                entry.pack_offset = None
+
+    def packed_files(self, disc_num):
+        """The entries packed into the container of a disc in offset order"""
+        return sorted((entry for entry in self.files(disc_num) if entry.is_packed), key=lambda entry: entry.pack_offset)
+
+    def disc_usage(self, disc_num=None):
+        """Returns a list of the upper bound of the bytes used on each disc including overhead, or if disc_num is
+        given the bytes used on just that disc"""
+        if disc_num is None:
+            return [self.disc_usage(this_disc) for this_disc in range(self.last_disc_number + 1)]
+        result = self.disc_overhead()
+        groups = set()
+        num_units = 0
+        for entry, part in self.units(disc_num):
+            result += self.size_on_disc(entry, part=part)
+            groups.update(self.unit_groups(entry))
+            num_units += 1
+        if num_units + len(groups) > FAN_OUT:  # Some of them are in bucket directories
+            result += fan_out_cost(self.segment_size)
+        return result + sum(self.group_cost(group) for group in groups)
+
+    def top_level_discs(self):
+        """Returns a dictionary of each top level directory of the archive to the sorted list of discs needed to
+        restore it.  Files directly in the iso path root are listed under the root."""
+        root = PurePosixPath(self.iso_path_root)
+        result = {}
         for entry in self.files():
-            size_on_disc = (
-                (2048 + entry.size) // 2048
-            ) * 2048 + FILE_OVERHEAD
-            if (count + size_on_disc) >= self.segment_size:
-                # If too big to fit file in segment then start a new disc
-                count = OVERHEAD
-                self.last_disc_number += 1
-            # Only add
-            entry.disc_num = self.last_disc_number
-            count += size_on_disc
-            if count > self.segment_size:
-                # if file is too big to fit on a single disc with overhad
-                raise odarchiveError(f"Disc too small {new_size:,}, cannot fit file {entry.filename} on disc {self.last_disc_number} with overhead {count:,}.")
+            for filename in entry.filenames:
+                relative = PurePosixPath(filename).relative_to(root)
+                top = root / relative.parts[0] if len(relative.parts) > 1 else root
+                discs = result.setdefault(str(top), set())
+                discs.update(disc_num for disc_num in entry.disc_nums if disc_num is not None)
+        return {top: sorted(disc_nums) for top, disc_nums in sorted(result.items())}
+
+    def get_directory_info(self):
+        """Returns the number of discs needed to restore each top level directory"""
+        result = "Discs for each top level directory:\n"
+        for top, disc_nums in self.top_level_discs().items():
+            result += f"  {top} = {len(disc_nums)} discs {disc_nums}\n"
+        return result
 
     @property
     def is_segmented(self):
@@ -94,43 +401,49 @@ class HashDatabase(AbstractFileDatabase):
 
     def files(self, disc_num=None):
         """Extend class with a disc number segemtn"""
-        for entry in self.entries.values():
-            if disc_num is None:  # without a disc num specification return all files
-                yield entry
-            elif entry.disc_num == disc_num:  # only get entries for this disc_num
-                yield entry
+        if disc_num is None:  # without a disc num specification return all files
+            yield from self.entries.values()
+        else:  # only get entries for this disc_num, or split over it, from the disc index
+            yield from self.entries.files_on_disc(disc_num)
+
+    def disc_totals(self, disc_num):
+        """The number of files, bytes of data and directories on a disc as a DiscTotals.  These are kept up to date
+        as the archive is segmented so are instant."""
+        return self.entries.disc_totals(disc_num)
 
     def get_info(self, for_disc_num = None):
         """Returns summary information on an archive. Uses introspection"""
-        count_files = 0
-        size_files = 0
         disc_nums = set()
         entries_no_disc = 0
         largest_file = 0
         max_dir_length = 0
         longest_dir = ""
         dirs = set()
-        for entry in self.files():
-            count_files += 1
-            size_files += entry.size
-            if for_disc_num is None or for_disc_num == entry.disc_num:
-                count_files += 1
-                size_files += entry.size
-                if self.is_segmented:
-                    if entry.disc_num is None:
-                        entries_no_disc += 1
-                    else:
-                        disc_nums |= {entry.disc_num}
-                if entry.size > largest_file:
-                    largest_file = entry.size
-                # Each entry may have multiple directory entries
-                for this_file in entry.filenames:
-                    this_dir = PurePosixPath(this_file).parent
-                    dirs = dirs | {this_dir}
-                    length = len(Path(this_dir).parts) - 2
-                    if length > max_dir_length:
-                        longest_dir = this_dir.parent
-                        max_dir_length = length
+        # The totals come from the disc index rather than adding up the entries.  Those of the whole archive are
+        # doubled as they always have been, the output of get_info is relied on, but those of a disc are not.
+        if for_disc_num is None:
+            count_files = 2 * len(self.entries)
+            size_files = 2 * sum(self.disc_totals(disc_num).size for disc_num in self.entries.disc_nums())
+        else:
+            totals = self.disc_totals(for_disc_num)
+            count_files = totals.num_files
+            size_files = totals.size
+        for entry in self.files(for_disc_num):
+            if self.is_segmented:
+                if entry.disc_num is None:
+                    entries_no_disc += 1
+                else:
+                    disc_nums |= {entry.disc_num}
+            if entry.size > largest_file:
+                largest_file = entry.size
+            # Each entry may have multiple directory entries
+            for this_file in entry.filenames:
+                this_dir = PurePosixPath(this_file).parent
+                dirs = dirs | {this_dir}
+                length = len(Path(this_dir).parts) - 2
+                if length > max_dir_length:
+                    longest_dir = this_dir.parent
+                    max_dir_length = length
         # Format answer
         result = super().get_info()
         result += f"Data size       = {size_files:,} bytes\n"
@@ -151,6 +464,13 @@ class HashDatabase(AbstractFileDatabase):
                 result += f"  Disc segment size = {self.int_segment_size:,} bytes\n"
             result += f"  Catalogue size = {self.catalogue_size:,} bytes\n"
             result += f"  Number of discs = {self.last_disc_number+1:,}\n"
+            if for_disc_num is None:
+                disc_nums_shown = range(self.last_disc_number + 1)
+            else:
+                disc_nums_shown = [for_disc_num] if 0 <= for_disc_num <= self.last_disc_number else []
+            for disc_num in disc_nums_shown:
+                used = self.disc_usage(disc_num)
+                result += f"  Disc {disc_num} fill = {used:,} bytes ({100 * used / self.int_segment_size:.2f}%)\n"
         if entries_no_disc > 0 and self.is_segmented:
             result += (
                 f"  ERROR: {entries_no_disc} entries have not been allocated a disc number and should have been.\n"
@@ -1,5 +1,5 @@
 import datetime as dt
-from collections import OrderedDict
+from collections import Counter, OrderedDict
 from enum import Enum
 import json
 from mmap import mmap, ACCESS_READ
@@ -12,15 +12,130 @@ import dill
 from stat import S_ISLNK, S_ISREG
 
 from .consts import *
+from .file_parts import FilePart, part_name
+from .iso_names import BridgeNames, iso9660_dir_name
 
 
-from .tools import mangle_file_for_iso9660, mangle_dir_for_iso9660
+class DiscTotals:
+    """The entries on one disc and their totals, kept up to date by the disc index of HashFileEntries"""
+
+    def __init__(self):
+        self.entries = {}  # Key in HashFileEntries to entry
+        self.size = 0  # Bytes of file data, only the parts on this disc of a split file
+        self.dirs = Counter()  # Number of files in each directory
+
+    @property
+    def num_files(self):
+        return len(self.entries)
+
+    @property
+    def num_dirs(self):
+        return len(self.dirs)
+
+    def add(self, key, entry, size, dirs):
+        self.entries[key] = entry
+        self.size += size
+        self.dirs.update(dirs)
+
+    def remove(self, key, size, dirs):
+        del self.entries[key]
+        self.size -= size
+        for this_dir in dirs:
+            self.dirs[this_dir] -= 1
+            if not self.dirs[this_dir]:
+                del self.dirs[this_dir]
 
 
 class HashFileEntries(OrderedDict):
     """This is a collection of HashFileEntries
     In fact you can only create a new HashFileEntry with reference to a collection
+
+    There is a secondary index from disc number to the DiscTotals of the entries on it, including each split
+    entry on every disc with one of its parts, so that per disc queries don't scan every entry.  It is built
+    the first time it is needed and then kept up to date as entries are added and as their disc numbers are set.
     """
+
+    def __setitem__(self, key, entry):
+        self.paths_changed()
+        indexed = getattr(self, "_disc_index", None) is not None  # Not while unpickling
+        if indexed:
+            if key in self:
+                self._unindex(key)
+            else:
+                self._positions[key] = self._next_position
+                self._next_position += 1
+        super().__setitem__(key, entry)
+        if indexed:
+            self._index(key, entry)
+
+    def __delitem__(self, key):
+        self.paths_changed()
+        if getattr(self, "_disc_index", None) is not None:
+            self._unindex(key)
+            del self._positions[key]
+        super().__delitem__(key)
+
+    def _build_disc_index(self):
+        self._disc_index = {}
+        self._indexed = {}  # Key to the (disc_num, size, dirs) it was added to the index with
+        self._positions = {}  # Key to catalogue order
+        for position, (key, entry) in enumerate(self.items()):
+            self._positions[key] = position
+            self._index(key, entry)
+        self._next_position = len(self._positions)
+
+    def _index(self, key, entry):
+        dirs = [str(PurePosixPath(filename).parent) for filename in entry.filenames]
+        added = []
+        for disc_num, size in entry.disc_sizes().items():
+            self._disc_index.setdefault(disc_num, DiscTotals()).add(key, entry, size, dirs)
+            added.append((disc_num, size, dirs))
+        self._indexed[key] = added
+
+    def _unindex(self, key):
+        for disc_num, size, dirs in self._indexed.pop(key, []):
+            self._disc_index[disc_num].remove(key, size, dirs)
+            if not self._disc_index[disc_num].entries:
+                del self._disc_index[disc_num]
+
+    def reindex(self, entry):
+        """Updates the disc index once an entry, or one of its parts, has moved disc or it has a new path.  Entries
+        that aren't in this collection yet, eg while being created, are ignored."""
+        if getattr(self, "_disc_index", None) is None or self.get(entry.file_hash) is not entry:
+            return
+        self._unindex(entry.file_hash)
+        self._index(entry.file_hash, entry)
+
+    def disc_totals(self, disc_num):
+        """The DiscTotals of a disc, None is the entries without a disc"""
+        if getattr(self, "_disc_index", None) is None:
+            self._build_disc_index()
+        return self._disc_index.get(disc_num, DiscTotals())
+
+    def disc_nums(self):
+        """Every disc number with an entry on it, including None if any entry has no disc"""
+        self.disc_totals(None)  # Builds the index
+        return set(self._disc_index)
+
+    def paths_changed(self):
+        """Notes that an entry or a path has been added or removed, so the bridge names need allocating again"""
+        self.paths_version = getattr(self, "paths_version", 0) + 1
+
+    @property
+    def bridge_names(self):
+        """The ISO 9660 path of each UDF path, see iso_names.py"""
+        if getattr(self, "_bridge_names", None) is None:
+            self._bridge_names = BridgeNames(self)
+        return self._bridge_names
+
+    def load_bridge_names(self, saved):
+        """Uses the ISO 9660 names saved from BridgeNames.changed rather than allocating them afresh"""
+        self._bridge_names = BridgeNames(self, saved)
+
+    def files_on_disc(self, disc_num):
+        """The entries on a disc in catalogue order"""
+        entries = self.disc_totals(disc_num).entries
+        return [entries[key] for key in sorted(entries, key=self._positions.__getitem__)]
     @classmethod
     def create(cls, iso_path_root, path):
         """ Did this to get around issue with loading pickled object that is derived from an OrderedDict"""
@@ -50,14 +165,23 @@ class HashFileEntries(OrderedDict):
             filenames = []
             for filename in entry['filenames']:
                 filenames.append(filename)
+            parts = entry.get('parts')
+            if parts:
+                parts = [FilePart.from_json(part_num, part) for part_num, part in enumerate(parts)]
+                for part in parts:
+                    if part.disc_num is not None and (parent.last_disc_number is None or
+                                                      part.disc_num > parent.last_disc_number):
+                        parent.last_disc_number = part.disc_num
             result[hash] = HashFileEntry(
                 result,
                 hash,
                 filenames,
                 entry['size'],
                 entry['mtime'],
-                0,#         catalogue_num=catalogue_num,
-                disc_num #         disc_num=this_entry.disc_num,
+                disc_num=disc_num,
+                catalogue_num=0,
+                parts=parts,
+                pack_offset=entry.get('pack_offset'),
             )
             #Add extra filenames
         return result
@@ -119,14 +243,17 @@ class HashFileEntries(OrderedDict):
         # OrderedDict([('pear', 1), ('apple', 4), ('orange', 2), ('banana', 3)])
         pass
 
-    def to_json(self):
+    def to_json(self, disc_num=None):
+        """If disc_num is given then only the entries on that disc are included eg for a catalogue shard"""
         header = "{\n"
         result = ""
         footer = "}\n"
-        for i, entry in enumerate(self.values()):
+        i = 0
+        for entry in self.values() if disc_num is None else self.files_on_disc(disc_num):
             if i:
                 result += " , "  # Can;t have trailing comma
             result += entry.to_json_entry() + "\n"
+            i += 1
         return header + result + footer
 
     def dir_entries(self, disc_num=None):
@@ -144,12 +271,14 @@ class HashFileEntries(OrderedDict):
                     # level of directory is included.
                 result[str(udf_path)] = ""
 
-        for entry in self.values():
-            if disc_num is None or disc_num == entry.disc_num:
-                update_dir_list(
+        for entry in self.values() if disc_num is None else self.files_on_disc(disc_num):
+            if entry.is_packed:
+                continue  # In the container in the root rather than its own directories
+            update_dir_list(
                     entry.udf_absolute_path.parent
                 )  # Only add parent but do it recursively
-            # else Do not add this directory to this entry
+            for link_path in entry.link_paths():  # Duplicates are hard links in their own directories
+                update_dir_list(link_path.parent)
         return result
 
 
@@ -170,6 +299,8 @@ class HashFileEntry:
         mtime=None,
         disc_num=None,
         catalogue_num=None,
+        parts=None,
+        pack_offset=None,
     ):
         # In memory, "filename" should be a relative UDF Path
         self.parent = parent  # eg a HashFileEntries
@@ -190,6 +321,8 @@ class HashFileEntry:
             catalogue_num
         )  # If None or 0 then in this catalogue otherwise in another catalogue
         #  You will need to look up the catalogue number to the GUID of the catalogue at the start of the catalogue
+        self.parts = parts  # List of FilePart if the file is too large for one disc
+        self.pack_offset = pack_offset  # Offset in the container on its disc if it is a packed small file
 
     @property
     def filename(self):
@@ -207,6 +340,50 @@ class HashFileEntry:
     @disc_num.setter
     def disc_num(self, disc_num):
         self._disc_num = disc_num  # Rely on Archive level lock for overwriting
+        if isinstance(self.parent, HashFileEntries):
+            self.parent.reindex(self)
+
+    @property
+    def is_split(self):
+        return bool(getattr(self, "parts", None))  # Entries pickled before parts existed have no attribute
+
+    @property
+    def is_packed(self):
+        return getattr(self, "pack_offset", None) is not None  # Entries pickled before packing have no attribute
+
+    @property
+    def disc_nums(self):
+        """The discs that this entry, or any of its parts, is on"""
+        if self.is_split:
+            return {part.disc_num for part in self.parts}
+        else:
+            return {self.disc_num}
+
+    def on_disc(self, disc_num):
+        return disc_num in self.disc_nums
+
+    def disc_sizes(self):
+        """Dictionary of each disc this entry is on to the bytes of it on that disc"""
+        if not self.is_split:
+            return {self.disc_num: self.size}
+        result = {}
+        for part in self.parts:
+            result[part.disc_num] = result.get(part.disc_num, 0) + part.size
+        return result
+
+    def link_paths(self, part_num=None):
+        """UDF absolute paths of the duplicates of this file, which are hard links to its data on the disc.  For a
+        split file the links to a part are named as that part of each duplicate."""
+        root = PurePosixPath(self.parent.iso_path_root)
+        result = [root / filename for filename in list(self.filenames)[1:]]
+        if part_num is not None:
+            result = [udf_path.parent / part_name(udf_path.name, part_num) for udf_path in result]
+        return result
+
+    def part_udf_path(self, part):
+        """Where a part of a split file is stored on its disc"""
+        udf_path = self.udf_absolute_path
+        return udf_path.parent / part_name(udf_path.name, part.part_num)
 
     def __str__(self):
         return f"{self.filename}, {self.hash}"
@@ -229,20 +406,8 @@ class HashFileEntry:
     @property
     def iso9660_path(self):
         # Assume PlainBuild UDF ie written in one pass not incrementally ie suffix is ";1"
-        # TODO do folding so that if the iso9660_path has been already used another is used.
-        # Needs to be done through parent as the parent controls the restart of reusage cache
-        file_start = self.parent.iso_path_root / self.filename
-        mangled_dirs = [
-            mangle_dir_for_iso9660(part, 3) for part in file_start.parent.parts
-        ]
-        mangled_dirs[0] = mangled_dirs[0][1:]  # Get rid of leading underscore
-        mangled = (
-            mangle_file_for_iso9660(str(file_start.stem), 1)[0]
-            + "."
-            + mangle_file_for_iso9660(str(file_start.suffix)[1:], 1)[0]
-        )
-
-        return "/".join(mangled_dirs) + "/" + mangled + ";1"
+        # Names that clash are made unique and the mapping kept by the parent, see iso_names.py
+        return self.parent.bridge_names.path(self.udf_absolute_path)
 
     def to_json_entry(self):
         """Returns a string which is the entry in an object
@@ -256,6 +421,13 @@ class HashFileEntry:
             disc_num = f'    "disc_num" : {self.disc_num},\n'
         else:
             disc_num = ""
+        if self.is_split:
+            parts = '    "parts" : ' + json.dumps([part.to_json() for part in self.parts]) + ',\n'
+        else:
+            parts = ""
+        if self.is_packed:
+            parts += f'    "pack_offset" : {self.pack_offset},\n'
+
         return (
             f'"{self.file_hash}"'
             + ": {\n"
@@ -263,13 +435,48 @@ class HashFileEntry:
             + filename_list
             + "    },"
             + disc_num
+            + parts
             + f'    "size" : {self.size},\n'
             + f'    "mtime" : "{dt.datetime.fromtimestamp(self.mtime).strftime("%Y-%m-%dT%H:%M:%S")}"\n'
             + "}\n"
         )
 
+    def catalogue_size(self, disc_num=None, packed=None):
+        """Returns the number of bytes this entry takes up in a saved catalogue.json (indent of 4 with the
+        entry nested two levels deep).  disc_num can be given to account for an entry before it is segmented and
+        packed if it will be packed, in which case the largest offset is allowed for."""
+        if disc_num is None:
+            disc_num = self.disc_num
+        if packed is None:
+            packed = self.is_packed
+        size = 8 + 2 + len(self.file_hash) + 4  # "hash": {
+        if disc_num is not None:
+            size += 12 + 14 + len(str(disc_num))  # "disc_num": n,
+        size += 12 + 15  # "filenames": {
+        for filename in self.filenames:
+            size += 16 + len(json.dumps(filename, ensure_ascii=False).encode("utf-8")) + 8  # "name": null,
+        size += -1 + 12 + 3  # No trailing comma on last filename then },
+        size += 12 + 32  # "mtime": "2018-05-24T09:32:31",
+        if self.is_split:
+            parts = [part.to_json() for part in self.parts]
+            for part in parts:
+                if part["disc_num"] is None:
+                    part["disc_num"] = disc_num
+            text = json.dumps(parts, sort_keys=True, indent=4)
+            # "parts": [...], with each line of the list indented to the depth of the entry
+            size += 12 + 9 + len(text) + 12 * text.count("\n") + 2
+        if packed:
+            offset = self.pack_offset if self.is_packed else 10 ** PACK_OFFSET_DIGITS
+            size += 12 + 16 + len(str(offset))  # "pack_offset": n,
+        size += 12 + 9 + len(str(self.size))  # "size": n
+        size += 8 + 3  # },
+        return size
+
     def add_path(self, this_path):
         self.filenames[str(this_path)] = {}
+        if isinstance(self.parent, HashFileEntries):
+            self.parent.paths_changed()
+            self.parent.reindex(self)
 
     def has_file_path(self, this_path):
         """A has file entry has multiple paths this tests if a UDF path has been stored."""
@@ -291,7 +498,7 @@ def iso9660_dir(this_dir):
      The truncated and translated name suitable for the ISO interchange level
      specified.
     """
-    mangled_dirs = [mangle_dir_for_iso9660(part, 3) for part in Path(this_dir).parts]
+    mangled_dirs = [iso9660_dir_name(part) for part in Path(this_dir).parts]
     mangled_dirs[0] = mangled_dirs[0][1:]  # Get rid of leading underscore
     result = "/".join(mangled_dirs)
     if result == "":
@@ -0,0 +1,211 @@
+"""
+A model of the size of the image pycdlib writes for a disc, ISO 9660 interchange level 3 with a UDF 2.60 bridge.
+
+This replaces guessing a fixed overhead per disc and per file.  The image is made up of:
+
+- a fixed area up to the start of the UDF partition: system area, ISO 9660 and UDF volume recognition
+  descriptors, UDF main and reserve volume descriptor sequences, integrity sequence, the anchor at sector 256
+  and the file set descriptor.
+- for each UDF directory a file entry sector and its file identifier descriptors (FIDs), which can span sectors.
+- a UDF file entry sector for each file.  Hard links to a file only add a FID.
+- the ISO 9660 little and big endian path tables, with a record for each directory.
+- the ISO 9660 directory extents.  Directory records can't span a sector so each sector may have some padding.
+- the file data, each file padded to a whole sector.
+- the closing UDF anchor.
+
+ImageLayout gives the exact size of an image.  For segmentation, where files have to be costed one at a time
+without knowing what else will be on the disc, the file_cost, directory_cost and base_disc_size functions give
+an upper bound which is at most a few sectors per directory over.
+"""
+from pathlib import PurePosixPath
+
+from .iso_names import FAN_OUT, MAX_FAN_OUT_LEVELS
+
+SECTOR_SIZE = 2048
+# System area (0-15), volume descriptors, UDF descriptor sequences at 32 and 48, integrity sequence at 64, then
+# the anchor at 256, the file set descriptor and its terminator.
+UDF_PARTITION_START = 259
+# Files and directories in /DATA are given 8 digit ISO 9660 names, see Archiver.write_iso
+ISO9660_NAME_LENGTH = 8
+BUCKET_NAME_LENGTH = 4  # Bucket directories of the fan-out, see iso_names.FanOut
+
+
+def sectors(num_bytes):
+    """Number of whole sectors needed for num_bytes"""
+    return -(-num_bytes // SECTOR_SIZE)
+
+
+def iso9660_record_length(name):
+    """Length of an ISO 9660 directory record, padded to an even number of bytes"""
+    length = 33 + len(name)
+    return length + length % 2
+
+
+def path_table_record_length(name):
+    length = 8 + len(name)
+    return length + length % 2
+
+
+def udf_fid_length(name):
+    """Length of a UDF file identifier descriptor, padded to a multiple of 4 bytes.  Names are stored 8 bits a
+    character if possible otherwise as UTF-16.  A name of '' is the parent FID."""
+    if name:
+        if max(map(ord, name)) < 256:
+            name_length = 1 + len(name)
+        else:
+            name_length = 1 + len(name.encode("utf-16-be"))
+    else:
+        name_length = 0
+    length = 38 + name_length
+    return length + (-length) % 4
+
+
+def _iso9660_dir_sectors(record_lengths):
+    """Records are in name order and can't span a sector"""
+    num_sectors = 1
+    offset = 68  # The . and .. records
+    for length in record_lengths:
+        if offset + length > SECTOR_SIZE:
+            num_sectors += 1
+            offset = 0
+        offset += length
+    return num_sectors
+
+
+def _udf_dir_sectors(fid_lengths):
+    """File entry plus the FIDs which can span sectors, this follows how pycdlib assigns them"""
+    num_sectors = 1
+    offset = 0
+    for length in fid_lengths:
+        if offset >= SECTOR_SIZE:
+            num_sectors += 1
+            offset -= SECTOR_SIZE
+        offset += length
+    if offset > SECTOR_SIZE:
+        num_sectors += 1
+    return num_sectors + 1
+
+
+def _iso9660_name(iso_path):
+    return PurePosixPath(iso_path).name
+
+
+class ImageLayout:
+    """Tracks what is added to an image, in the same way as it is added with pycdlib, to give its size"""
+
+    def __init__(self):
+        self.iso_dirs = {"/": []}  # ISO 9660 directory -> list of (name, record length) of its children
+        self.udf_dirs = {"/": [udf_fid_length("")]}  # UDF directory -> FID lengths, including the parent FID
+        self.udf_files = 0
+        self.data_sectors = 0
+
+    def add_directory(self, iso_path, udf_path=None):
+        iso_path = str(iso_path)
+        name = _iso9660_name(iso_path)
+        self.iso_dirs[str(PurePosixPath(iso_path).parent)].append((name, iso9660_record_length(name)))
+        self.iso_dirs[iso_path] = []
+        if udf_path is None:  # Only in the ISO 9660 tree
+            return
+        udf_path = PurePosixPath(udf_path)
+        self.udf_dirs[str(udf_path.parent)].append(udf_fid_length(udf_path.name))
+        self.udf_dirs[str(udf_path)] = [udf_fid_length("")]
+
+    def add_file(self, size, iso_path, udf_path):
+        iso_path = str(iso_path)
+        name = _iso9660_name(iso_path)
+        self.iso_dirs[str(PurePosixPath(iso_path).parent)].append((name, iso9660_record_length(name)))
+        udf_path = PurePosixPath(udf_path)
+        self.udf_dirs[str(udf_path.parent)].append(udf_fid_length(udf_path.name))
+        self.udf_files += 1
+        self.data_sectors += sectors(size)
+
+    def add_hard_link(self, udf_path):
+        """A UDF hard link to a file already added, which shares its file entry and data"""
+        udf_path = PurePosixPath(udf_path)
+        self.udf_dirs[str(udf_path.parent)].append(udf_fid_length(udf_path.name))
+
+    def size(self):
+        """Size in bytes of the image"""
+        num_sectors = UDF_PARTITION_START
+        for fid_lengths in self.udf_dirs.values():
+            num_sectors += _udf_dir_sectors(fid_lengths)
+        num_sectors += self.udf_files
+        path_table_size = path_table_record_length("\0")  # Root
+        for iso_dir in self.iso_dirs:
+            if iso_dir != "/":
+                path_table_size += path_table_record_length(_iso9660_name(iso_dir))
+        num_sectors += 2 * (-(-sectors(path_table_size) // 2) * 2)  # Little and big endian, even sectors each
+        for children in self.iso_dirs.values():
+            num_sectors += _iso9660_dir_sectors(length for name, length in sorted(children))
+        num_sectors += self.data_sectors
+        num_sectors += 1  # Closing anchor
+        return num_sectors * SECTOR_SIZE
+
+    def data_start(self):
+        """Offset of the first file data, everything before it is metadata"""
+        return self.size() - (self.data_sectors + 1) * SECTOR_SIZE
+
+
+def _iso9660_record_bound(name_length):
+    """Records can't span a sector so some of each sector may be padding, spread that over each record"""
+    length = iso9660_record_length("x" * name_length)
+    return -(-SECTOR_SIZE // (SECTOR_SIZE // length))
+
+
+def file_cost(size, udf_name, iso_name_length=ISO9660_NAME_LENGTH):
+    """Upper bound of the bytes a file adds to an image once its directory is there.  This is its data, its
+    UDF file entry, its FID in the UDF directory and its ISO 9660 directory record."""
+    return (
+        sectors(size) * SECTOR_SIZE
+        + SECTOR_SIZE
+        + udf_fid_length(udf_name)
+        + _iso9660_record_bound(iso_name_length)
+    )
+
+
+def directory_cost(udf_name, iso_name_length=ISO9660_NAME_LENGTH):
+    """Upper bound of the bytes a directory adds to an image, not counting what is in it.  The UDF directory
+    is a file entry plus at most one sector more than its FIDs, the ISO 9660 directory is one sector plus the
+    records in it and there is a record in each path table."""
+    return (
+        2 * SECTOR_SIZE
+        + udf_fid_length("")
+        + udf_fid_length(udf_name)
+        + SECTOR_SIZE
+        + _iso9660_record_bound(iso_name_length)
+        + 2 * path_table_record_length("x" * iso_name_length)
+    )
+
+
+def fan_out_cost(disc_size):
+    """Upper bound of the bytes used by the ISO 9660 bucket directories of the fan-out on a disc, see
+    iso_names.FanOut.  The records of the files and directories in the buckets are already in file_cost and
+    directory_cost so each bucket only adds a sector for its . and .. records and padding, its own record and
+    its path table records.  Each file and directory uses at least a sector, which bounds how many there can be,
+    so a disc too small for more than FAN_OUT doesn't need any."""
+    max_entries = disc_size // SECTOR_SIZE
+    if max_entries <= FAN_OUT:
+        return 0
+    num_buckets = 2 * MAX_FAN_OUT_LEVELS  # A partly full bucket at each level for files and for directories
+    while max_entries > FAN_OUT:
+        max_entries = -(-max_entries // FAN_OUT)
+        num_buckets += max_entries
+    bucket_cost = (SECTOR_SIZE + _iso9660_record_bound(BUCKET_NAME_LENGTH)
+                   + 2 * path_table_record_length("x" * BUCKET_NAME_LENGTH))
+    return num_buckets * bucket_cost + 4 * SECTOR_SIZE  # Path tables rounded up to an even number of sectors
+
+
+def base_disc_size(root_files, data_dir="DATA"):
+    """Upper bound of the bytes used on every disc before any files are added.
+    :param root_files: dictionary of UDF name to size (or the largest size) of the files in the root
+    :param data_dir: name of the directory that holds the archived files
+    """
+    size = UDF_PARTITION_START * SECTOR_SIZE
+    size += 2 * (2 * SECTOR_SIZE + path_table_record_length("\0"))  # Both path tables with the root record
+    size += SECTOR_SIZE  # ISO 9660 root, there are few enough root files to fit in one sector
+    size += 2 * SECTOR_SIZE + udf_fid_length("")  # UDF root
+    size += directory_cost(data_dir, len(data_dir))
+    for name, file_size in root_files.items():
+        size += file_cost(file_size, name, len(name) + 2)  # ISO 9660 names have a ;1 suffix
+    size += SECTOR_SIZE  # Closing anchor
+    return size
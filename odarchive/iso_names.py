@@ -0,0 +1,215 @@
+"""
+ISO 9660 names for the UDF paths of an archive, the bridge names.
+
+ISO 9660 names are upper case letters, digits and underscore and are limited in length so the mapping from UDF is
+lossy and two UDF names can end up the same.  A clash is resolved by replacing the end of the name with a number
+from a counter kept for each directory and prefix, so allocating a name is O(1) however many clash, rather than
+trying each number in turn.  When a counter runs out of digits it is widened by a digit, and the prefix shortened,
+so there is always a free name.
+
+Which name a path gets depends on the order paths are allocated in so, as the README's lossless scheme asks, the
+mapping is kept.  BridgeNames allocates the paths of the catalogue once in catalogue order and caches them.  Only
+the paths whose name had to be changed to make it unique are saved in the catalogue, the rest are the plain
+translation, so loading them back gives the same mapping even after more files are added.  Saving a loaded
+catalogue again only allocates the paths if entries or paths have been added since.
+
+Characters are translated with str.translate and a table that is filled in as characters are seen rather than a
+regular expression on every name.
+
+On the discs written by Archiver.write_iso the ISO 9660 tree of the data is anonymous, each directory and file is
+numbered.  FanOut spreads them over bucket directories so no ISO 9660 directory has more than FAN_OUT entries,
+which keeps both adding them with pycdlib and looking them up on a reader fast.
+"""
+from collections import defaultdict
+from pathlib import PurePosixPath
+
+from .consts import *
+
+ISO9660_DIR_LENGTH = 31  # Interchange level 3
+ISO9660_STEM_LENGTH = 8
+ISO9660_EXT_LENGTH = 8
+SUFFIX_DIGITS = 3  # Digits of the number that makes a clashing name unique, widened when they run out
+FAN_OUT = 1000  # Most numbered entries in an ISO 9660 directory of the data, see FanOut
+# pycdlib allows 7 directory levels and the data directory and the numbered entry itself use two of them
+MAX_FAN_OUT_LEVELS = 5
+_D_CHARACTERS = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_")
+
+
+class _TranslateTable(dict):
+    """str.translate table from any character to itself if it is allowed in ISO 9660 names or otherwise _"""
+
+    def __missing__(self, code):
+        result = code if chr(code) in _D_CHARACTERS else ord("_")
+        self[code] = result
+        return result
+
+
+_TRANSLATE_TABLE = _TranslateTable()
+
+
+def translate(name):
+    """Upper cases a name and replaces the characters not allowed in ISO 9660 with _"""
+    return name.upper().translate(_TRANSLATE_TABLE)
+
+
+def iso9660_dir_name(name):
+    return translate(name)[:ISO9660_DIR_LENGTH]
+
+
+def iso9660_file_name(name):
+    """Returns the (stem, extension) of the ISO 9660 name of a file"""
+    path = PurePosixPath(name)
+    return translate(path.stem)[:ISO9660_STEM_LENGTH], translate(path.suffix[1:])[:ISO9660_EXT_LENGTH]
+
+
+def _join(stem, ext, is_dir):
+    return stem if is_dir else f"{stem}.{ext};1"
+
+
+class NameAllocator:
+    """Hands out ISO 9660 names that are unique in their directory"""
+
+    def __init__(self):
+        self.used = defaultdict(set)  # ISO 9660 directory to the names in it
+        self.counters = {}  # (directory, prefix, extension) to the next number to try
+
+    def reserve(self, iso_dir, name):
+        self.used[iso_dir].add(name)
+
+    def allocate(self, iso_dir, stem, ext="", is_dir=False):
+        """Returns a name, stem or stem.ext;1 for a file, that isn't used in iso_dir yet and marks it as used"""
+        used = self.used[iso_dir]
+        name = _join(stem, ext, is_dir)
+        if name not in used:
+            used.add(name)
+            return name
+        max_length = ISO9660_DIR_LENGTH if is_dir else ISO9660_STEM_LENGTH
+        digits = SUFFIX_DIGITS
+        while digits <= max_length:
+            prefix = stem[:max_length - digits]
+            key = (iso_dir, prefix, ext, digits)
+            number = self.counters.get(key, 0)
+            while number < 10 ** digits:
+                name = _join(f"{prefix}{number:0{digits}}", ext, is_dir)
+                number += 1
+                if name not in used:
+                    self.counters[key] = number
+                    used.add(name)
+                    return name
+            self.counters[key] = number
+            digits += 1
+        raise odarchiveError(f"No free ISO 9660 name for {stem} in {iso_dir}")
+
+
+class BridgeNames:
+    """The ISO 9660 path of each UDF path in a HashFileEntries, allocated in catalogue order the first time it is
+    needed"""
+
+    def __init__(self, entries, saved=None):
+        """
+        :param saved: the paths whose names were made unique, as returned by changed, to allocate first
+        """
+        self.entries = entries
+        self.saved = dict(saved or {})
+        # The paths_version of the entries when every path was last allocated.  Names that were saved are already
+        # those of the entries as loaded, so until one is added they don't need allocating to be saved again.
+        self.version = None if saved is None else getattr(entries, "paths_version", 0)
+        self.paths = None  # UDF path to ISO 9660 path
+        self.allocator = NameAllocator()
+        self.made_unique = set()  # UDF paths whose name isn't the plain translation
+
+    def _build(self):
+        self.paths = {}
+        for udf_path, iso_path in self.saved.items():
+            iso_path = PurePosixPath(iso_path)
+            self.allocator.reserve(str(iso_path.parent), iso_path.name)
+            self.paths[udf_path] = str(iso_path)
+        self._allocate_all()
+
+    def _allocate_all(self):
+        """Allocates the paths of any entries that don't have names yet, in catalogue order"""
+        root = PurePosixPath(self.entries.iso_path_root)
+        for entry in self.entries.values():
+            for filename in entry.filenames:
+                self.path(root / filename)
+        self.version = getattr(self.entries, "paths_version", 0)
+
+    def path(self, udf_path, is_dir=False):
+        """The ISO 9660 path for an absolute UDF path"""
+        if self.paths is None:
+            self._build()
+        key = str(udf_path)
+        result = self.paths.get(key)
+        if result is None:
+            udf_path = PurePosixPath(udf_path)
+            if udf_path.parent == udf_path:
+                return "/"
+            iso_dir = self.path(udf_path.parent, is_dir=True)
+            if is_dir:
+                stem, ext = iso9660_dir_name(udf_path.name), ""
+            else:
+                stem, ext = iso9660_file_name(udf_path.name)
+            name = self.allocator.allocate(iso_dir, stem, ext, is_dir)
+            if name != _join(stem, ext, is_dir):
+                self.made_unique.add(key)
+            result = self.paths[key] = f"{iso_dir.rstrip('/')}/{name}"
+        return result
+
+    def changed(self, udf_paths=None):
+        """The paths whose name had to be changed to make it unique, which is all that needs saving.
+        :param udf_paths: only these paths and their directories, eg for a catalogue shard"""
+        if udf_paths is None:
+            if self.version != getattr(self.entries, "paths_version", 0):  # Entries added since
+                if self.paths is None:
+                    self._build()
+                else:
+                    self._allocate_all()
+            return {**self.saved, **{key: self.paths[key] for key in self.made_unique}}
+        if self.paths is None:
+            self._build()
+        wanted = set()
+        for udf_path in udf_paths:
+            self.path(udf_path)
+            udf_path = PurePosixPath(udf_path)
+            wanted.add(str(udf_path))
+            wanted.update(str(parent) for parent in udf_path.parents)
+        return {key: self.paths[key] for key in wanted if key in self.saved or key in self.made_unique}
+
+
+def fan_out_levels(count, fan_out=FAN_OUT):
+    """Number of levels of bucket directories needed for count numbered entries"""
+    levels = 0
+    while count > fan_out ** (levels + 1):
+        levels += 1
+    if levels > MAX_FAN_OUT_LEVELS:
+        raise odarchiveError(f"Too many entries, {count:,}, for the ISO 9660 directory depth")
+    return levels
+
+
+class FanOut:
+    """ISO 9660 paths for count numbered directories or files under root.  Up to fan_out of them are all in root,
+    the flat layout.  More are put in bucket directories by number, eg with two levels number 1234567 is
+    root/F001/234/01234567, so every directory has at most fan_out entries.  The buckets of the top level are
+    named with a prefix so that those for files and for directories can share the root."""
+
+    def __init__(self, root, prefix, count, fan_out=FAN_OUT):
+        self.root = str(root).rstrip("/")
+        self.prefix = prefix
+        self.fan_out = fan_out
+        self.levels = fan_out_levels(count, fan_out)
+        self.digits = len(str(fan_out - 1))
+        self.buckets = set()  # Bucket directories already returned by place
+
+    def place(self, number):
+        """Returns the list of bucket directories that have to be added before the entry, in order, and the ISO 9660
+        path of the entry"""
+        new_buckets = []
+        bucket = self.root
+        for level in range(self.levels, 0, -1):
+            index = number // self.fan_out ** level % self.fan_out
+            name = f"{index:0{self.digits}}"
+            bucket += f"/{self.prefix}{name}" if level == self.levels else f"/{name}"
+            if bucket not in self.buckets:
+                self.buckets.add(bucket)
+                new_buckets.append(bucket)
+        return new_buckets, f"{bucket}/{number:08}"
@@ -0,0 +1,87 @@
+"""
+A journal of the discs of a job that have been written so that writing a large set can be resumed.
+
+Each line is a JSON record for a disc with the hash of what was planned to go on it, the ISO it was written to,
+the size and hash of that image and whether it is complete.  Records are appended, and flushed to disc, as each
+disc is started and finished so the journal survives the machine dying part way through.  The last record for a
+disc is the one that counts.
+
+A disc is only skipped on a rerun if its last record is complete, the planned contents still match (ie the
+archive hasn't been segmented or saved again since) and the image is still there with the right size, and
+optionally the right hash.  A disc produced with produce_isos is also marked consumed once its image has been used
+and deleted, see production.py.
+"""
+import json
+import os
+
+from .consts import *
+from .file_parts import READ_SIZE
+
+JOURNAL_SUFFIX = ".journal"
+
+
+class Journal:
+    """The records of a job journal by disc number"""
+
+    def __init__(self, filename):
+        self.filename = str(filename)
+        self.records = {}
+        self._torn_at = None  # Where the last line starts if it was cut short, it is cut off before appending
+        try:
+            with open(self.filename, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+        if data and not data.endswith(b"\n"):
+            self._torn_at = data.rfind(b"\n") + 1
+        for line in data.splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # A line cut short when the machine died
+            self.records[record["disc_num"]] = record
+
+    def record(self, disc_num, contents_hash, path, size=None, image_hash=None, complete=False, consumed=False):
+        record = {
+            "disc_num": disc_num,
+            "contents_hash": contents_hash,
+            "path": str(path),
+            "size": size,
+            "image_hash": image_hash,
+            "complete": complete,
+            "consumed": consumed,
+        }
+        if self._torn_at is not None:  # Otherwise this record would be joined on to the end of it and lost too
+            os.truncate(self.filename, self._torn_at)
+            self._torn_at = None
+        with open(self.filename, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, sort_keys=True) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.records[disc_num] = record
+
+    def is_complete(self, disc_num, contents_hash, verify=False):
+        """True if a disc has been written with the planned contents and its image is intact
+        :param verify: also hash the image, otherwise only its size is checked"""
+        record = self.records.get(disc_num)
+        if record is None or not record["complete"] or record["contents_hash"] != contents_hash:
+            return False
+        try:
+            if os.path.getsize(record["path"]) != record["size"]:
+                return False
+        except OSError:
+            return False
+        return not verify or hash_image(record["path"]) == record["image_hash"]
+
+    def is_consumed(self, disc_num, contents_hash):
+        """True if the image of a disc with the planned contents has been consumed and deleted"""
+        record = self.records.get(disc_num)
+        return record is not None and record.get("consumed", False) and record["contents_hash"] == contents_hash
+
+
+def hash_image(filename):
+    hasher = HASH_FUNCTION()
+    with open(filename, "rb") as f:
+        for data in iter(lambda: f.read(READ_SIZE), b""):
+            hasher.update(data)
+    return hasher.hexdigest()
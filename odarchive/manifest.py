@@ -0,0 +1,50 @@
+"""
+The SHA512SUM manifest written to the root of each disc.
+
+It lists the hash of every file in the data directory of the disc, whole files and parts of split files, in the
+format of sha512sum so a mounted disc can be checked without odarchive by running 'sha512sum -c SHA512SUM' in its
+root.  Paths are relative to the root of the disc.  As in GNU coreutils a line whose path has a backslash or new
+line in it starts with a backslash and they are escaped.  Small files packed into the container are not separate
+files on the disc so aren't listed, they are checked against the catalogue by Archiver.verify_iso.
+
+Each line is charged to the file it lists when segmenting, see HashDatabase.size_on_disc, so the manifest always
+fits on the disc.
+"""
+from pathlib import PurePosixPath
+
+from .consts import *
+
+
+def disc_path(udf_path):
+    """Path of a file relative to the root of its disc as written in the manifest"""
+    return str(PurePosixPath(udf_path).relative_to("/"))
+
+
+def manifest_line(file_hash, udf_path):
+    path = disc_path(udf_path)
+    if "\\" in path or "\n" in path:
+        return "\\" + f"{file_hash}  " + path.replace("\\", "\\\\").replace("\n", "\\n") + "\n"
+    return f"{file_hash}  {path}\n"
+
+
+def manifest_line_size(udf_path):
+    """Bytes the line for a file takes up in the manifest"""
+    return len(manifest_line("0" * 128, udf_path).encode("utf-8"))
+
+
+def parse_manifest(text):
+    """Returns a dictionary of the path relative to the disc root to hash of each line of a manifest"""
+    result = {}
+    for line in text.splitlines():
+        if not line:
+            continue
+        escaped = line.startswith("\\")
+        if escaped:
+            line = line[1:]
+        file_hash, sep, path = line.partition("  ")
+        if not sep or not SHA512_HASH_PATTERN.match(file_hash):
+            raise odarchiveError(f"Badly formed line in {HASH_FILENAME}: {line!r}")
+        if escaped:
+            path = path.replace("\\\\", "\0").replace("\\n", "\n").replace("\0", "\\")
+        result[path] = file_hash.lower()
+    return result
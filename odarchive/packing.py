@@ -0,0 +1,89 @@
+"""
+Small files are packed into a container file on each disc rather than being written as files of their own.
+
+Each file on a disc takes at least a whole 2048 byte sector for its data plus a sector for its UDF file entry and
+its directory records, so for archives of millions of small files most of each disc would be padding.  When
+segmenting with a pack threshold the files smaller than it are concatenated, in catalogue order, into
+PACK_FILENAME in the root of their disc.  Their offset in it is recorded in the catalogue as pack_offset so each
+file can still be read back, and checked against its hash, on its own.
+"""
+from bisect import bisect_right
+import os
+
+from .consts import *
+from .image_size import file_cost, SECTOR_SIZE
+
+# Used as the group of packed files when segmenting so that the cost of the container is charged once per disc
+PACK_GROUP = ""
+
+
+def pack_cost():
+    """Upper bound of the bytes a container adds to a disc over the bytes packed into it, its file entry, records
+    and the padding of the last sector"""
+    return file_cost(0, PACK_FILENAME, len(PACK_FILENAME) + 2) + SECTOR_SIZE - 1
+
+
+class PackFile:
+    """A read only file object over the concatenation of the packed files on a disc, so that the container can be
+    written to an ISO without being copied first.  Files are opened one at a time as they are read."""
+
+    mode = "rb"  # pycdlib checks for a binary file object
+
+    def __init__(self, files):
+        """:param files: list of (filename, size) in pack offset order"""
+        self.filenames = [filename for filename, size in files]
+        self.sizes = [size for filename, size in files]
+        self.offsets = []
+        offset = 0
+        for size in self.sizes:
+            self.offsets.append(offset)
+            offset += size
+        self.size = offset
+        self.position = 0
+        self.f = None
+        self.open_index = None
+
+    def seek(self, position, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            position += self.position
+        elif whence == os.SEEK_END:
+            position += self.size
+        self.position = max(0, min(position, self.size))
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.size - self.position:
+            size = self.size - self.position
+        result = bytearray()
+        while len(result) < size:
+            index = bisect_right(self.offsets, self.position) - 1  # The last of any empty files is the one read
+            if self.open_index != index:
+                self.close()
+                self.f = open(self.filenames[index], "rb")
+                self.open_index = index
+            within = self.position - self.offsets[index]
+            self.f.seek(within)
+            data = self.f.read(min(size - len(result), self.sizes[index] - within))
+            if not data:
+                raise odarchiveError(f"{self.filenames[index]} is shorter than the {self.sizes[index]:,} bytes in "
+                                     f"the catalogue")
+            result += data
+            self.position += len(data)
+        if self.position >= self.size:
+            self.close()
+        return bytes(result)
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+            self.open_index = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
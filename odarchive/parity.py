@@ -0,0 +1,536 @@
+"""
+Reed-Solomon parity for the sectors of a disc, so that sectors that can no longer be read can be rebuilt rather than
+only found by verify or scrub.
+
+The parity goes after the ISO image, in the same way as dvdisaster's RS02 method.  Nothing that reads the file
+system looks past the end of the volume so the disc mounts and verifies as before, and every sector of the image is
+covered, metadata included.  The sectors make up codewords of a Reed-Solomon code over GF(2^8), byte i of the
+sectors of a codeword being one codeword of bytes.  Each codeword has parity_rows parity sectors and up to
+CODEWORD - parity_rows data sectors.  The data sectors of a codeword are spread over the whole image: the image is
+taken as rows of groups sectors and sector s is in codeword s % groups, so a scratch across many consecutive sectors
+loses a few sectors of many codewords rather than many of one.  A codeword can rebuild up to parity_rows sectors as
+long as it is known which they are, so a CRC32 of every sector is kept too and a sector that fails it, or can't be
+read, is taken as lost.
+
+After the image, in order:
+
+- a header sector, PARITY_MAGIC then the layout as JSON
+- the parity sectors, the parity_rows of each codeword together
+- the CRC table, the CRC32s of the data then the parity sectors, little endian, CRCS_PER_SECTOR to a sector with
+  the CRC32 of the rest of the sector in its last 4 bytes.  There are two copies as a lost sector of the table
+  would hide damage to the sectors it covers.
+- a copy of the header in the last sector
+
+About parity_rows / CODEWORD of a disc goes on parity, see image_capacity for how large an image can then be.
+NumPy is needed to add or use the parity but not to segment for it.  The parity is worked out by a linear feedback
+shift register over whole rows of sectors at once, multiplying 2 bytes at a time by table lookup, so it keeps up
+with writing the image.
+"""
+import json
+import os
+import zlib
+
+from .consts import *
+from .image_size import sectors, SECTOR_SIZE
+from .scrub import read_sectors, SCRUB_READ_SIZE
+
+try:
+    import numpy as np
+except ImportError:  # Only needed to add or use parity
+    np = None
+
+PARITY_MAGIC = b"ODARCHIVE PARITY\n"
+PARITY_VERSION = 1
+CODEWORD = 255  # Sectors in a codeword, the most there can be over GF(2^8)
+MAX_PARITY = 0.5  # Largest fraction of a disc that can be parity
+GF_POLYNOMIAL = 0x11D  # x^8 + x^4 + x^3 + x^2 + 1, with alpha = 2
+PARITY_BLOCK_SIZE = 32 * 1024 * 1024  # Bytes of parity worked out at once, the rows are read this / parity_rows
+CHUNK_SIZE = 128 * 1024  # Bytes of a row worked on at once so that the registers stay in the cache
+CRCS_PER_SECTOR = SECTOR_SIZE // 4 - 1
+PVD_SPACE_SIZE = 16 * SECTOR_SIZE + 80  # Volume space size in the primary volume descriptor, little endian
+
+
+def _gf_tables():
+    exp = [0] * (2 * 255)
+    log = [0] * 256
+    x = 1
+    for i in range(255):
+        exp[i] = exp[i + 255] = x
+        log[x] = i
+        x <<= 1
+        if x & 0x100:
+            x ^= GF_POLYNOMIAL
+    return exp, log
+
+
+_EXP, _LOG = _gf_tables()
+_pair_tables = {}
+
+
+def _mul(a, b):
+    if a == 0 or b == 0:
+        return 0
+    return _EXP[_LOG[a] + _LOG[b]]
+
+
+def _generator(parity_rows):
+    """Coefficients, lowest power first, of the product of (x - alpha^j) for j < parity_rows"""
+    g = [1]
+    for j in range(parity_rows):
+        g = [(g[i - 1] if i else 0) ^ (_mul(g[i], _EXP[j]) if i < len(g) else 0) for i in range(len(g) + 1)]
+    return g
+
+
+def _invert(matrix):
+    """Inverse of a square matrix over GF(2^8) by Gauss-Jordan elimination"""
+    n = len(matrix)
+    rows = [list(row) + [int(i == j) for j in range(n)] for i, row in enumerate(matrix)]
+    for col in range(n):
+        pivot = next(r for r in range(col, n) if rows[r][col])
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        scale = _EXP[255 - _LOG[rows[col][col]]]
+        rows[col] = [_mul(scale, value) for value in rows[col]]
+        for r in range(n):
+            factor = rows[r][col]
+            if r != col and factor:
+                rows[r] = [value ^ _mul(factor, pivot_value) for value, pivot_value in zip(rows[r], rows[col])]
+    return [row[n:] for row in rows]
+
+
+def _check_numpy():
+    if np is None:
+        raise odarchiveError("Reed-Solomon parity needs NumPy, pip install numpy")
+
+
+def _multiply(c, data, out):
+    """out = c * data for uint8 arrays of an even length, looking up 2 bytes at a time"""
+    table = _pair_tables.get(c)
+    if table is None:
+        products = np.array([_mul(c, value) for value in range(256)], dtype=np.uint16)
+        pairs = np.arange(65536)
+        table = _pair_tables[c] = products[pairs & 0xFF] | (products[pairs >> 8] << 8)
+    np.take(table, data.view(np.uint16), out=out.view(np.uint16), mode="wrap")
+
+
+def parity_rows(fraction):
+    """Parity sectors in each codeword for about fraction of a disc to be parity"""
+    if not 0 < fraction <= MAX_PARITY:
+        raise odarchiveError(f"Parity of {fraction} must be more than 0 and at most {MAX_PARITY}")
+    return max(1, round(CODEWORD * fraction))
+
+
+class ParityLayout:
+    """Where everything is for the parity of an image of data_sectors sectors, all in sectors.  The covered sectors,
+    those with a CRC, are numbered as in the CRC table, the data sectors then the parity sectors."""
+
+    def __init__(self, data_sectors, parity_rows):
+        if not 0 < parity_rows < CODEWORD:
+            raise odarchiveError(f"{parity_rows} parity sectors in a codeword of {CODEWORD}")
+        self.data_sectors = data_sectors
+        self.parity_rows = parity_rows
+        self.groups = max(1, -(-data_sectors // (CODEWORD - parity_rows)))  # Codewords
+        self.rows = -(-data_sectors // self.groups)  # Data sectors in each codeword, the last row can be short
+        self.parity_sectors = parity_rows * self.groups
+        self.covered = data_sectors + self.parity_sectors
+        self.crc_sectors = -(-self.covered // CRCS_PER_SECTOR)
+        self.header = data_sectors
+        self.parity_start = self.header + 1
+        self.crc_start = self.parity_start + self.parity_sectors
+        self.crc_copy_start = self.crc_start + self.crc_sectors
+        self.trailer = self.crc_copy_start + self.crc_sectors
+        self.total_sectors = self.trailer + 1
+
+    @property
+    def size(self):
+        """Bytes of the image with its parity"""
+        return self.total_sectors * SECTOR_SIZE
+
+    @property
+    def extra_size(self):
+        """Bytes the parity adds to the image"""
+        return (self.total_sectors - self.data_sectors) * SECTOR_SIZE
+
+    def codeword(self, index):
+        """The codeword of a covered sector and its power of x in it.  Parity sector t of a codeword is x^t and the
+        data sectors follow in falling powers from the first row."""
+        if index < self.data_sectors:
+            return index % self.groups, self.parity_rows + self.rows - 1 - index // self.groups
+        return divmod(index - self.data_sectors, self.parity_rows)
+
+    def sector(self, index):
+        """Sector in the image of a covered sector"""
+        return index if index < self.data_sectors else index + 1
+
+    def covered_index(self, sector):
+        """The covered sector of a sector in the image or None if it isn't covered"""
+        if sector < self.data_sectors:
+            return sector
+        if self.parity_start <= sector < self.crc_start:
+            return sector - 1
+        return None
+
+    def header_bytes(self):
+        header = {"version": PARITY_VERSION, "data_sectors": self.data_sectors, "parity_rows": self.parity_rows}
+        return (PARITY_MAGIC + json.dumps(header).encode("utf-8") + b"\n").ljust(SECTOR_SIZE, b"\0")
+
+    @classmethod
+    def from_header(cls, data):
+        """The layout from a header sector or None if it isn't one"""
+        if not data.startswith(PARITY_MAGIC):
+            return None
+        try:
+            header = json.loads(data[len(PARITY_MAGIC):].split(b"\n", 1)[0].decode("utf-8"))
+            if header["version"] != PARITY_VERSION:
+                return None
+            return cls(header["data_sectors"], header["parity_rows"])
+        except (ValueError, KeyError, TypeError, odarchiveError):
+            return None
+
+
+def image_capacity(disc_size, fraction):
+    """Bytes of the largest image that fits on a disc of disc_size bytes once its parity is added"""
+    if not fraction:
+        return disc_size
+    rows = parity_rows(fraction)
+    lo, hi = 0, disc_size // SECTOR_SIZE
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if ParityLayout(mid, rows).size <= disc_size:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo * SECTOR_SIZE
+
+
+def parity_size(image_size, fraction):
+    """Bytes the parity adds to an image of image_size bytes"""
+    return ParityLayout(sectors(image_size), parity_rows(fraction)).extra_size if fraction else 0
+
+
+def _crcs(data):
+    view = memoryview(data)
+    return [zlib.crc32(view[i:i + SECTOR_SIZE]) for i in range(0, len(data), SECTOR_SIZE)]
+
+
+def _crc_table(crcs):
+    table = bytearray()
+    for first in range(0, len(crcs), CRCS_PER_SECTOR):
+        sector = crcs[first:first + CRCS_PER_SECTOR].tobytes().ljust(SECTOR_SIZE - 4, b"\0")
+        table += sector + zlib.crc32(sector).to_bytes(4, "little")
+    return bytes(table)
+
+
+def _encode(fd, layout, first, last, crcs):
+    """The parity sectors of codewords first to last, filling in the CRCs of their sectors"""
+    width = (last - first) * SECTOR_SIZE
+    generator = _generator(layout.parity_rows)
+    registers = [np.zeros(width, dtype=np.uint8) for _ in range(layout.parity_rows)]  # [t] is x^t
+    product = np.empty(min(width, CHUNK_SIZE), dtype=np.uint8)
+    padded = np.zeros(width, dtype=np.uint8)
+    for row in range(layout.rows):
+        start = row * layout.groups + first
+        count = max(0, min(last - first, layout.data_sectors - start))
+        data = os.pread(fd, count * SECTOR_SIZE, start * SECTOR_SIZE)
+        if len(data) != count * SECTOR_SIZE:
+            raise odarchiveError(f"Image is shorter than its {layout.data_sectors:,} sectors")
+        crcs[start:start + count] = _crcs(data)
+        if count == last - first:
+            values = np.frombuffer(data, dtype=np.uint8)
+        else:  # The last row is short, the rest of the codewords is zeros
+            padded[:len(data)] = np.frombuffer(data, dtype=np.uint8)
+            padded[len(data):] = 0
+            values = padded
+        feedback = registers[-1]
+        np.bitwise_xor(feedback, values, out=feedback)
+        for offset in range(0, width, CHUNK_SIZE):
+            chunk = feedback[offset:offset + CHUNK_SIZE]
+            chunk_product = product[:len(chunk)]
+            for t in range(layout.parity_rows - 1, 0, -1):
+                if generator[t]:
+                    _multiply(generator[t], chunk, chunk_product)
+                    registers[t - 1][offset:offset + CHUNK_SIZE] ^= chunk_product
+            _multiply(generator[0], chunk, chunk)
+        registers = [feedback] + registers[:-1]
+    parity = np.stack(registers).reshape(layout.parity_rows, last - first, SECTOR_SIZE).transpose(1, 0, 2).tobytes()
+    index = layout.data_sectors + first * layout.parity_rows
+    crcs[index:index + len(parity) // SECTOR_SIZE] = _crcs(parity)
+    return parity
+
+
+def add_parity(filename, fraction, hasher=None):
+    """Appends the parity of an ISO image to it, see above
+    :param fraction: about this fraction of the image with its parity is parity
+    :param hasher: updated with everything appended, so a running hash of the image becomes one of the whole file
+    :return: ParityLayout"""
+    _check_numpy()
+    size = os.path.getsize(filename)
+    if size % SECTOR_SIZE:
+        raise odarchiveError(f"{filename} is not a whole number of sectors")
+    layout = ParityLayout(size // SECTOR_SIZE, parity_rows(fraction))
+    crcs = np.zeros(layout.covered, dtype="<u4")
+    fd = os.open(filename, os.O_RDWR)
+    try:
+        def append(data, sector):
+            os.pwrite(fd, data, sector * SECTOR_SIZE)
+            if hasher is not None:
+                hasher.update(data)
+
+        append(layout.header_bytes(), layout.header)
+        block = max(1, PARITY_BLOCK_SIZE // (layout.parity_rows * SECTOR_SIZE))  # Codewords at once
+        for first in range(0, layout.groups, block):
+            append(_encode(fd, layout, first, min(first + block, layout.groups), crcs),
+                   layout.parity_start + first * layout.parity_rows)
+        table = _crc_table(crcs)
+        append(table, layout.crc_start)
+        append(table, layout.crc_copy_start)
+        append(layout.header_bytes(), layout.trailer)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    return layout
+
+
+def read_layout(fd):
+    """The ParityLayout of an image from its header, or from its trailer if the header is lost, or None"""
+    try:
+        space = int.from_bytes(os.pread(fd, 4, PVD_SPACE_SIZE), "little")
+        layout = ParityLayout.from_header(os.pread(fd, SECTOR_SIZE, space * SECTOR_SIZE))
+        if layout is not None and layout.data_sectors == space:
+            return layout
+    except OSError:
+        pass
+    try:
+        end = os.lseek(fd, 0, os.SEEK_END) // SECTOR_SIZE * SECTOR_SIZE
+        return ParityLayout.from_header(os.pread(fd, SECTOR_SIZE, end - SECTOR_SIZE)) if end else None
+    except OSError:
+        return None
+
+
+class RepairReport:
+    """The result of repairing an image from its parity"""
+
+    def __init__(self, image, output):
+        self.image = str(image)
+        self.output = str(output)
+        self.layout = None
+        self.unreadable_sectors = []  # Sectors that couldn't be read, as for ScrubReport
+        self.bad_sectors = []  # Sectors that couldn't be read or were wrong
+        self.repaired = []
+        self.errors = []
+
+    @property
+    def unrecoverable(self):
+        return sorted(set(self.bad_sectors) - set(self.repaired))
+
+    @property
+    def passed(self):
+        return not self.errors and not self.unrecoverable
+
+    def summary(self):
+        lines = [f"{self.output}: {'PASS' if self.passed else 'FAIL'}, {len(self.bad_sectors):,} bad sectors, "
+                 f"{len(self.repaired):,} repaired"]
+        lines += [f"  {error}" for error in self.errors]
+        unrecoverable = self.unrecoverable
+        if unrecoverable:
+            lines.append(f"  {len(unrecoverable):,} sectors can't be repaired from {unrecoverable[0]:,}")
+        return "\n".join(lines)
+
+
+def _read_range(fd, start, count, report):
+    """Reads count sectors from sector start a chunk at a time, yielding the first sector and the data of each.
+    Sectors that can't be read, or are past the end, are zeros."""
+    step = SCRUB_READ_SIZE // SECTOR_SIZE
+    for first in range(start, start + count, step):
+        size = min(step, start + count - first) * SECTOR_SIZE
+        try:
+            data = os.pread(fd, size, first * SECTOR_SIZE)
+        except OSError:
+            data = read_sectors(fd, first * SECTOR_SIZE, size, report)[0]
+        yield first, bytes(data).ljust(size, b"\0")
+
+
+def _copy_image(image, output, report):
+    fd = os.open(image, os.O_RDONLY)
+    try:
+        end = os.lseek(fd, 0, os.SEEK_END)
+        with open(output, "wb") as f:
+            for first, data in _read_range(fd, 0, sectors(end), report):
+                f.write(data)
+    finally:
+        os.close(fd)
+
+
+def _read_crc_table(fd, layout, report):
+    """The CRCs of the covered sectors, whether each is known, the bad sectors of both copies of the table and the
+    good copy, or None, of each sector of the table"""
+    copies = []
+    bad = []
+    for start in (layout.crc_start, layout.crc_copy_start):
+        copy = []
+        for first, data in _read_range(fd, start, layout.crc_sectors, report):
+            for offset in range(0, len(data), SECTOR_SIZE):
+                sector = data[offset:offset + SECTOR_SIZE]
+                if zlib.crc32(sector[:-4]) == int.from_bytes(sector[-4:], "little"):
+                    copy.append(sector)
+                else:
+                    copy.append(None)
+                    bad.append(start + len(copy) - 1)
+        copies.append(copy)
+    crcs = np.zeros(layout.covered, dtype="<u4")
+    known = np.ones(layout.covered, dtype=bool)
+    table = [first or second for first, second in zip(*copies)]
+    for i, sector in enumerate(table):
+        index = i * CRCS_PER_SECTOR
+        count = min(CRCS_PER_SECTOR, layout.covered - index)
+        if sector is None:
+            known[index:index + count] = False
+        else:
+            crcs[index:index + count] = np.frombuffer(sector, dtype="<u4", count=count)
+    return crcs, known, bad, table
+
+
+def _find_bad(fd, layout, crcs, known, report):
+    """Covered sectors that can't be read or fail their CRC"""
+    bad = set()
+    for start, count in ((0, layout.data_sectors), (layout.parity_start, layout.parity_sectors)):
+        for first, data in _read_range(fd, start, count, report):
+            index = layout.covered_index(first)
+            found = np.array(_crcs(data), dtype="<u4")
+            failed = (found != crcs[index:index + len(found)]) & known[index:index + len(found)]
+            bad.update((index + np.flatnonzero(failed)).tolist())
+    for sector in report.unreadable_sectors:
+        index = layout.covered_index(sector)
+        if index is not None:
+            bad.add(index)
+    return bad
+
+
+def _runs(groups):
+    """Runs of consecutive codewords in a sorted list, as (position in the list, first codeword, length)"""
+    runs = []
+    for i, group in enumerate(groups):
+        if runs and runs[-1][1] + runs[-1][2] == group:
+            runs[-1][2] += 1
+        else:
+            runs.append([i, group, 1])
+    return runs
+
+
+def _syndromes(fd, layout, groups, lost):
+    """The syndromes of the codewords in groups, a sorted list, with the lost sectors taken as zeros, by Horner's
+    method over the sectors in falling powers of x"""
+    width = len(groups) * SECTOR_SIZE
+    runs = _runs(groups)
+    syndromes = [np.zeros(width, dtype=np.uint8) for _ in range(layout.parity_rows)]
+
+    def add(values):
+        np.bitwise_xor(syndromes[0], values, out=syndromes[0])
+        for j in range(1, layout.parity_rows):
+            _multiply(_EXP[j], syndromes[j], syndromes[j])
+            np.bitwise_xor(syndromes[j], values, out=syndromes[j])
+
+    for row in range(layout.rows):
+        values = bytearray(width)
+        for i, group, length in runs:
+            start = row * layout.groups + group
+            count = max(0, min(length, layout.data_sectors - start))
+            values[i * SECTOR_SIZE:(i + count) * SECTOR_SIZE] = os.pread(fd, count * SECTOR_SIZE,
+                                                                         start * SECTOR_SIZE)
+            for index in range(start, start + count):
+                if index in lost:
+                    offset = (i + index - start) * SECTOR_SIZE
+                    values[offset:offset + SECTOR_SIZE] = bytes(SECTOR_SIZE)
+        add(np.frombuffer(values, dtype=np.uint8))
+    parity = np.zeros((len(groups), layout.parity_rows, SECTOR_SIZE), dtype=np.uint8)
+    for i, group, length in runs:
+        data = os.pread(fd, length * layout.parity_rows * SECTOR_SIZE,
+                        (layout.parity_start + group * layout.parity_rows) * SECTOR_SIZE)
+        parity[i:i + length] = np.frombuffer(data, dtype=np.uint8).reshape(length, layout.parity_rows, SECTOR_SIZE)
+        for index in range(layout.data_sectors + group * layout.parity_rows,
+                           layout.data_sectors + (group + length) * layout.parity_rows):
+            if index in lost:
+                position, t = layout.codeword(index)
+                parity[i + position - group, t] = 0
+    for t in range(layout.parity_rows - 1, -1, -1):
+        add(np.ascontiguousarray(parity[:, t]).reshape(width))
+    return syndromes
+
+
+def _solve(syndromes, i, erasures):
+    """The values of the lost sectors of codeword i of the syndromes, erasures being (index, power of x) of each"""
+    powers = [power for index, power in erasures]
+    inverse = _invert([[_EXP[j * power % 255] for power in powers] for j in range(len(powers))])
+    product = np.empty(SECTOR_SIZE, dtype=np.uint8)
+    values = []
+    for row in inverse:
+        value = np.zeros(SECTOR_SIZE, dtype=np.uint8)
+        for j, factor in enumerate(row):
+            if factor:
+                _multiply(factor, syndromes[j][i * SECTOR_SIZE:(i + 1) * SECTOR_SIZE], product)
+                value ^= product
+        values.append(value.tobytes())
+    return values
+
+
+def repair_image(image, output=None):
+    """Rebuilds the sectors of an ISO image with parity that can't be read or fail their CRC
+    :param image: an ISO image or the block device of a disc
+    :param output: file to write the repaired image to, otherwise image is repaired in place
+    :return: RepairReport"""
+    _check_numpy()
+    output = image if output is None else output
+    report = RepairReport(image, output)
+    if str(output) != str(image):
+        _copy_image(image, output, report)
+    fd = os.open(output, os.O_RDWR)
+    try:
+        layout = report.layout = read_layout(fd)
+        if layout is None:
+            report.errors.append("has no parity, or its header and trailer can't be read")
+            return report
+        end = os.lseek(fd, 0, os.SEEK_END) // SECTOR_SIZE
+        if end < layout.total_sectors:  # Cut short, the rest is lost
+            report.unreadable_sectors.extend(range(end, layout.total_sectors))
+            os.ftruncate(fd, layout.size)
+        header = layout.header_bytes()
+        bad_headers = [sector for sector in (layout.header, layout.trailer) if sector in report.unreadable_sectors
+                       or os.pread(fd, SECTOR_SIZE, sector * SECTOR_SIZE) != header]
+        crcs, known, bad_table, table = _read_crc_table(fd, layout, report)
+        lost = _find_bad(fd, layout, crcs, known, report)
+        report.bad_sectors = sorted(bad_headers + bad_table + [layout.sector(index) for index in lost])
+        codewords = {}
+        for index in sorted(lost):
+            group, power = layout.codeword(index)
+            codewords.setdefault(group, []).append((index, power))
+        recoverable = sorted(group for group, erasures in codewords.items() if len(erasures) <= layout.parity_rows)
+        block = max(1, PARITY_BLOCK_SIZE // (layout.parity_rows * SECTOR_SIZE))
+        for first in range(0, len(recoverable), block):
+            groups = recoverable[first:first + block]
+            syndromes = _syndromes(fd, layout, groups, lost)
+            for i, group in enumerate(groups):
+                for (index, power), value in zip(codewords[group], _solve(syndromes, i, codewords[group])):
+                    if known[index] and zlib.crc32(value) != crcs[index]:
+                        continue  # More was wrong than was found
+                    os.pwrite(fd, value, layout.sector(index) * SECTOR_SIZE)
+                    lost.discard(index)
+                    report.repaired.append(layout.sector(index))
+        for sector in bad_headers:
+            os.pwrite(fd, header, sector * SECTOR_SIZE)
+            report.repaired.append(sector)
+        for sector in bad_table:  # From the other copy, or worked out again from the repaired sectors
+            i = (sector - layout.crc_start) % layout.crc_sectors
+            if table[i] is None:
+                index = i * CRCS_PER_SECTOR
+                count = min(CRCS_PER_SECTOR, layout.covered - index)
+                if not lost.isdisjoint(range(index, index + count)):
+                    continue
+                for covered in range(index, index + count):
+                    crcs[covered] = zlib.crc32(os.pread(fd, SECTOR_SIZE, layout.sector(covered) * SECTOR_SIZE))
+                table[i] = _crc_table(crcs[index:index + count])
+            os.pwrite(fd, table[i], sector * SECTOR_SIZE)
+            report.repaired.append(sector)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    report.repaired.sort()
+    return report
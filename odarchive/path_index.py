@@ -0,0 +1,121 @@
+"""
+An index from the path of every file in a segmented archive to where its data is, so that one file can be got
+from its disc without loading the catalogue.
+
+The index is a text file of JSON lines, each [path, location], sorted by path, so a lookup is a binary search of
+the file by byte offset that reads a few lines rather than the whole file.  Paths are relative to the data
+directory, as they are restored.  The location has the hash, size and disc of the file and where its data is on
+the disc: its UDF path, its offset in the container of packed files or, for a file split over discs, the disc,
+UDF path, size and hash of each part.  Each duplicate has a line of its own pointing at the one copy of the data.
+
+The extent of the data isn't kept as it is only fixed when the image is mastered, and an image can be mastered
+again.  pycdlib finds it from the directory records of the image, so getting a file opens just the image it is on
+and reads only its metadata and the file's own extent.
+"""
+import json
+import os
+from pathlib import PurePosixPath
+
+from .consts import *
+from .restore import Disc, _HashingWriter
+
+PATH_INDEX_FILENAME = "paths.idx"
+DISC_IMAGE_PATTERN = "new_{disc_num:04}.iso"  # As written by write_iso
+
+
+def _location(entry):
+    location = {"hash": entry.file_hash, "size": entry.size}
+    if entry.is_split:
+        location["disc_num"] = min(entry.disc_nums)
+        location["parts"] = [[part.disc_num, str(entry.part_udf_path(part)), part.size, part.file_hash]
+                             for part in sorted(entry.parts, key=lambda part: part.offset)]
+    else:
+        location["disc_num"] = entry.disc_num
+        if entry.is_packed:
+            location["pack_offset"] = entry.pack_offset
+        else:
+            location["udf_path"] = str(entry.udf_absolute_path)
+    return location
+
+
+def write_path_index(hash_db, iso_path_root, filename=PATH_INDEX_FILENAME):
+    """Writes the index of every file in a segmented hash database that has been placed on a disc"""
+    lines = []
+    for entry in hash_db.files():
+        if None in entry.disc_nums:
+            continue  # Added since the archive was segmented
+        location = _location(entry)
+        for path in entry.filenames:
+            relative = str(PurePosixPath(path).relative_to(iso_path_root))
+            lines.append((relative, json.dumps([relative, location], ensure_ascii=False)))
+    lines.sort()
+    temp_filename = f"{filename}.part"
+    with open(temp_filename, "w", encoding="utf-8") as f:
+        for relative, line in lines:
+            f.write(line + "\n")
+    os.replace(temp_filename, filename)
+
+
+def lookup_path(path, filename=PATH_INDEX_FILENAME):
+    """Returns the location of a file, see above, or None if the path isn't in the index"""
+    path = str(PurePosixPath(path)).lstrip("/")
+    with open(filename, "rb") as f:
+        lo, hi = 0, os.fstat(f.fileno()).st_size  # The line of path, if any, starts in [lo, hi)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if mid:
+                f.seek(mid - 1)
+                f.readline()  # To the first line starting at or after mid
+            else:
+                f.seek(0)
+            start = f.tell()
+            line = f.readline()
+            if start >= hi or not line:
+                hi = mid
+                continue
+            key, location = json.loads(line.decode("utf-8"))
+            if key == path:
+                return location
+            if key < path:
+                lo = f.tell()
+            else:
+                hi = mid
+    return None
+
+
+def get_file(path, outfp, images=DISC_IMAGE_PATTERN, index=PATH_INDEX_FILENAME):
+    """Writes a file of the archive to outfp from the disc it is on, checking it against its hash
+    :param images: the ISO image or mounted disc of each disc, with {disc_num} replaced
+    :return: the location of the file from the index"""
+    location = lookup_path(path, index)
+    if location is None:
+        raise odarchiveError(f"{path} is not in the index {index}")
+    whole = HASH_FUNCTION()
+    if "parts" in location:
+        for disc_num, udf_path, size, part_hash in location["parts"]:
+            writer = _HashingWriter(outfp, whole)
+            with _open_disc(images, disc_num) as disc:
+                disc.copy_to(udf_path, writer)
+            if writer.size != size or writer.hexdigest() != part_hash:
+                raise odarchiveError(f"Part of {path} on disc {disc_num} does not match its hash")
+    else:
+        writer = _HashingWriter(outfp, whole)
+        with _open_disc(images, location["disc_num"]) as disc:
+            if "pack_offset" in location:
+                disc.copy_range(f"/{PACK_FILENAME}", location["pack_offset"], location["size"], writer)
+            else:
+                disc.copy_to(location["udf_path"], writer)
+    if whole.hexdigest() != location["hash"]:
+        raise odarchiveError(f"{path} from disc {location['disc_num']} does not match its hash")
+    return location
+
+
+def _open_disc(images, disc_num):
+    disc = Disc(images.format(disc_num=disc_num))
+    try:
+        if disc.disc_num != disc_num:
+            raise odarchiveError(f"{disc.source} is disc {disc.disc_num}, not disc {disc_num}")
+    except Exception:
+        disc.close()
+        raise
+    return disc
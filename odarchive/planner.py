@@ -0,0 +1,186 @@
+"""
+Planning how many discs an archive needs for several disc sizes without segmenting it for each one.
+
+The space each entry takes on a disc is worked out once, in the order next-fit segmentation packs them (priority
+tier then catalogue order), as prefix sums.  Each directory is charged to the first entry in it so an entry that
+starts a disc is also charged for its directories that were charged earlier.  Then for any capacity the end of each
+disc is found by binary searching the prefix sums, so a plan takes O(discs log entries) rather than a pass over
+the entries.
+
+Small files that will be packed have the container charged to them as if it were a directory.  Files that are
+larger than a disc are planned as a disc for each part as they would be split.  The plan is the
+same as next-fit segmentation except where directories are revisited out of catalogue order so it is an
+estimate.
+"""
+from bisect import bisect_right
+
+from .consts import *
+from .file_parts import part_name
+from .image_size import fan_out_cost, file_cost, SECTOR_SIZE
+from .parity import image_capacity
+from .priority import PriorityRules
+
+
+class DiscPlan:
+    """How many discs of a size an archive needs and how full they are"""
+
+    def __init__(self, size, capacity, fills, split_files=0):
+        self.size = size  # As given eg 'bd' or a number of bytes
+        self.capacity = capacity
+        self.fills = fills  # Upper bound of the bytes used on each disc, None if a file can't be split small enough
+        self.split_files = split_files
+
+    @property
+    def num_discs(self):
+        return None if self.fills is None else len(self.fills)
+
+    @property
+    def average_fill(self):
+        return sum(self.fills) / (len(self.fills) * self.capacity)
+
+    @property
+    def last_fill(self):
+        return self.fills[-1] / self.capacity
+
+
+class DiscPlanner:
+    """Precomputes the prefix sums of the space used by each entry of a hash database"""
+
+    def __init__(self, hash_db, catalogue_size, sharded):
+        """
+        :param catalogue_size: bytes reserved on every disc for the catalogue, see Archiver.reserved_catalogue_size
+        :param sharded: plan for a catalogue shard on each disc
+        """
+        self.overhead = hash_db.disc_overhead(catalogue_size, sharded)
+        self.parity = getattr(hash_db, "parity", 0)
+        num_entries = len(hash_db.entries)
+        entries = list(hash_db.files())
+        rules = PriorityRules(getattr(hash_db, "priority_rules", []))
+        tiers = [hash_db.entry_tier(entry, rules) if rules else 0 for entry in entries]
+        order = sorted(range(len(entries)), key=lambda i: tiers[i])  # Stable so catalogue order within a tier
+        self.prefix = [0]
+        self.restart = []  # Cost of the directories of each entry charged before it, for starting a disc with it
+        self.dirs_cost = []
+        self.sizes = []
+        self.names = []
+        self.catalogue_costs = []
+        self.part_manifest_costs = []  # Upper bound of the manifest line of a part of each entry if split
+        self.part_link_costs = []  # Upper bound of the hard links to a part of each entry if split
+        self.tier_starts = []
+        seen = set()
+        for position, i in enumerate(order):
+            entry = entries[i]
+            if position == 0 or tiers[i] != tiers[order[position - 1]]:
+                self.tier_starts.append(position)
+            dirs = hash_db.unit_groups(entry)
+            costs = [hash_db.group_cost(group) for group in dirs]
+            charged = sum(cost for this_dir, cost in zip(dirs, costs) if this_dir not in seen)
+            seen.update(dirs)
+            packed = hash_db.will_pack(entry)
+            catalogue_cost = entry.catalogue_size(num_entries, packed) if sharded else 0
+            self.restart.append(sum(costs) - charged)
+            self.dirs_cost.append(sum(costs))
+            self.sizes.append(entry.size)
+            self.names.append(entry.filename.name)
+            self.catalogue_costs.append(catalogue_cost)
+            udf_path = entry.udf_absolute_path
+            self.part_manifest_costs.append(hash_db.manifest_cost(udf_path.parent / part_name(udf_path.name, 9999)))
+            self.part_link_costs.append(hash_db.link_cost(entry, 9999))
+            data_cost = entry.size if packed else (file_cost(entry.size, entry.filename.name)
+                                                   + hash_db.manifest_cost(entry.udf_absolute_path)
+                                                   + hash_db.link_cost(entry))
+            self.prefix.append(self.prefix[-1] + data_cost + catalogue_cost + charged)
+        # Entries by the space they need on an empty disc, largest first, to find those that need splitting
+        self.largest = sorted(((self.restart[i] + self.prefix[i + 1] - self.prefix[i], i)
+                               for i in range(len(order))), reverse=True)
+
+    def plan(self, size):
+        """Returns a DiscPlan for a disc size, either a name eg 'bd' or a number of bytes"""
+        total = interpret_disc_capacity(size)
+        # A disc must be left with at least one byte free, room for the fan-out and the parity, as in
+        # HashDatabase.capacity
+        capacity = image_capacity(total, self.parity) - self.overhead - fan_out_cost(total) - 1
+        split = {i for needed, i in self.largest[:self._num_too_large(capacity)]}
+        tier_starts = set(self.tier_starts)
+        # Next fit stops at the start of each tier and at each file that has to be split
+        stops = sorted((tier_starts | split | {len(self.sizes)}) - {0})
+        fills = []
+        used = None  # Bytes used on the open disc, None if there isn't one
+        start = 0
+        for stop in stops:
+            if start in tier_starts and used is not None:
+                fills.append(used)
+                used = None
+            if start in split:
+                parts = self._part_costs(start, capacity)
+                if parts is None:
+                    return DiscPlan(size, total, None, len(split))
+                if used is not None:
+                    fills.append(used)
+                fills.extend(parts[:-1])
+                used = parts[-1]
+                start += 1
+            used = self._next_fit(start, stop, capacity, used, fills)
+            start = stop
+        if used is not None:
+            fills.append(used)
+        return DiscPlan(size, total, [fill + self.overhead for fill in fills] or [self.overhead], len(split))
+
+    def _num_too_large(self, capacity):
+        """Number of entries that won't fit on an empty disc"""
+        low, high = 0, len(self.largest)
+        while low < high:
+            middle = (low + high) // 2
+            if self.largest[middle][0] > capacity:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _next_fit(self, start, stop, capacity, used, fills):
+        """Packs entries start to stop - 1 onto discs in order, closing each full disc into fills.  Returns the
+        bytes used on the disc left open."""
+        prefix = self.prefix
+        i = start
+        while i < stop:
+            if used is None:
+                used = self.restart[i]
+            # The entries i to k - 1 fit on the open disc
+            k = bisect_right(prefix, prefix[i] + capacity - used, i, stop + 1) - 1
+            if k == i:  # Not even one so start a new disc
+                fills.append(used)
+                used = None
+                continue
+            used += prefix[k] - prefix[i]
+            i = k
+            if i < stop:
+                fills.append(used)
+                used = None
+        return used
+
+    def _part_costs(self, i, capacity):
+        """Space used by each part of a file that is split as in HashDatabase.split_large_files, or None if no part
+        can fit on a disc"""
+        available = (capacity - self.dirs_cost[i] - file_cost(0, part_name(self.names[i], 9999)) - self.catalogue_costs[i]
+                     - self.part_manifest_costs[i] - self.part_link_costs[i])
+        part_size = (available // SECTOR_SIZE) * SECTOR_SIZE
+        if part_size <= 0:
+            return None
+        result = []
+        for part_num, offset in enumerate(range(0, self.sizes[i], part_size)):
+            this_size = min(part_size, self.sizes[i] - offset)
+            result.append(file_cost(this_size, part_name(self.names[i], part_num)) + self.dirs_cost[i] +
+                          self.catalogue_costs[i] + self.part_manifest_costs[i] + self.part_link_costs[i])
+        return result
+
+
+def format_plan_table(plans):
+    """Returns a text table of DiscPlans"""
+    lines = [f"{'Size':>10} {'Bytes':>19} {'Discs':>7} {'Average fill':>13} {'Last disc':>10}"]
+    for plan in plans:
+        if plan.num_discs is None:
+            lines.append(f"{str(plan.size):>10} {plan.capacity:>19,} {'too small':>7}")
+        else:
+            lines.append(f"{str(plan.size):>10} {plan.capacity:>19,} {plan.num_discs:>7,} "
+                         f"{100 * plan.average_fill:>12.2f}% {100 * plan.last_fill:>9.2f}%")
+    return "\n".join(lines)
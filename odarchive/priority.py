@@ -0,0 +1,92 @@
+"""
+Priority tiers decide which files are archived first eg "backup some critical files first eg my own Photographs".
+
+A rule is written TIER:KIND:VALUE where KIND is one of:
+
+- path, a glob matched against the path of the file below the data directory eg 0:path:Photos/*
+  (as with fnmatch * also matches /)
+- ext, a comma separated list of file extensions eg 1:ext:jpg,raw
+- newer or older, an age in days from the file's mtime eg 2:newer:30
+
+A file is in the lowest tier of the rules it matches and files that match no rule are in the tier after the last
+one.  Each tier is segmented onto its own discs in tier order so tier 0 fills disc 0 first.  The discs of the
+first tiers can then be written while the later tiers are still being hashed and planned, see
+Archiver.convert_to_hash_database and Archiver.add_new_files.
+"""
+from fnmatch import fnmatch
+from pathlib import PurePosixPath
+import time
+
+from .consts import *
+
+PRIORITY_KINDS = ("path", "ext", "newer", "older")
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+class PriorityRule:
+    """A single rule for putting files in a tier"""
+
+    def __init__(self, tier, kind, value):
+        self.tier = tier
+        self.kind = kind
+        self.value = value
+        if kind == "ext":
+            self.extensions = {"." + ext.strip().lstrip(".").lower() for ext in value.split(",")}
+        elif kind in ("newer", "older"):
+            self.seconds = float(value) * SECONDS_PER_DAY
+
+    @classmethod
+    def from_spec(cls, spec):
+        """Parse a rule written TIER:KIND:VALUE"""
+        try:
+            tier, kind, value = str(spec).split(":", 2)
+            tier = int(tier)
+            if tier < 0 or kind not in PRIORITY_KINDS or not value:
+                raise ValueError
+            return cls(tier, kind, value)
+        except ValueError:
+            raise odarchiveError(f"Priority rule {spec} should be TIER:KIND:VALUE with KIND one of "
+                                 f"{', '.join(PRIORITY_KINDS)} eg 0:path:Photos/*")
+
+    @property
+    def spec(self):
+        return f"{self.tier}:{self.kind}:{self.value}"
+
+    def matches(self, relative_path, mtime, now):
+        """relative_path is below the data directory"""
+        if self.kind == "path":
+            return fnmatch(str(relative_path), self.value)
+        elif self.kind == "ext":
+            return PurePosixPath(relative_path).suffix.lower() in self.extensions
+        try:
+            age = now - float(mtime)
+        except (TypeError, ValueError):  # eg loaded from a catalogue with a text mtime
+            return False
+        if self.kind == "newer":
+            return age <= self.seconds
+        else:
+            return age > self.seconds
+
+
+class PriorityRules:
+    """Works out the tier of files from a list of rules"""
+
+    def __init__(self, specs=()):
+        self.rules = [PriorityRule.from_spec(spec) for spec in specs]
+        self.default_tier = max((rule.tier for rule in self.rules), default=-1) + 1
+        self.now = time.time()
+
+    @property
+    def specs(self):
+        return [rule.spec for rule in self.rules]
+
+    def tier(self, relative_paths, mtime):
+        """The tier of a file with one or more paths below the data directory"""
+        result = self.default_tier
+        for rule in self.rules:
+            if rule.tier < result and any(rule.matches(path, mtime, self.now) for path in relative_paths):
+                result = rule.tier
+        return result
+
+    def __bool__(self):
+        return bool(self.rules)
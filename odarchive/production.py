@@ -0,0 +1,127 @@
+"""
+Producing the images of a large set continuously on a small scratch volume.
+
+write_all_isos writes every image before any is used, which for a set of Blu-ray discs can be terabytes of
+scratch space.  produce_images instead masters the discs in order in a background thread and hands each finished
+image to a consumer, eg a command that burns or uploads it, so disc k+1 is mastered while disc k is consumed.  The
+size of each image is known before it is written, see image_size.py, so a disc is only started once it fits in the
+budget alongside the images already on disk; otherwise the producer waits for the consumer to free some space.
+
+An image is only deleted once the consumer reports success.  If it fails the image is kept, production stops and
+odarchiveError is raised.  Progress is kept in the job journal as for write_all_isos, with a disc marked consumed
+once its image has been deleted, so a rerun skips the discs already consumed and consumes the images already
+written, whatever their order, before mastering any more.
+"""
+import os
+import queue
+import shlex
+import subprocess
+import threading
+
+from .consts import *
+
+
+def command_consumer(command):
+    """A consumer that runs a shell command, with {path} and {disc_num} replaced, and succeeds if it exits with 0"""
+
+    def consume(disc_num, path):
+        result = subprocess.run(command.format(path=shlex.quote(str(path)), disc_num=disc_num), shell=True)
+        return result.returncode == 0
+
+    return consume
+
+
+class ScratchBudget:
+    """The bytes of images on disk, which the producer waits on until there is room for the next"""
+
+    def __init__(self, budget, used=0):
+        self.budget = budget
+        self.used = used
+        self.stopped = False
+        self.condition = threading.Condition()
+
+    def reserve(self, size):
+        """Waits until size more bytes fit in the budget
+        :return: False if production was stopped first"""
+        with self.condition:
+            while not self.stopped and self.used + size > self.budget:
+                self.condition.wait()
+            if self.stopped:
+                return False
+            self.used += size
+            return True
+
+    def release(self, size):
+        with self.condition:
+            self.used -= size
+            self.condition.notify_all()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+
+def produce_images(discs, master, consume, budget, journal):
+    """Masters discs in order in a background thread and consumes each image in order as it is finished
+    :param discs: list of (disc_num, filename, image size, contents hash) in the order they are to be consumed, after
+      any whose image is already written
+    :param master: master(disc_num, filename) writes the image of a disc and returns its size and hash
+    :param consume: consume(disc_num, filename) returns True if it succeeded and the image can be deleted
+    :param budget: most bytes of images on disk at once
+    :param journal: the Journal of the job
+    :return: the disc nums consumed"""
+    pending = []  # (disc_num, filename, image size, contents hash, already written)
+    on_disk = 0
+    for disc_num, filename, size, contents_hash in discs:
+        if journal.is_consumed(disc_num, contents_hash):
+            continue
+        written = journal.is_complete(disc_num, contents_hash)
+        if written:
+            on_disk += os.path.getsize(journal.records[disc_num]["path"])
+        elif size > budget:
+            raise odarchiveError(f"The image of disc {disc_num} is {size:,} bytes, more than the budget of "
+                                 f"{budget:,} bytes")
+        pending.append((disc_num, filename, size, contents_hash, written))
+    # The images already written are consumed first, freeing their space, otherwise waiting for room for an earlier
+    # disc that isn't written could wait for ever on a later one that is
+    pending.sort(key=lambda disc: not disc[4])
+    scratch = ScratchBudget(budget, on_disk)
+    ready = queue.Queue()
+
+    def produce():
+        try:
+            for disc_num, filename, size, contents_hash, written in pending:
+                if not written:
+                    if not scratch.reserve(size):
+                        return
+                    journal.record(disc_num, contents_hash, filename)
+                    image_size, image_hash = master(disc_num, filename)
+                    scratch.release(size - image_size)
+                    journal.record(disc_num, contents_hash, filename, image_size, image_hash, complete=True)
+                ready.put(journal.records[disc_num])
+        except Exception as e:
+            ready.put(e)
+        finally:
+            ready.put(None)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    consumed = []
+    try:
+        for record in iter(ready.get, None):
+            if isinstance(record, Exception):
+                raise record
+            disc_num, filename = record["disc_num"], record["path"]
+            if not consume(disc_num, filename):
+                raise odarchiveError(f"Consuming disc {disc_num} failed so its image {filename} has been kept")
+            size = os.path.getsize(filename)
+            os.remove(filename)
+            journal.record(disc_num, record["contents_hash"], filename, record["size"], record["image_hash"],
+                           complete=True, consumed=True)
+            scratch.release(size)
+            consumed.append(disc_num)
+    finally:
+        scratch.stop()
+        producer.join()
+    return consumed
@@ -0,0 +1,320 @@
+"""
+Restoring files from written discs.
+
+A disc can be given as its ISO image, the block device of the drive it is in or the directory it is mounted on.
+Each file is checked against its hash as it is written.  A file that was split over several discs is joined back
+together from its parts and each part is checked as well as the whole file.  A small file that was packed is read
+from its offset in the container on its disc.
+
+BulkRestore restores a selection of files reading each disc needed once, see below.  A single file can also be got
+through the path index, see path_index.py.
+"""
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from itertools import groupby
+import os
+from pathlib import Path, PurePosixPath
+import shutil
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Not on Windows, where duplicates are hard links or copies
+    fcntl = None
+import pycdlib
+
+from .consts import *
+from .disc_info import load_disc_info_from_json
+from .file_parts import READ_SIZE
+from .image_size import SECTOR_SIZE
+from .journal import hash_image
+
+RESTORE_THREADS = 4  # Writer threads
+FICLONE = 0x40049409  # Linux ioctl to share the blocks of one file with another
+
+
+class Disc:
+    """Read access to the files on a written disc"""
+
+    def __init__(self, source):
+        self.source = Path(source)
+        if self.source.is_file() or self.source.is_block_device():  # An image or a disc in a drive
+            self.iso = pycdlib.PyCdlib()
+            self.iso.open(str(self.source))
+        elif self.source.is_dir():
+            self.iso = None
+        else:
+            raise odarchiveError(f"{source} is neither an ISO image nor a mounted disc")
+
+    def copy_to(self, udf_path, outfp):
+        """Copy a file on the disc to outfp"""
+        if self.iso is not None:
+            self.iso.get_file_from_iso_fp(outfp, udf_path=str(udf_path))
+        else:
+            with open(self.source / PurePosixPath(udf_path).relative_to("/"), "rb") as f:
+                shutil.copyfileobj(f, outfp, READ_SIZE)
+
+    def copy_range(self, udf_path, offset, size, outfp):
+        """Copy size bytes from offset in a file on the disc to outfp"""
+        if self.iso is not None:
+            with self.iso.open_file_from_iso(udf_path=str(udf_path)) as f:
+                f.seek(offset)
+                _copy_bytes(f, outfp, size)
+        else:
+            with open(self.source / PurePosixPath(udf_path).relative_to("/"), "rb") as f:
+                f.seek(offset)
+                _copy_bytes(f, outfp, size)
+
+    def open(self, udf_path):
+        """A file object to read a file on the disc"""
+        if self.iso is not None:
+            return self.iso.open_file_from_iso(udf_path=str(udf_path))
+        return open(self.source / PurePosixPath(udf_path).relative_to("/"), "rb")
+
+    def extent(self, udf_path):
+        """Where a file starts on the disc in bytes, or None if it isn't known as the disc is mounted"""
+        if self.iso is None:
+            return None
+        inode = self.iso.get_record(udf_path=str(udf_path)).inode
+        return None if inode is None else inode.extent_location() * SECTOR_SIZE
+
+    def read(self, udf_path):
+        """Returns the contents of a small file on the disc eg the catalogue"""
+        result = BytesIO()
+        self.copy_to(udf_path, result)
+        return result.getvalue()
+
+    @property
+    def disc_num(self):
+        disc_info = load_disc_info_from_json(json_data=self.read(f"/{DISC_INFO_FILENAME}").decode("utf-8"))
+        return disc_info.disc_num
+
+    def close(self):
+        if self.iso is not None:
+            self.iso.close()
+            self.iso = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _copy_bytes(f, outfp, size):
+    while size > 0:
+        data = f.read(min(size, READ_SIZE))
+        if not data:
+            break  # Short, which is caught by the hash check
+        outfp.write(data)
+        size -= len(data)
+
+
+class _HashingWriter:
+    """Passes writes on to a file while hashing them, optionally also into the hash of the whole file"""
+
+    def __init__(self, f, whole=None):
+        self.f = f
+        self.whole = whole
+        self.hasher = HASH_FUNCTION()
+        self.size = 0
+
+    def write(self, data):
+        self.hasher.update(data)
+        if self.whole is not None:
+            self.whole.update(data)
+        self.size += len(data)
+        return self.f.write(data)
+
+    def hexdigest(self):
+        return self.hasher.hexdigest()
+
+
+class _Read:
+    """A run of bytes of a file on a disc that is restored to an offset of a file and checked against a hash"""
+
+    def __init__(self, udf_path, offset, size, file_hash, target, out_offset, truncate, label, order):
+        self.udf_path = str(udf_path)
+        self.offset = offset
+        self.size = size
+        self.file_hash = file_hash
+        self.target = target
+        self.out_offset = out_offset
+        self.truncate = truncate  # Rather than a part of the file
+        self.label = label
+        self.order = order  # Position in the catalogue, for a mounted disc where the extent isn't known
+
+
+class _Output:
+    """A file being written by the writer threads, closed once it has been read and every write is done"""
+
+    def __init__(self, path, truncate):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | (os.O_TRUNC if truncate else 0), 0o666)
+        self.pending = 1  # The read until finish is called
+        self.lock = threading.Lock()
+
+    def write(self, data, offset):
+        try:
+            view = memoryview(data)
+            while len(view):
+                written = os.pwrite(self.fd, view, offset)
+                view = view[written:]
+                offset += written
+        finally:
+            self.finish()
+
+    def submit(self, executor, data, offset):
+        with self.lock:
+            self.pending += 1
+        return executor.submit(self.write, data, offset)
+
+    def finish(self):
+        with self.lock:
+            self.pending -= 1
+            if self.pending == 0:
+                os.close(self.fd)
+
+
+def _duplicate(source, target, reflink=False):
+    """Recreates a duplicate of a restored file as a hard link, or a reflink, falling back to a copy where the file
+    system can't"""
+    target.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        target.unlink()
+    except FileNotFoundError:
+        pass
+    try:
+        if not reflink:
+            os.link(source, target)
+            return
+        if fcntl is not None:
+            with open(source, "rb") as src, open(target, "wb") as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return
+    except OSError:
+        pass  # eg another file system, or one without reflinks
+    shutil.copyfile(str(source), str(target))
+
+
+class BulkRestore:
+    """Restores a selection of files from a set of discs.  Each disc needed is read once, in disc number order, and
+    the files on it in the order of their extents so an optical drive reads it from start to end.  The data is
+    hashed as it is read and written to the restored files by a pool of writer threads.  A file split over discs
+    is written part by part at its offsets as each disc is read and then checked as a whole.  Duplicates are only
+    read once and recreated as hard links, or reflinks."""
+
+    def __init__(self, selection, discs, threads=RESTORE_THREADS, reflink=False):
+        """
+        :param selection: list of (HashFileEntry, list of paths to restore it to)
+        :param discs: dictionary of disc number to an ISO image or the directory a disc is mounted on
+        :param reflink: recreate duplicates as reflinks rather than hard links
+        """
+        self.discs = discs
+        self.threads = max(1, threads)
+        self.reflink = reflink
+        self.reads = defaultdict(list)  # Disc number to _Reads
+        self.selected = []  # (HashFileEntry, targets) that have all their discs
+        self.missing_discs = set()
+        for order, (entry, targets) in enumerate(selection):
+            if not entry.disc_nums <= set(discs):
+                self.missing_discs |= entry.disc_nums - set(discs) - {None}
+                continue
+            self.selected.append((entry, targets))
+            if entry.is_split:
+                offset = 0
+                for part in sorted(entry.parts, key=lambda part: part.offset):
+                    if part.offset != offset:
+                        raise odarchiveError(f"Parts of {entry.filename} do not join up at offset {offset:,}")
+                    offset += part.size
+                    self.reads[part.disc_num].append(
+                        _Read(entry.part_udf_path(part), 0, part.size, part.file_hash, targets[0], part.offset,
+                              False, f"Part {part.part_num} of {entry.filename} on disc {part.disc_num}", order))
+            elif entry.is_packed:
+                self.reads[entry.disc_num].append(
+                    _Read(f"/{PACK_FILENAME}", entry.pack_offset, entry.size, entry.file_hash, targets[0], 0, True,
+                          f"Restored {entry.filename}", order))
+            else:
+                self.reads[entry.disc_num].append(
+                    _Read(entry.udf_absolute_path, 0, entry.size, entry.file_hash, targets[0], 0, True,
+                          f"Restored {entry.filename}", order))
+
+    @property
+    def disc_order(self):
+        """The discs needed, each once"""
+        return sorted(self.reads)
+
+    def disc_bytes(self, disc_num):
+        return sum(read.size for read in self.reads[disc_num])
+
+    def run(self):
+        """:return: list of the files restored"""
+        for entry, targets in self.selected:
+            if entry.is_split:  # Written a part at a time so start empty
+                _Output(targets[0], True).finish()
+        errors = []  # From the writer threads
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            for disc_num in self.disc_order:
+                with Disc(self.discs[disc_num]) as disc:
+                    self._restore_disc(disc, self.reads[disc_num], executor, errors)
+        if errors:
+            raise errors[0]
+        restored = []
+        for entry, targets in self.selected:
+            if entry.is_split and hash_image(targets[0]) != entry.file_hash:
+                targets[0].unlink()
+                raise odarchiveError(f"Restored {entry.filename} does not match its hash")
+            for target in targets[1:]:
+                _duplicate(targets[0], target, self.reflink)
+            restored.extend(targets)
+        return restored
+
+    def _restore_disc(self, disc, reads, executor, errors):
+        in_flight = threading.BoundedSemaphore(2 * self.threads)  # Buffers waiting to be written
+
+        def written(future):
+            if future.exception() is not None:
+                errors.append(future.exception())
+            in_flight.release()
+
+        extents = {read.udf_path: disc.extent(read.udf_path) for read in reads}
+
+        def disc_order(read):
+            """Extent order, or for a mounted disc the packed files and then catalogue order"""
+            packed = read.udf_path == f"/{PACK_FILENAME}"
+            return extents[read.udf_path] or 0, not packed, 0 if packed else read.order, read.offset
+
+        reads = sorted(reads, key=disc_order)
+        for udf_path, file_reads in groupby(reads, key=lambda read: read.udf_path):  # Eg the packed files
+            file_reads = list(file_reads)
+            if not any(read.size for read in file_reads):
+                with BytesIO() as f:  # Only empty files
+                    self._restore_reads(f, file_reads, executor, in_flight, written, errors)
+            else:
+                with disc.open(udf_path) as f:
+                    self._restore_reads(f, file_reads, executor, in_flight, written, errors)
+
+    @staticmethod
+    def _restore_reads(f, reads, executor, in_flight, written, errors):
+        for read in reads:
+            output = _Output(read.target, read.truncate)
+            hasher = HASH_FUNCTION()
+            size = 0
+            try:
+                f.seek(read.offset)
+                while size < read.size:
+                    data = f.read(min(read.size - size, READ_SIZE))
+                    if not data:
+                        break  # Short, which is caught by the hash check
+                    hasher.update(data)
+                    in_flight.acquire()
+                    output.submit(executor, data, read.out_offset + size).add_done_callback(written)
+                    size += len(data)
+            finally:
+                output.finish()
+            if errors:
+                raise errors[0]
+            if size != read.size or hasher.hexdigest() != read.file_hash:
+                read.target.unlink()
+                raise odarchiveError(f"{read.label} does not match its hash")
@@ -0,0 +1,218 @@
+"""
+Scrubbing a written disc to measure how its media is wearing.
+
+Where verify only reads the extents of the files, a scrub reads the whole of an ISO image or a burned disc from
+its block device, start to end in large reads, so it runs at the full sequential speed of the device and every
+sector is read, metadata included.  The data of each file is hashed as the read passes over its extent and
+checked against the catalogue.  A read that fails is retried a sector at a time so each unreadable sector is
+found, and zeros put in its place so the read can carry on past it.  The throughput is sampled every
+sample_bytes, so a disc that is decaying shows up as slow reads, as the drive retries, before it shows up as
+errors.
+
+A mounted disc can't be read raw, so its files are read through the file system in catalogue order instead.
+
+The result is a ScrubReport, which is a VerifyReport with the unreadable sectors and the throughput samples and
+can be written as JSON.
+"""
+import json
+import os
+import time
+
+import pycdlib
+
+from .consts import *
+from .image_size import SECTOR_SIZE
+from .verify import locate_checks, VerifyReport
+
+SCRUB_READ_SIZE = 4 * 1024 * 1024  # Most read at once, a multiple of SECTOR_SIZE
+SAMPLE_BYTES = 256 * 1024 * 1024  # Read between throughput samples
+SCRUB_WORKERS = 2  # Images scrubbed at once
+MB = 1024 * 1024
+
+
+class ScrubReport(VerifyReport):
+    """The result of scrubbing an image or disc"""
+
+    def __init__(self, image, disc_num):
+        super().__init__(image, disc_num)
+        self.unreadable_sectors = []  # Sector numbers
+        self.samples = []  # (bytes read, seconds since the start, MB/s since the last sample)
+        self.bytes_read = 0
+        self.seconds = 0.0
+
+    @property
+    def passed(self):
+        return super().passed and not self.unreadable_sectors
+
+    def summary(self):
+        lines = [super().summary()]
+        if self.seconds:
+            rates = sorted(rate for offset, seconds, rate in self.samples) or [0.0]
+            lines.append(f"  {self.bytes_read:,} bytes read in {self.seconds:.1f} s, "
+                         f"{self.bytes_read / MB / self.seconds:.1f} MB/s (slowest {rates[0]:.1f}, "
+                         f"median {rates[len(rates) // 2]:.1f}, fastest {rates[-1]:.1f})")
+        if self.unreadable_sectors:
+            lines.append(f"  {len(self.unreadable_sectors):,} unreadable sectors from {self.unreadable_sectors[0]:,}")
+        return "\n".join(lines)
+
+    def to_dict(self):
+        return {
+            "image": self.image,
+            "disc_num": self.disc_num,
+            "passed": self.passed,
+            "files": len(self.checks),
+            "bytes_read": self.bytes_read,
+            "seconds": round(self.seconds, 3),
+            "errors": self.errors,
+            "mismatches": [{"name": check.name, "udf_path": check.udf_path, "error": check.error}
+                           for check in self.failures],
+            "unreadable_sectors": self.unreadable_sectors,
+            "throughput": [{"offset": offset, "seconds": round(seconds, 3), "mb_per_s": round(rate, 1)}
+                           for offset, seconds, rate in self.samples],
+        }
+
+
+class _Sampler:
+    """Records the throughput every sample_bytes"""
+
+    def __init__(self, report, sample_bytes, clock):
+        self.report = report
+        self.sample_bytes = max(1, sample_bytes)
+        self.clock = clock
+        self.start = self.last_time = clock()
+        self.last_bytes = 0
+
+    def add(self, size, final=False):
+        self.report.bytes_read += size
+        if final or self.report.bytes_read - self.last_bytes >= self.sample_bytes:
+            now = self.clock()
+            if self.report.bytes_read > self.last_bytes:
+                rate = (self.report.bytes_read - self.last_bytes) / MB / max(now - self.last_time, 1e-9)
+                self.report.samples.append((self.report.bytes_read, now - self.start, rate))
+            self.last_time = now
+            self.last_bytes = self.report.bytes_read
+            self.report.seconds = now - self.start
+
+
+def read_sectors(fd, position, size, report):
+    """Reads a range a sector at a time after a read of all of it failed, recording the sectors that can't be read.
+    Also used by repair_image in parity.py.
+    :param report: anything with a list of unreadable_sectors to add to
+    :return: the data with zeros for the unreadable sectors, and the unreadable ranges"""
+    data = bytearray(size)
+    unreadable = []
+    for offset in range(0, size, SECTOR_SIZE):
+        length = min(SECTOR_SIZE, size - offset)
+        try:
+            sector = os.pread(fd, length, position + offset)
+        except OSError:
+            report.unreadable_sectors.append((position + offset) // SECTOR_SIZE)
+            unreadable.append((position + offset, position + offset + length))
+            continue
+        data[offset:offset + len(sector)] = sector
+    return data, unreadable
+
+
+def _scrub_raw(image, report, sample_bytes, clock):
+    checks = sorted((check for check in report.checks if check.location is not None),
+                    key=lambda check: check.location)
+    for check in checks:
+        if check.size == 0:
+            check.finish()
+    checks = [check for check in checks if check.size > 0]
+    sampler = _Sampler(report, sample_bytes, clock)
+    fd = os.open(image, os.O_RDONLY)
+    try:
+        end = os.lseek(fd, 0, os.SEEK_END)
+        position = 0
+        first = 0  # The first check not yet finished
+        read_size = max(SECTOR_SIZE, min(SCRUB_READ_SIZE, sample_bytes) // SECTOR_SIZE * SECTOR_SIZE)
+        while position < end:
+            size = min(read_size, end - position)
+            unreadable = []
+            try:
+                data = os.pread(fd, size, position)
+            except OSError:
+                data, unreadable = read_sectors(fd, position, size, report)
+            if not data:
+                break  # Cut short, the checks not finished are caught by their size
+            view = memoryview(data)
+            read_end = position + len(data)
+            i = first
+            while i < len(checks) and checks[i].location < read_end:
+                check = checks[i]
+                check_end = check.location + check.size
+                if check_end > position:
+                    start = max(check.location, position)
+                    stop = min(check_end, read_end)
+                    check.update(view[start - position:stop - position])
+                    if check.error is None and any(start < bad_end and bad_start < stop
+                                                   for bad_start, bad_end in unreadable):
+                        check.error = "has unreadable sectors"
+                    if check_end <= read_end:
+                        check.finish()
+                if i == first and check_end <= read_end:
+                    first += 1
+                i += 1
+            sampler.add(len(data))
+            position = read_end
+    finally:
+        os.close(fd)
+        sampler.add(0, final=True)
+        for check in checks:
+            if check.read < check.size:
+                check.finish()
+
+
+def _scrub_mounted(mount_point, report, sample_bytes, clock):
+    sampler = _Sampler(report, sample_bytes, clock)
+    try:
+        for check in report.checks:
+            filename = os.path.join(mount_point, check.udf_path.lstrip("/"))
+            try:
+                with open(filename, "rb") as f:
+                    f.seek(check.offset)
+                    while check.read < check.size:
+                        data = f.read(min(SCRUB_READ_SIZE, check.size - check.read))
+                        if not data:
+                            break
+                        check.update(data)
+                        sampler.add(len(data))
+            except FileNotFoundError:
+                check.error = "is missing"
+            except OSError as e:
+                check.error = f"can't be read at offset {check.offset + check.read:,}: {e}"
+            check.finish()
+    finally:
+        sampler.add(0, final=True)
+
+
+def scrub_image(image, checks, disc_num=None, sample_bytes=SAMPLE_BYTES, clock=time.perf_counter):
+    """Reads all of an ISO image, burned disc or mounted disc and checks every file on it
+    :param image: an ISO image, the block device of a disc or the directory it is mounted on
+    :param checks: FileCheck for each file that should be on the disc
+    :param sample_bytes: bytes read between throughput samples
+    :return: ScrubReport"""
+    report = ScrubReport(image, disc_num)
+    report.checks = list(checks)
+    if os.path.isdir(image):
+        _scrub_mounted(image, report, sample_bytes, clock)
+        return report
+    iso = pycdlib.PyCdlib()
+    try:
+        iso.open(str(image))
+        try:
+            locate_checks(iso, report.checks)
+        finally:
+            iso.close()
+    except Exception as e:  # The directories can't be read, the sectors are still scrubbed
+        report.errors.append(f"can't be opened: {e}")
+        for check in report.checks:
+            if check.error is None and check.location is None:
+                check.error = "can't be found"
+    _scrub_raw(str(image), report, sample_bytes, clock)
+    return report
+
+
+def reports_json(reports):
+    return json.dumps([report.to_dict() for report in reports], indent=4)
@@ -0,0 +1,349 @@
+"""
+Strategies for packing files onto discs.
+
+Each strategy takes a list of the sizes of the things to be packed (the space each file takes up on a disc
+including overhead) and the space available on each disc.  It returns a list of the same length with the disc
+number for each item.
+
+- next-fit, is the original method, files are put on discs in catalogue order.  A new disc is started as soon as
+  a file does not fit and an earlier disc is never gone back to.
+- first-fit, files are sorted largest first and each is put on the first disc it fits on.  Discs are held in a
+  tree of free space so finding that disc is O(log discs).
+- best-fit, files are sorted largest first and each is put on the disc with the least free space it fits on.
+- locality, keeps directories together so that restoring a directory needs as few discs as possible.  The size
+  of each directory subtree is rolled up and every subtree that fits on a disc is packed as a single item, first
+  fit largest first.  Only directories that are larger than a disc are split, into their own files and then
+  each of their sub directories in turn.
+
+A balancing pass can then be run which moves files from the fullest to the emptiest discs without changing
+the number of discs.  This is useful so that the last disc isn't nearly empty.
+
+Items can also belong to groups, eg the directories a file is in, which cost space once on each disc that has
+any item of the group.  When looking for a disc an item is costed as if none of its groups are there yet.  The
+locality strategy needs the groups of each item to be its directories, nearest first.
+"""
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict
+import heapq
+
+from .consts import odarchiveError
+
+NEXT_FIT = "next-fit"
+FIRST_FIT = "first-fit"
+BEST_FIT = "best-fit"
+LOCALITY = "locality"
+SEGMENT_STRATEGIES = (NEXT_FIT, FIRST_FIT, BEST_FIT, LOCALITY)
+
+
+class FreeSpaceTree:
+    """A max segment tree over the free space of each disc.  Used to find the first disc with enough free
+    space in O(log discs).  Grows by doubling as discs are added."""
+
+    def __init__(self):
+        self.leaves = 1
+        self.tree = [-1] * 2  # -1 marks a disc that doesn't exist yet
+        self.num_discs = 0
+
+    def add_disc(self, free):
+        """Add a new disc with free bytes, returns its disc number"""
+        if self.num_discs == self.leaves:
+            old_leaves = self.tree[self.leaves:]
+            self.leaves *= 2
+            self.tree = [-1] * (2 * self.leaves)
+            self.tree[self.leaves:self.leaves + len(old_leaves)] = old_leaves
+            for i in range(self.leaves - 1, 0, -1):
+                self.tree[i] = max(self.tree[2 * i], self.tree[2 * i + 1])
+        disc_num = self.num_discs
+        self.num_discs += 1
+        self._set(disc_num, free)
+        return disc_num
+
+    def use(self, disc_num, size):
+        """Reduce the free space on a disc"""
+        self._set(disc_num, self.tree[self.leaves + disc_num] - size)
+
+    def free(self, disc_num):
+        return self.tree[self.leaves + disc_num]
+
+    def _set(self, disc_num, free):
+        i = self.leaves + disc_num
+        self.tree[i] = free
+        i //= 2
+        while i:
+            self.tree[i] = max(self.tree[2 * i], self.tree[2 * i + 1])
+            i //= 2
+
+    def first_fit(self, size):
+        """Returns the first disc with at least size bytes free or None if there isn't one"""
+        if self.tree[1] < size:
+            return None
+        i = 1
+        while i < self.leaves:
+            i = 2 * i if self.tree[2 * i] >= size else 2 * i + 1
+        return i - self.leaves
+
+
+class DiscGroups:
+    """Counts the items of each group on each disc so that a group's cost is only charged once per disc"""
+
+    def __init__(self, groups, group_costs, chains=None):
+        self.groups = groups  # For each item a tuple of groups
+        self.group_costs = group_costs  # group -> bytes
+        # For each item the directories of its own path, nearest first, which locality keeps together
+        self.chains = groups if chains is None else chains
+        self.counts = []  # For each disc, group -> number of items
+
+    def worst(self, i):
+        """Cost of the groups of item i on a disc that has none of them"""
+        return sum(self.group_costs[group] for group in self.groups[i])
+
+    def extra(self, i, disc_num):
+        """Cost of the groups of item i that aren't on a disc yet"""
+        if disc_num >= len(self.counts):
+            return self.worst(i)
+        counts = self.counts[disc_num]
+        return sum(self.group_costs[group] for group in self.groups[i] if group not in counts)
+
+    def add(self, i, disc_num):
+        """Put item i on a disc, returns the cost of the groups this adds"""
+        while disc_num >= len(self.counts):
+            self.counts.append({})
+        result = self.extra(i, disc_num)
+        counts = self.counts[disc_num]
+        for group in self.groups[i]:
+            counts[group] = counts.get(group, 0) + 1
+        return result
+
+    def remove(self, i, disc_num):
+        """Take item i off a disc, returns the cost of the groups that are no longer needed"""
+        result = 0
+        counts = self.counts[disc_num]
+        for group in self.groups[i]:
+            counts[group] -= 1
+            if not counts[group]:
+                del counts[group]
+                result += self.group_costs[group]
+        return result
+
+
+def _check_fits(sizes, capacity, disc_groups):
+    largest = max((size + disc_groups.worst(i) for i, size in enumerate(sizes)), default=0)
+    if largest > capacity:
+        raise odarchiveError(f"Disc too small, {capacity:,} bytes available but need {largest:,} for largest file.")
+
+
+def _largest_first(sizes, disc_groups):
+    return sorted(range(len(sizes)), key=lambda i: sizes[i] + disc_groups.worst(i), reverse=True)
+
+
+def next_fit(sizes, capacity, disc_groups=None):
+    disc_groups = disc_groups or DiscGroups([()] * len(sizes), {})
+    _check_fits(sizes, capacity, disc_groups)
+    result = []
+    disc_num = 0
+    used = 0
+    for i, size in enumerate(sizes):
+        if used + size + disc_groups.extra(i, disc_num) > capacity:
+            disc_num += 1
+            used = 0
+        result.append(disc_num)
+        used += size + disc_groups.add(i, disc_num)
+    return result
+
+
+def first_fit_decreasing(sizes, capacity, disc_groups=None):
+    disc_groups = disc_groups or DiscGroups([()] * len(sizes), {})
+    _check_fits(sizes, capacity, disc_groups)
+    result = [None] * len(sizes)
+    discs = FreeSpaceTree()
+    for i in _largest_first(sizes, disc_groups):
+        disc_num = discs.first_fit(sizes[i] + disc_groups.worst(i))
+        if disc_num is None:
+            disc_num = discs.add_disc(capacity)
+        discs.use(disc_num, sizes[i] + disc_groups.add(i, disc_num))
+        result[i] = disc_num
+    return result
+
+
+def best_fit_decreasing(sizes, capacity, disc_groups=None):
+    disc_groups = disc_groups or DiscGroups([()] * len(sizes), {})
+    _check_fits(sizes, capacity, disc_groups)
+    result = [None] * len(sizes)
+    free = []  # Sorted list of (free bytes, disc_num)
+    num_discs = 0
+    for i in _largest_first(sizes, disc_groups):
+        position = bisect_left(free, (sizes[i] + disc_groups.worst(i), -1))
+        if position == len(free):
+            disc_num = num_discs
+            num_discs += 1
+            disc_free = capacity
+        else:
+            disc_free, disc_num = free.pop(position)
+        insort(free, (disc_free - sizes[i] - disc_groups.add(i, disc_num), disc_num))
+        result[i] = disc_num
+    return result
+
+
+def balance(sizes, assignment, capacity, disc_groups=None):
+    """Moves files from the fullest disc to the emptiest, largest file that narrows the gap first, until the
+    gap can't be narrowed any further.  The number of discs is not changed.  Returns the new assignment."""
+    result = list(assignment)
+    if not result:
+        return result
+    disc_groups = disc_groups or DiscGroups([()] * len(sizes), {})
+    num_discs = max(result) + 1
+    fills = [0] * num_discs
+    items = [[] for _ in range(num_discs)]  # Sorted (size, item) on each disc
+    for i, disc_num in enumerate(result):
+        fills[disc_num] += sizes[i] + disc_groups.add(i, disc_num)
+        items[disc_num].append((sizes[i], i))
+    for disc_items in items:
+        disc_items.sort()
+    fullest = [(-fill, disc_num) for disc_num, fill in enumerate(fills)]
+    emptiest = [(fill, disc_num) for disc_num, fill in enumerate(fills)]
+    heapq.heapify(fullest)
+    heapq.heapify(emptiest)
+    for _ in range(len(sizes)):
+        # Heaps are lazily updated so throw away stale entries
+        while -fullest[0][0] != fills[fullest[0][1]]:
+            heapq.heappop(fullest)
+        while emptiest[0][0] != fills[emptiest[0][1]]:
+            heapq.heappop(emptiest)
+        source = fullest[0][1]
+        target = emptiest[0][1]
+        gap = fills[source] - fills[target]
+        # Moving a file of size s leaves a gap of |gap - 2s| so the best is the largest file up to half the gap
+        # but any file smaller than the gap helps.
+        position = bisect_right(items[source], (gap // 2, len(sizes))) - 1
+        if position < 0:
+            position = 0
+        if not items[source] or not 0 < items[source][position][0] < gap:
+            break
+        size, i = items[source][position]
+        if fills[target] + size + disc_groups.extra(i, target) >= fills[source]:
+            break  # The groups it would need on the target disc use up the gap
+        del items[source][position]
+        insort(items[target], (size, i))
+        fills[source] -= size + disc_groups.remove(i, source)
+        fills[target] += size + disc_groups.add(i, target)
+        result[i] = target
+        heapq.heappush(fullest, (-fills[source], source))
+        heapq.heappush(fullest, (-fills[target], target))
+        heapq.heappush(emptiest, (fills[source], source))
+        heapq.heappush(emptiest, (fills[target], target))
+    return result
+
+
+def subtree_chunks(sizes, groups, group_costs, capacity, chains=None):
+    """Divides the items into chunks that each fit on a disc.  A chunk is a whole directory subtree if that fits,
+    otherwise the files directly in a directory are chunked in order and then each of its sub directories.
+    :param groups: for each item all the groups it needs on its disc
+    :param chains: for each item the directories of its own path, nearest first, with () for the root directory,
+      which make up the tree.  Defaults to groups.  Any other groups of an item, eg the directories of hard links
+      to it, are charged to the item in full.
+    :return: list of lists of items in directory order"""
+    if chains is None:
+        chains = groups
+    files = defaultdict(list)  # directory -> items directly in it, None is the root
+    subdirs = defaultdict(set)
+    sizes = list(sizes)
+    for i, chain in enumerate(chains):
+        files[chain[0] if chain else None].append(i)
+        path = (None,) + tuple(reversed(chain))
+        for parent, child in zip(path, path[1:]):
+            subdirs[parent].add(child)
+        sizes[i] += sum(group_costs[group] for group in groups[i] if group not in chain)
+    # Roll up the size of each subtree, deepest first, and the cost of the directories above it
+    path_cost = {None: 0}
+    order = [None]
+    for this_dir in order:
+        for child in sorted(subdirs[this_dir]):
+            path_cost[child] = path_cost[this_dir] + group_costs[child]
+            order.append(child)
+    rollup = {}
+    for this_dir in reversed(order):
+        rollup[this_dir] = (sum(sizes[i] for i in files[this_dir]) +
+                            sum(rollup[child] + group_costs[child] for child in subdirs[this_dir]))
+
+    def subtree_items(this_dir):
+        result = list(files[this_dir])
+        for child in sorted(subdirs[this_dir]):
+            result.extend(subtree_items(child))
+        return result
+
+    chunks = []
+    stack = [None]
+    while stack:
+        this_dir = stack.pop()
+        if rollup[this_dir] + path_cost[this_dir] <= capacity:
+            chunks.append(subtree_items(this_dir))
+            continue
+        chunk, used = [], path_cost[this_dir]
+        for i in files[this_dir]:
+            if chunk and used + sizes[i] > capacity:
+                chunks.append(chunk)
+                chunk, used = [], path_cost[this_dir]
+            chunk.append(i)
+            used += sizes[i]
+        if chunk:
+            chunks.append(chunk)
+        stack.extend(sorted(subdirs[this_dir], reverse=True))  # Popped in name order
+    return chunks
+
+
+def locality(sizes, capacity, disc_groups=None):
+    disc_groups = disc_groups or DiscGroups([()] * len(sizes), {})
+    _check_fits(sizes, capacity, disc_groups)
+    chunks = subtree_chunks(sizes, disc_groups.groups, disc_groups.group_costs, capacity, disc_groups.chains)
+    chunk_sizes, chunk_groups = _chunk_items(chunks, sizes, disc_groups.groups)
+    chunk_assignment = first_fit_decreasing(chunk_sizes, capacity, DiscGroups(chunk_groups, disc_groups.group_costs))
+    return _unchunk(chunks, chunk_assignment, len(sizes))
+
+
+def _chunk_items(chunks, sizes, groups):
+    """Sizes and groups of chunks of items so that they can be packed as single items"""
+    chunk_sizes = [sum(sizes[i] for i in chunk) for chunk in chunks]
+    chunk_groups = [tuple({group: None for i in chunk for group in groups[i]}) for chunk in chunks]
+    return chunk_sizes, chunk_groups
+
+
+def _unchunk(chunks, chunk_assignment, num_items):
+    result = [None] * num_items
+    for chunk, disc_num in zip(chunks, chunk_assignment):
+        for i in chunk:
+            result[i] = disc_num
+    return result
+
+
+PACKERS = {
+    NEXT_FIT: next_fit,
+    FIRST_FIT: first_fit_decreasing,
+    BEST_FIT: best_fit_decreasing,
+    LOCALITY: locality,
+}
+
+
+def pack(sizes, capacity, strategy=NEXT_FIT, balanced=False, groups=None, group_costs=None, chains=None):
+    """Returns the disc number for each size using the named strategy.
+    :param groups: optional, for each item a tuple of the groups it belongs to
+    :param group_costs: dictionary of group to the bytes it uses on each disc it is on
+    :param chains: optional, for each item the groups that are the directories of its own path, nearest first, for
+      locality.  Defaults to groups."""
+    try:
+        packer = PACKERS[strategy]
+    except KeyError:
+        raise odarchiveError(f"Unknown segment strategy {strategy}, choose from {', '.join(SEGMENT_STRATEGIES)}")
+    if groups is None:
+        groups = [()] * len(sizes)
+    group_costs = group_costs or {}
+    result = packer(sizes, capacity, DiscGroups(groups, group_costs, chains))
+    if balanced and strategy == LOCALITY:
+        # Move whole chunks so that directories stay together
+        chunks = subtree_chunks(sizes, groups, group_costs, capacity, chains)
+        chunk_sizes, chunk_groups = _chunk_items(chunks, sizes, groups)
+        chunk_assignment = [result[chunk[0]] for chunk in chunks]
+        chunk_assignment = balance(chunk_sizes, chunk_assignment, capacity, DiscGroups(chunk_groups, group_costs))
+        result = _unchunk(chunks, chunk_assignment, len(sizes))
+    elif balanced:
+        result = balance(sizes, result, capacity, DiscGroups(groups, group_costs))
+    return result
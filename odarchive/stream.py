@@ -0,0 +1,157 @@
+"""
+Streaming an ISO image to stdout, a named pipe or a socket without writing it to a staging file first.
+
+pycdlib masters an image by seeking about a seekable file.  It writes the metadata, which is everything before
+the file data plus the closing anchor in the last sector, in any order and then writes the data of each file in
+the order of its inodes, which Archiver.stream_iso first sorts into extent order.  ImageStream takes advantage of
+this: writes to the metadata and the last sector are held in memory, one
+sector at a time, and from the start of the file data the image is passed on in order.  Gaps are zero filled, as
+they would be in a sparse file.  The start of the data and the size of the image come from ImageLayout, which
+models pycdlib exactly.
+
+Output is collected in a large buffer, a whole number of sectors, so the consumer sees a few large writes and a
+running hash of the image is kept so it can be checked once burnt or uploaded.
+"""
+import os
+
+from .consts import *
+from .image_size import SECTOR_SIZE
+
+STREAM_BUFFER_SIZE = 4 * 1024 * 1024  # Bytes, a whole number of sectors
+
+
+class ImageStream:
+    """A write only file object for pycdlib's write_fp that passes the image on to outfp in order"""
+
+    mode = "wb"  # pycdlib checks for a binary file object
+
+    def __init__(self, outfp, data_start, image_size, buffer_size=STREAM_BUFFER_SIZE):
+        """
+        :param outfp: where the image goes, anything with a write method eg sys.stdout.buffer, an open pipe or
+          socket.makefile('wb')
+        :param data_start: offset of the first file data, writes before this are held until it is reached
+        :param image_size: size of the image, writes to the last sector are held until it is closed
+        """
+        if buffer_size <= 0 or buffer_size % SECTOR_SIZE:
+            raise odarchiveError(f"Stream buffer size {buffer_size:,} must be a whole number of {SECTOR_SIZE} "
+                                 f"byte sectors")
+        self.outfp = outfp
+        self.data_start = data_start
+        self.tail_start = image_size - SECTOR_SIZE
+        self.image_size = image_size
+        self.buffer = bytearray(buffer_size)
+        self.buffered = 0
+        self.held = {}  # Sector number to bytearray of the sectors not yet passed on
+        self.position = 0  # Where pycdlib is writing
+        self.end = 0  # End of the furthest write, the size of the image so far
+        self.emitted = 0  # Bytes of the image passed on, or in the buffer
+        self.hasher = HASH_FUNCTION()
+        self.closed = False
+
+    def seek(self, position, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            position += self.position
+        elif whence == os.SEEK_END:
+            position += self.end
+        self.position = position
+        return position
+
+    def tell(self):
+        return self.position
+
+    def write(self, data):
+        start = self.position
+        length = len(data)
+        if start < self.emitted:
+            raise odarchiveError(f"Can't stream an image that writes back to {start:,} once {self.emitted:,} bytes "
+                                 f"have been passed on")
+        self.position += length
+        self.end = max(self.end, self.position)
+        if start < self.data_start or start >= self.tail_start:
+            self._hold(start, data)
+        else:
+            # pycdlib writes the data in order so everything before here is final
+            self._emit_to(start)
+            if self.held and min(self.held) * SECTOR_SIZE < self.position:
+                self._hold(start, data)  # Overlaps something held so merge with it
+            else:
+                self._emit(data)
+        return length
+
+    def _hold(self, start, data):
+        view = memoryview(data)
+        done = 0
+        while done < len(view):
+            sector, offset = divmod(start + done, SECTOR_SIZE)
+            page = self.held.get(sector)
+            if page is None:
+                page = self.held[sector] = bytearray(SECTOR_SIZE)
+            count = min(SECTOR_SIZE - offset, len(view) - done)
+            page[offset:offset + count] = view[done:done + count]
+            done += count
+
+    def _emit_to(self, position):
+        """Passes on the image up to position, the held sectors and zeros for anything never written"""
+        for sector in sorted(sector for sector in self.held if sector * SECTOR_SIZE < position):
+            page = self.held.pop(sector)
+            start = sector * SECTOR_SIZE
+            if start > self.emitted:
+                self._emit_zeros(start - self.emitted)
+            end = min(start + SECTOR_SIZE, position)
+            self._emit(memoryview(page)[self.emitted - start:end - start])
+            if end < start + SECTOR_SIZE:
+                self.held[sector] = page  # The rest of it is still to come
+        if position > self.emitted:
+            self._emit_zeros(position - self.emitted)
+
+    def _emit_zeros(self, count):
+        zeros = bytes(min(count, len(self.buffer)))
+        while count > 0:
+            this_count = min(count, len(zeros))
+            self._emit(memoryview(zeros)[:this_count])
+            count -= this_count
+
+    def _emit(self, data):
+        view = memoryview(data)
+        self.emitted += len(view)
+        while len(view):
+            count = min(len(self.buffer) - self.buffered, len(view))
+            self.buffer[self.buffered:self.buffered + count] = view[:count]
+            self.buffered += count
+            view = view[count:]
+            if self.buffered == len(self.buffer):
+                self._flush_buffer()
+
+    def _flush_buffer(self):
+        view = memoryview(self.buffer)[:self.buffered]
+        self.hasher.update(view)
+        while len(view):
+            written = self.outfp.write(view)
+            view = view[len(view) if written is None else written:]  # Only raw files can write less
+        self.buffered = 0
+
+    @property
+    def size(self):
+        """Bytes of the image passed on"""
+        return self.emitted
+
+    def hexdigest(self):
+        """Hash of the image passed on so far, with HASH_FUNCTION"""
+        return self.hasher.hexdigest()
+
+    def close(self):
+        """Passes on the rest of the image, held sectors included"""
+        if not self.closed:
+            self._emit_to(max(self.end, self.image_size))
+            self._flush_buffer()
+            flush = getattr(self.outfp, "flush", None)
+            if flush is not None:
+                flush()
+            self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
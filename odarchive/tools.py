@@ -28,7 +28,6 @@ import collections
 import fileinput
 import fnmatch
 import os
-import re
 import sys
 import time
 
@@ -39,6 +38,13 @@ except ImportError:
 
 import pycdlib
 
+from odarchive.iso_names import translate
+
+try:
+    from odarchive.background_writer import BackgroundWriter
+except ImportError:
+    BackgroundWriter = None
+
 ################################ MURMER3 HASH FUNCTIONS ##############################
 
 if sys.version_info > (3, 0):
@@ -178,13 +184,10 @@ def truncate_basename(basename, iso_level, is_dir):
         maxlen = 31 if is_dir else 30
 
     # For performance reasons, we first truncate the string to the length
-    # allowed.  Second, ISO9660 Levels 1, 2, and 3 require all uppercase names,
-    # so we uppercase it.
-    valid_base = basename[:maxlen].upper()
-
-    # Finally, ISO9660 requires only uppercase letters, 0-9, and underscore.
-    # Translate any non-compliant characters to underscore and return that.
-    return re.sub("[^A-Z0-9_]{1}", r"_", valid_base)
+    # allowed.  Then ISO9660 Levels 1, 2, and 3 require all uppercase names
+    # of only uppercase letters, 0-9, and underscore so translate upper cases
+    # it and replaces any non-compliant characters with underscore.
+    return translate(basename[:maxlen])
 
 
 def mangle_file_for_iso9660(orig, iso_level):
@@ -247,8 +250,8 @@ def mangle_file_for_iso9660(orig, iso_level):
             basename = orig
         else:
             tmpext = ext.upper()
-            valid_ext, numsub = re.subn("[^A-Z0-9_]{1}", r"_", tmpext)
-            if numsub > 0:
+            valid_ext = translate(tmpext)
+            if valid_ext != tmpext:
                 valid_ext = ""
                 basename = orig
 
@@ -1144,6 +1147,11 @@ def parse_arguments():
     parser.add_argument(
         "-no-hfs", help="Do not create ISO9660/HFS hybrid", action="store_true"
     )
+    parser.add_argument(
+        "-direct-io",
+        help="Write the output with O_DIRECT, bypassing the page cache",
+        action="store_true",
+    )
     parser.add_argument(
         "-scan-for-duplicates",
         help="Aggressively try to find duplicate files to reduce size (very slow!)",
@@ -1224,13 +1232,15 @@ class DirLevel(object):
     mangled maps for mangling filenames as appropriate.
     """
 
-    __slots__ = ("iso_path", "joliet_path", "udf_path", "mangled_children")
+    __slots__ = ("iso_path", "joliet_path", "udf_path", "mangled_children", "mangled_counters")
 
     def __init__(self, iso_path, joliet_path, udf_path):
         self.iso_path = iso_path
         self.joliet_path = joliet_path
         self.udf_path = udf_path
         self.mangled_children = {}
+        # The next number to try for each prefix, extension and width of number
+        self.mangled_counters = {}
 
 
 def build_iso_path(parent_dirlevel, nameonly, iso_level, is_dir):
@@ -1253,8 +1263,11 @@ def build_iso_path(parent_dirlevel, nameonly, iso_level, is_dir):
     # mangled name, we see if that name has been used at this directory level
     # yet.  If it has not been used, we mark it as now used, and return it
     # unmolested (beyond the ISO9660 mangle).  If it has been used, then we
-    # need to strip it down to its prefix (the first 4 characters), add a
-    # 3-digit number starting at zero, then iterate until we find a free one.
+    # need to strip it down to its prefix (the first 5 characters) and add a
+    # 3-digit number.  The directory level keeps the next number for each
+    # prefix so we carry on from there rather than trying every number from
+    # zero again.  Once the 3-digit numbers run out we widen to 4 digits and so
+    # on, shortening the prefix for level 1, until there isn't room.
     # Once we have found a free one, we mark it as now used, and return what
     # we figured out.
 
@@ -1268,19 +1281,32 @@ def build_iso_path(parent_dirlevel, nameonly, iso_level, is_dir):
             filemangle = ".".join([filename, ext])
 
     if filemangle in parent_dirlevel.mangled_children:
-        currnum = 0
-        prefix = filemangle[:5]
-        while True:
-            if is_dir:
-                tmp = "%s%.03d" % (prefix, currnum)
+        counters = parent_dirlevel.mangled_counters
+        digits = 3
+        found = None
+        while found is None:
+            if iso_level == 1:
+                if digits > 8:
+                    return None
+                prefix = filemangle[:8 - digits] if digits > 3 else filemangle[:5]
             else:
-                tmp = "%s%.03d.%s" % (prefix, currnum, ext)
-            if tmp not in parent_dirlevel.mangled_children:
-                filemangle = tmp
-                break
-            currnum += 1
-            if currnum == 1000:
-                return None
+                if digits > 25:
+                    return None
+                prefix = filemangle[:5]
+            key = (prefix, is_dir, ext, digits)
+            currnum = counters.get(key, 0)
+            while currnum < 10 ** digits:
+                if is_dir:
+                    tmp = "%s%0*d" % (prefix, digits, currnum)
+                else:
+                    tmp = "%s%0*d.%s" % (prefix, digits, currnum, ext)
+                currnum += 1
+                if tmp not in parent_dirlevel.mangled_children:
+                    found = tmp
+                    break
+            counters[key] = currnum
+            digits += 1
+        filemangle = found
 
     parent_dirlevel.mangled_children[filemangle] = True
 
@@ -1376,7 +1402,10 @@ def main():
             print("Output file must be specified (use -o)", file=logfp)
             sys.exit(1)
 
-        fp = open(args.output, "wb")
+        if BackgroundWriter is None:
+            fp = open(args.output, "wb")
+        else:  # Written from a background thread while the next data is read
+            fp = BackgroundWriter(args.output, direct=args.direct_io)
 
     # Figure out Joliet flag, which is the combination of args.joliet
     # and args.ucs_level.
@@ -1693,6 +1722,8 @@ def main():
             "Total extents scheduled to be written = %d" % (len(fp.getvalue()) / 2048),
             file=logfp,
         )
+    else:
+        fp.close()
 
     iso.close()
 
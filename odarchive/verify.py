@@ -0,0 +1,192 @@
+"""
+Checking a finished ISO image against the catalogue.
+
+The image is opened with pycdlib only to find where the data of each file is.  The data is then read straight from
+the image in extent order, so the read is one sequential pass however the files are laid out, while the hashing
+is spread over several threads.  The data of each file always goes to the same thread, in order, and hashlib lets
+go of the GIL for large buffers so the threads hash in parallel while the next data is read.  Small files that were
+packed are checked as ranges of the container.
+
+The result is a VerifyReport with a FileCheck for each file that says whether it passed.
+"""
+import os
+import queue
+import threading
+
+import pycdlib
+
+from .consts import *
+from .file_parts import READ_SIZE
+from .image_size import SECTOR_SIZE
+from .manifest import parse_manifest
+
+HASH_QUEUE_DEPTH = 8  # Buffers waiting for each hashing thread, so memory use is bounded
+
+
+class FileCheck:
+    """A file, or part or packed range of one, that should be on a disc"""
+
+    def __init__(self, name, udf_path, file_hash, size, offset=0):
+        """
+        :param name: what the report calls it, eg the path in the catalogue
+        :param udf_path: the file on the disc that holds its data
+        :param offset: where its data starts in the file on the disc, for packed files
+        """
+        self.name = name
+        self.udf_path = str(udf_path)
+        self.file_hash = file_hash
+        self.size = size
+        self.offset = offset
+        self.location = None  # Offset of its data in the image
+        self.hasher = HASH_FUNCTION()
+        self.read = 0
+        self.error = None
+
+    def update(self, data):
+        self.hasher.update(data)
+        self.read += len(data)
+
+    def finish(self):
+        if self.error is None:
+            if self.read != self.size:
+                self.error = f"only {self.read:,} of {self.size:,} bytes could be read"
+            elif self.hasher.hexdigest() != self.file_hash:
+                self.error = "does not match its hash"
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class VerifyReport:
+    """The result of verifying an image"""
+
+    def __init__(self, image, disc_num):
+        self.image = str(image)
+        self.disc_num = disc_num
+        self.checks = []
+        self.errors = []  # Problems with the disc as a whole, eg the manifest
+
+    @property
+    def failures(self):
+        return [check for check in self.checks if not check.ok]
+
+    @property
+    def passed(self):
+        return not self.errors and not self.failures
+
+    @property
+    def bytes_checked(self):
+        return sum(check.read for check in self.checks)
+
+    def summary(self):
+        lines = [f"{self.image}: disc {self.disc_num} {'PASS' if self.passed else 'FAIL'}, "
+                 f"{len(self.checks) - len(self.failures):,} of {len(self.checks):,} files ok, "
+                 f"{self.bytes_checked:,} bytes checked"]
+        lines += [f"  {error}" for error in self.errors]
+        lines += [f"  {check.name}: {check.error}" for check in self.failures]
+        return "\n".join(lines)
+
+
+def _hash_worker(work):
+    while True:
+        item = work.get()
+        if item is None:
+            return
+        check, data = item
+        if data is None:
+            check.finish()
+        else:
+            check.update(data)
+
+
+def _hash_extents(image, checks, threads):
+    """Reads the data of each check in extent order and hashes them across threads"""
+    workers = []
+    for _ in range(threads):
+        work = queue.Queue(HASH_QUEUE_DEPTH)
+        thread = threading.Thread(target=_hash_worker, args=(work,), daemon=True)
+        thread.start()
+        workers.append((work, thread))
+    try:
+        with open(image, "rb") as f:
+            for i, check in enumerate(sorted(checks, key=lambda check: check.location)):
+                work = workers[i % threads][0]
+                if f.tell() != check.location:
+                    f.seek(check.location)
+                remaining = check.size
+                while remaining > 0:
+                    data = f.read(min(remaining, READ_SIZE))
+                    if not data:
+                        break  # Image cut short, caught by the size check
+                    work.put((check, data))
+                    remaining -= len(data)
+                work.put((check, None))
+    finally:
+        for work, thread in workers:
+            work.put(None)
+        for work, thread in workers:
+            thread.join()
+
+
+def locate_checks(iso, checks):
+    """Sets the location in the image of the data of each check, or its error if its file isn't there
+    :param iso: the image opened with pycdlib"""
+    extents = {}
+    for check in checks:
+        if check.udf_path not in extents:
+            try:
+                inode = iso.get_record(udf_path=check.udf_path).inode
+                extents[check.udf_path] = (inode.extent_location() * SECTOR_SIZE, inode.get_data_length())
+            except pycdlib.pycdlibexception.PyCdlibException:
+                extents[check.udf_path] = None
+        extent = extents[check.udf_path]
+        if extent is None:
+            check.error = "is missing"
+        elif check.offset + check.size > extent[1]:
+            check.error = f"is {extent[1]:,} bytes rather than {check.offset + check.size:,}"
+        else:
+            check.location = extent[0] + check.offset
+
+
+def verify_image(image, checks, manifest=None, disc_num=None, threads=None):
+    """Checks that an image holds the expected data
+    :param checks: FileCheck for each file that should be on the disc
+    :param manifest: expected text of the HASH_FILENAME manifest, None to not check it
+    :param threads: number of hashing threads, defaults to the number of CPUs
+    :return: VerifyReport"""
+    report = VerifyReport(image, disc_num)
+    report.checks = list(checks)
+    iso = pycdlib.PyCdlib()
+    try:
+        iso.open(str(image))
+    except Exception as e:
+        report.errors.append(f"can't be opened: {e}")
+        return report
+    try:
+        locate_checks(iso, report.checks)
+        if manifest is not None:
+            _check_manifest(iso, manifest, report)
+    finally:
+        iso.close()
+    to_read = [check for check in report.checks if check.location is not None]
+    _hash_extents(image, to_read, max(1, threads or os.cpu_count() or 1))
+    return report
+
+
+def _check_manifest(iso, manifest, report):
+    udf_path = f"/{HASH_FILENAME}"
+    try:
+        with iso.open_file_from_iso(udf_path=udf_path) as f:
+            on_disc = parse_manifest(f.read().decode("utf-8"))
+    except pycdlib.pycdlibexception.PyCdlibException:
+        report.errors.append(f"{HASH_FILENAME} is missing")
+        return
+    except (UnicodeDecodeError, odarchiveError) as e:
+        report.errors.append(f"{HASH_FILENAME} can't be read: {e}")
+        return
+    expected = parse_manifest(manifest)
+    if on_disc != expected:
+        different = sorted(path for path in on_disc.keys() | expected.keys() if on_disc.get(path) != expected.get(path))
+        report.errors.append(f"{HASH_FILENAME} differs from the catalogue for {len(different):,} files eg "
+                             f"{different[0]}")
@@ -3,5 +3,17 @@ from odarchive import *
 if __name__ == "__main__":
     cli.add_command(archive)
     cli.add_command(init)
+    cli.add_command(segment)
     cli.add_command(write_iso)
+    cli.add_command(write_all_isos)
+    cli.add_command(produce_isos)
+    cli.add_command(stream_iso)
+    cli.add_command(restore)
+    cli.add_command(get)
+    cli.add_command(verify)
+    cli.add_command(scrub)
+    cli.add_command(repair)
+    cli.add_command(add)
+    cli.add_command(segment_new)
+    cli.add_command(plan)
     cli()
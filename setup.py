@@ -24,6 +24,9 @@ setup(
     install_requires=[
         'python-dateutil'
     ],
+    extras_require={
+        'parity': ['numpy'],  # Reed-Solomon parity, see odarchive/parity.py
+    },
     license="MIT license",
     zip_safe=False,
     keywords = ['cdrom', 'dvd', 'bdrom', 'archive', 'odarchive'],
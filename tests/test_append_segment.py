@@ -0,0 +1,125 @@
+"""
+Tests for adding files to an archive once its discs have been written.
+"""
+import os
+from pathlib import Path
+import shutil
+import tempfile
+import unittest
+
+from odarchive import Archiver, odarchiveError, load_archiver_from_checkpoint, load_archiver_from_discs
+
+DISC_SIZE = 600000
+
+
+class TestAppendSegment(unittest.TestCase):
+
+    def setUp(self):
+        self.start_dir = os.getcwd()
+        self.work_dir = tempfile.mkdtemp()
+        os.chdir(self.work_dir)
+        os.makedirs("usb/old")
+        for i in range(4):
+            self.write(f"usb/old/file{i}.bin", 3000, i)
+        self.ar = Archiver()
+        self.ar.create_file_database(Path("usb"))
+        self.ar.convert_to_hash_database()
+        self.ar.segment(DISC_SIZE)
+        self.ar.locked = True
+
+    def tearDown(self):
+        os.chdir(self.start_dir)
+        shutil.rmtree(self.work_dir)
+
+    def write(self, filename, size, seed):
+        with open(filename, "wb") as f:
+            f.write(bytes([seed % 256]) * size)
+
+    def disc_nums(self):
+        return {str(entry.filename): entry.disc_num for entry in self.ar.hash_db.files()}
+
+    def test_append(self):
+        before = self.disc_nums()
+        last_disc_num = self.ar.last_disc_num
+        self.assertEqual(0, self.ar.add_new_files())  # Nothing has changed
+        os.makedirs("usb/new")
+        for i in range(60):
+            self.write(f"usb/new/file{i}.bin", 3000, 100 + i)
+        shutil.copy("usb/old/file0.bin", "usb/new/copy.bin")
+        self.assertEqual(61, self.ar.add_new_files())
+        new_discs = self.ar.segment_new_files()
+        self.assertEqual(last_disc_num + 1, new_discs.start)
+        self.assertEqual(self.ar.last_disc_num + 1, new_discs.stop)
+        self.assertGreater(len(new_discs), 1)
+        after = self.disc_nums()
+        for filename, disc_num in before.items():
+            self.assertEqual(disc_num, after[filename], "Files on written discs are not moved")
+        for entry in self.ar.hash_db.files():
+            if entry.filename.parent.name == "new":
+                self.assertIn(entry.disc_num, new_discs)
+        # The copy is only stored once on the disc that was already written
+        copy = next(entry for entry in self.ar.hash_db.files() if entry.has_file_path("/DATA/new/copy.bin"))
+        self.assertEqual(before["/DATA/old/file0.bin"], copy.disc_num)
+        usage = self.ar.hash_db.disc_usage()
+        for disc_num in new_discs:
+            self.assertLess(usage[disc_num], DISC_SIZE)
+        self.assertEqual(0, len(self.ar.segment_new_files()), "Nothing left to place")
+
+    def test_changed_file(self):
+        old_hash = next(entry.file_hash for entry in self.ar.hash_db.files() if entry.filename.name == "file1.bin")
+        self.write("usb/old/file1.bin", 4000, 7)
+        self.assertEqual(1, self.ar.add_new_files())
+        self.ar.segment_new_files()
+        entries = [entry for entry in self.ar.hash_db.files() if entry.has_file_path("/DATA/old/file1.bin")]
+        self.assertEqual(2, len(entries), "Old contents are kept as they are on a written disc")
+        self.assertIn(old_hash, [entry.file_hash for entry in entries])
+        self.assertEqual(self.ar.last_disc_num, entries[-1].disc_num)
+
+    def test_checkpoint(self):
+        """Files added by one command are placed by another"""
+        os.makedirs("usb/new")
+        self.write("usb/new/file.bin", 3000, 50)
+        self.ar.add_new_files()
+        self.ar.save_checkpoint()
+        ar = load_archiver_from_checkpoint()
+        self.assertTrue(ar.is_locked)
+        new_discs = ar.segment_new_files()
+        self.assertEqual(1, len(new_discs))
+        ar.save_checkpoint()
+        ar = load_archiver_from_checkpoint()
+        self.assertEqual([], ar.hash_db.pending_entries())
+        self.assertEqual(new_discs.start, next(entry.disc_num for entry in ar.hash_db.files()
+                                               if entry.filename.name == "file.bin"))
+
+    def test_restore(self):
+        self.ar.save()
+        isos = []
+        for disc_num in range(self.ar.num_discs):
+            self.ar.write_iso(disc_num=disc_num, job_name="first")
+            isos.append(f"first_{disc_num:04}.iso")
+        os.makedirs("usb/new")
+        self.write("usb/new/file.bin", 3000, 50)
+        self.ar.add_new_files()
+        new_discs = self.ar.segment_new_files()
+        self.ar.save()
+        for disc_num in new_discs:
+            self.ar.write_iso(disc_num=disc_num, job_name="second")
+            isos.append(f"second_{disc_num:04}.iso")
+            self.assertEqual(os.path.getsize(isos[-1]), self.ar.image_size(disc_num))
+        # The catalogue on the newest disc covers the discs written first
+        ar, discs = load_archiver_from_discs(isos[::-1])
+        ar.restore(discs, "restored")
+        for filename in ("old/file0.bin", "old/file3.bin", "new/file.bin"):
+            with open(Path("usb") / filename, "rb") as f, open(Path("restored") / filename, "rb") as g:
+                self.assertEqual(f.read(), g.read())
+
+    def test_not_segmented(self):
+        ar = Archiver()
+        ar.create_file_database(Path("usb"))
+        ar.convert_to_hash_database()
+        with self.assertRaises(odarchiveError):
+            ar.segment_new_files()
+
+
+if __name__ == "__main__":
+    unittest.main()
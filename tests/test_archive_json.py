@@ -36,6 +36,7 @@ Is segmented    = True
   Disc segment size = bd, 25,000,000,000 bytes
   Catalogue size = {{ size }} bytes
   Number of discs = 1
+  Disc 0 fill = {{ fill }} bytes ({{ percent }})
 Number of files = 6
   Largest file  = 33
 Number of dirs  = 2
@@ -70,7 +71,7 @@ class Test_Archive_File_DB(unittest.TestCase):
             "Failed to create catalogue.json.",
         )
         ar = load_archiver_from_json("catalogue.json")
-        self.assertEqual(get_info.render(size='1,480', guid = ar.guid),
+        self.assertEqual(get_info.render(size='1,480', fill='584,658', percent='0.00%', guid = ar.guid),
                          ar.get_info().strip())
 
     def make_iso(self):
@@ -104,7 +105,7 @@ class Test_Archive_File_DB(unittest.TestCase):
             "Failed to read from ISO",
         )
         ar = load_archiver_from_json(None, json_data=file_data)
-        self.assertEqual(get_info.render(size='1,479', guid = ar.guid),
+        self.assertEqual(get_info.render(size='1,479', fill='584,658', percent='0.00%', guid = ar.guid),
                          ar.get_info().strip())
 
     def test_read_from_iso(self):
@@ -124,7 +125,7 @@ class Test_Archive_File_DB(unittest.TestCase):
                 new_drive_letter = list(drive_letters_after - drive_letters_before)[0]
                 print(f'New drive letter is {new_drive_letter}')
                 ar = load_archiver_from_json(f'{new_drive_letter}:\catalogue.json')
-                self.assertEqual(get_info.render(size='1,480', guid=ar.guid),
+                self.assertEqual(get_info.render(size='1,480', fill='584,658', percent='0.00%', guid=ar.guid),
                                  ar.get_info().strip())
             finally:
                 os.system(f'PowerShell DisMount-DiskImage {iso_path}')
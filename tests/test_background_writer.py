@@ -0,0 +1,100 @@
+"""
+Tests for writing images through a ring of buffers written by a background thread.
+"""
+import errno
+import os
+from pathlib import Path
+import random
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from odarchive import Archiver, odarchiveError
+from odarchive.background_writer import BackgroundWriter, DIRECT_ALIGNMENT
+
+DISC_SIZE = 700000
+
+
+class TestBackgroundWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.start_dir = os.getcwd()
+        self.work_dir = tempfile.mkdtemp()
+        os.chdir(self.work_dir)
+
+    def tearDown(self):
+        os.chdir(self.start_dir)
+        shutil.rmtree(self.work_dir)
+
+    def write(self, filename, data):
+        with open(filename, "wb") as f:
+            f.write(data)
+
+    def test_same_as_file(self):
+        """Runs of writes, seeks back over what was written and past the end come out as they would in a file"""
+        rng = random.Random(1)
+        writes = []
+        position = 0
+        for i in range(300):
+            if rng.random() < 0.1:
+                position = rng.randrange(100000)
+            data = bytes(rng.getrandbits(8) for _ in range(rng.randrange(1, 3000)))
+            writes.append((position, data))
+            position += len(data)
+        for direct in (False, True):
+            with open("expected.bin", "wb") as expected, \
+                    BackgroundWriter("written.bin", direct=direct, buffer_size=2 * DIRECT_ALIGNMENT,
+                                     num_buffers=2) as written:
+                for position, data in writes:
+                    for f in (expected, written):
+                        f.seek(position)
+                        self.assertEqual(len(data), f.write(data))
+                        self.assertEqual(position + len(data), f.tell())
+                written.seek(-10, os.SEEK_END)
+                expected.seek(-10, os.SEEK_END)
+                self.assertEqual(expected.tell(), written.tell())
+            self.assertEqual(Path("expected.bin").read_bytes(), Path("written.bin").read_bytes())
+
+    @mock.patch("pycdlib.headervd.time")  # pycdlib puts the time it is written in the volume descriptor
+    def test_same_as_pycdlib(self, fake_time):
+        fake_time.time.return_value = 1.5e9
+        rng = random.Random(1)
+        os.makedirs("usb/dir")
+        for i in range(20):
+            self.write(f"usb/dir/file{i}.bin", bytes(rng.getrandbits(8) for _ in range(rng.randrange(20000))))
+        self.write("usb/large.bin", bytes(rng.getrandbits(8) for _ in range(250000)))  # Split over discs
+        ar = Archiver()
+        ar.create_file_database(Path("usb"))
+        ar.convert_to_hash_database()
+        ar.segment(DISC_SIZE, pack_threshold=1000)
+        ar.save()
+        for disc_num in range(ar.num_discs):
+            iso, any_files = ar._build_iso(disc_num)  # The same image so the other times in it are the same
+            iso.write("pycdlib.iso")
+            for direct in (False, True):
+                with BackgroundWriter("background.iso", direct=direct, buffer_size=DIRECT_ALIGNMENT) as f:
+                    iso.write_fp(f)
+                self.assertEqual(Path("pycdlib.iso").read_bytes(), Path("background.iso").read_bytes())
+            iso.close()
+            filename = ar.write_iso(disc_num=disc_num, direct_io=True)
+            self.assertEqual(ar.image_size(disc_num), os.path.getsize(filename))
+
+    def test_write_error(self):
+        f = BackgroundWriter("failed.bin", num_buffers=2, buffer_size=DIRECT_ALIGNMENT)
+        with mock.patch("os.pwrite", side_effect=OSError(errno.ENOSPC, "No space left on device")):
+            with self.assertRaises(OSError):
+                for i in range(10):  # The error comes back from a later write once the thread has hit it
+                    f.write(bytes(DIRECT_ALIGNMENT))
+                f.flush()
+        with self.assertRaises(OSError):
+            f.close()
+        self.assertTrue(f.closed)
+
+    def test_buffer_size(self):
+        with self.assertRaises(odarchiveError):
+            BackgroundWriter("odd.bin", buffer_size=1000)
+
+
+if __name__ == "__main__":
+    unittest.main()
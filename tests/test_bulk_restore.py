@@ -0,0 +1,144 @@
+"""
+Tests for restoring a selection of files reading each disc once in extent order.
+"""
+import importlib
+import os
+from pathlib import Path
+import random
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import pycdlib
+
+from odarchive import Archiver, odarchiveError, load_archiver_from_discs
+
+restore_module = importlib.import_module("odarchive.restore")  # odarchive.restore is also the restore command
+
+DISC_SIZE = 700000
+
+
+class TestBulkRestore(unittest.TestCase):
+
+    def setUp(self):
+        self.start_dir = os.getcwd()
+        self.work_dir = tempfile.mkdtemp()
+        os.chdir(self.work_dir)
+        rng = random.Random(1)
+        for i in range(3):
+            os.makedirs(f"usb/dir{i}")
+        for i in range(30):
+            self.write(f"usb/dir{i % 3}/file{i}.bin", bytes(rng.getrandbits(8) for _ in range(rng.randrange(30000))))
+        for i in range(20):
+            self.write(f"usb/dir{i % 3}/small{i}.txt", f"small file {i}".encode())
+        self.write("usb/large.bin", bytes(rng.getrandbits(8) for _ in range(250000)))  # Split over discs
+        shutil.copy("usb/dir0/file0.bin", "usb/dir1/copy.bin")
+        shutil.copy("usb/large.bin", "usb/dir2/large copy.bin")
+        self.write("usb/empty.txt", b"")
+        ar = Archiver()
+        ar.create_file_database(Path("usb"))
+        ar.convert_to_hash_database()
+        ar.segment(DISC_SIZE, pack_threshold=100)
+        ar.save()
+        self.isos = [ar.write_iso(disc_num=disc_num) for disc_num in range(ar.num_discs)]
+        self.ar, self.discs = load_archiver_from_discs(self.isos)
+
+    def tearDown(self):
+        os.chdir(self.start_dir)
+        shutil.rmtree(self.work_dir)
+
+    def write(self, filename, data):
+        with open(filename, "wb") as f:
+            f.write(data)
+
+    def check_same(self, restored, destination="restored"):
+        for path in restored:
+            self.assertEqual((Path("usb") / path.relative_to(destination)).read_bytes(), path.read_bytes())
+
+    def test_restore_all(self):
+        self.assertGreater(self.ar.num_discs, 2)
+        restored = self.ar.restore(self.discs, "restored", threads=3)
+        self.assertEqual(sorted(path.relative_to("usb") for path in Path("usb").rglob("*") if path.is_file()),
+                         sorted(path.relative_to("restored") for path in restored))
+        self.check_same(restored)
+        # Duplicates are hard links to the one copy restored
+        self.assertTrue(os.path.samefile("restored/dir0/file0.bin", "restored/dir1/copy.bin"))
+        self.assertTrue(os.path.samefile("restored/large.bin", "restored/dir2/large copy.bin"))
+
+    def test_reflink(self):
+        restored = self.ar.restore(self.discs, "restored", paths=["dir0/file0.bin", "dir1"], reflink=True)
+        self.check_same(restored)
+        self.assertIn(Path("restored/dir1/copy.bin"), restored)
+        # A reflink, or a copy where the file system has none, is a file of its own
+        self.assertFalse(os.path.samefile("restored/dir0/file0.bin", "restored/dir1/copy.bin"))
+
+    def test_selection(self):
+        plan = self.ar.restore_plan(self.discs, "restored", paths=["dir1", "*/small1?.txt"])
+        restored = plan.run()
+        expected = {path.relative_to("usb") for path in Path("usb/dir1").rglob("*")}
+        expected |= {path.relative_to("usb") for path in Path("usb").glob("*/small1?.txt")}
+        self.assertEqual(expected, {path.relative_to("restored") for path in restored})
+        self.check_same(restored)
+        # Only the discs with the selected files are read, each once
+        discs_needed = {disc_num for entry, targets in plan.selected for disc_num in entry.disc_nums}
+        self.assertEqual(sorted(discs_needed), plan.disc_order)
+        with mock.patch.object(restore_module.Disc, "__init__", autospec=True,
+                               side_effect=restore_module.Disc.__init__) as disc_init:
+            self.ar.restore(self.discs, "again", paths=["large.bin"])
+        opened = [call.args[1] for call in disc_init.call_args_list]
+        large = next(entry for entry in self.ar.hash_db.files() if entry.is_split)
+        self.assertEqual([self.discs[disc_num] for disc_num in sorted(large.disc_nums)], opened)
+
+    def test_missing_disc(self):
+        large = next(entry for entry in self.ar.hash_db.files() if entry.is_split)
+        del self.discs[max(large.disc_nums)]
+        plan = self.ar.restore_plan(self.discs, "restored")
+        self.assertIn(max(large.disc_nums), plan.missing_discs)
+        self.assertNotIn(Path("restored/large.bin"), plan.run())
+        self.assertFalse(os.path.exists("restored/large.bin"))
+
+    def test_extent_order(self):
+        outputs = []
+        output_class = restore_module._Output
+
+        def record(path, truncate):
+            outputs.append(path)
+            return output_class(path, truncate)
+
+        with mock.patch.object(restore_module, "_Output", side_effect=record):
+            self.ar.restore({0: self.discs[0]}, "restored")
+        iso = pycdlib.PyCdlib()
+        iso.open(self.isos[0])
+        try:
+            extents = []
+            for path in outputs:
+                entry = next(entry for entry in self.ar.hash_db.files()
+                             if Path("restored") / Path(entry.filename).relative_to(self.ar.iso_path_root) == path)
+                if entry.size and not entry.is_packed and not entry.is_split:
+                    extents.append(iso.get_record(udf_path=str(entry.udf_absolute_path)).inode.extent_location())
+        finally:
+            iso.close()
+        self.assertGreater(len(extents), 2)
+        self.assertEqual(sorted(extents), extents)
+
+    def test_corrupt_disc(self):
+        entry = next(entry for entry in self.ar.hash_db.files(0)
+                     if entry.size > 1000 and not entry.is_packed and not entry.is_split and entry.disc_num == 0)
+        iso = pycdlib.PyCdlib()
+        iso.open(self.isos[0])
+        location = iso.get_record(udf_path=str(entry.udf_absolute_path)).inode.extent_location() * 2048
+        iso.close()
+        with open(self.isos[0], "r+b") as f:
+            f.seek(location + 500)
+            byte = f.read(1)
+            f.seek(location + 500)
+            f.write(bytes([byte[0] ^ 0xFF]))
+        target = Path("restored") / Path(entry.filename).relative_to(self.ar.iso_path_root)
+        with self.assertRaises(odarchiveError):
+            self.ar.restore({0: self.discs[0]}, "restored")
+        self.assertFalse(target.exists())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+"""
+Tests for saving and loading the working state of an archive via a checkpoint file.
+"""
+import os
+from pathlib import Path
+import sqlite3
+import unittest
+
+from odarchive import Archiver, odarchiveError, load_archiver_from_checkpoint, CHECKPOINT_FILENAME
+
+from utils import test_1_clean
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        """Delete files on setup so that can review at end"""
+        self.start_dir = os.getcwd()
+        os.chdir(Path(__file__).parents[0] / "test_1_files")
+        test_1_clean()
+        self.ar = Archiver()
+        self.ar.create_file_database(Path("usb"))
+        self.ar.convert_to_hash_database()
+        self.ar.save()  # Creates catalogue.json
+
+    def tearDown(self):
+        os.chdir(self.start_dir)
+
+    def assertSameEntries(self, expected, actual):
+        self.assertEqual(list(expected.keys()), list(actual.keys()), "Entries in same order")
+        for file_hash, entry in expected.items():
+            loaded = actual[file_hash]
+            self.assertEqual(entry.filenames, loaded.filenames)
+            self.assertEqual(entry.size, loaded.size)
+            self.assertEqual(entry.mtime, loaded.mtime)
+            self.assertEqual(entry.disc_num, loaded.disc_num)
+            self.assertEqual(str(entry.file_system_path), str(loaded.file_system_path))
+
+    def test_round_trip(self):
+        self.ar.save_checkpoint()
+        ar = load_archiver_from_checkpoint()
+        self.assertFalse(ar.is_segmented)
+        self.assertEqual(self.ar.job_id, ar.job_id)
+        self.assertEqual(self.ar.guid, ar.guid)
+        self.assertSameEntries(self.ar.hash_db.entries, ar.hash_db.entries)
+        self.assertEqual(self.ar.get_info(), ar.get_info())
+
+    def test_round_trip_segmented(self):
+        self.ar.segment(583000)
+        self.ar.locked = True
+        self.ar.save_checkpoint()
+        ar = load_archiver_from_checkpoint()
+        self.assertTrue(ar.is_locked)
+        self.assertEqual(self.ar.last_disc_num, ar.last_disc_num)
+        self.assertSameEntries(self.ar.hash_db.entries, ar.hash_db.entries)
+        self.assertEqual(self.ar.get_info(), ar.get_info())
+        ar.write_iso(disc_num=0)
+        self.assertTrue(os.path.isfile("new_0000.iso"))
+
+    def test_load_single_disc(self):
+        self.ar.segment(583000)
+        self.ar.save_checkpoint()
+        ar = load_archiver_from_checkpoint(disc_num=1)
+        self.assertEqual(1, len(ar.hash_db.entries))
+        self.assertEqual(1, next(iter(ar.hash_db.entries.values())).disc_num)
+        self.assertEqual(self.ar.last_disc_num, ar.last_disc_num)
+        with self.assertRaises(odarchiveError):
+            ar.save_checkpoint()  # Only part of the archive has been loaded
+
+    def test_version_mismatch(self):
+        self.ar.save_checkpoint()
+        con = sqlite3.connect(CHECKPOINT_FILENAME)
+        con.execute("UPDATE meta SET value = '0' WHERE key = 'checkpoint_version'")
+        con.commit()
+        con.close()
+        with self.assertRaises(odarchiveError):
+            load_archiver_from_checkpoint()
+
+    def test_missing_checkpoint(self):
+        with self.assertRaises(odarchiveError):
+            load_archiver_from_checkpoint()
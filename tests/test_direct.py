@@ -81,6 +81,7 @@ Is segmented    = True
   Disc segment size = cd, 737,280,000 bytes
   Catalogue size = 2,048 bytes
   Number of discs = 1
+  Disc 0 fill = 584,766 bytes (0.08%)
 Number of files = 6
   Largest file  = 33
 Number of dirs  = 2
@@ -153,10 +154,10 @@ Database Version = 2"""
         ar.create_file_database(Path("usb"))
         ar.convert_to_hash_database()
         ar.save()  #  Creates catalogue.json
-        ar.segment(506145)
+        ar.segment(583000)
         ar.locked = True
-        self.assertEqual(2, ar.last_disc_num)
-        for i in range(3):
+        self.assertEqual(1, ar.last_disc_num)
+        for i in range(2):
             ar.write_iso(disc_num=i)
 
 
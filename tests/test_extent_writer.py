@@ -0,0 +1,74 @@
+"""
+Tests for writing images with the file data copied in parallel rather than by pycdlib.
+"""
+import os
+from pathlib import Path
+import random
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from odarchive import Archiver, odarchiveError
+from odarchive.extent_writer import write_image
+
+DISC_SIZE = 700000
+
+
+class TestExtentWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.start_dir = os.getcwd()
+        self.work_dir = tempfile.mkdtemp()
+        os.chdir(self.work_dir)
+        rng = random.Random(1)
+        for i in range(3):
+            os.makedirs(f"usb/dir{i}")
+        for i in range(20):
+            self.write(f"usb/dir{i % 3}/file{i}.bin", bytes(rng.getrandbits(8) for _ in range(rng.randrange(20000))))
+        for i in range(30):
+            self.write(f"usb/dir{i % 3}/small{i}.txt", bytes(rng.getrandbits(8) for _ in range(rng.randrange(600))))
+        self.write("usb/large.bin", bytes(rng.getrandbits(8) for _ in range(250000)))  # Split over discs
+        shutil.copy("usb/dir0/file0.bin", "usb/dir1/copy.bin")  # A hard link on the disc
+        self.write("usb/empty.txt", b"")
+        self.ar = Archiver()
+        self.ar.create_file_database(Path("usb"))
+        self.ar.convert_to_hash_database()
+        self.ar.segment(DISC_SIZE, pack_threshold=1000)
+        self.ar.save()
+
+    def tearDown(self):
+        os.chdir(self.start_dir)
+        shutil.rmtree(self.work_dir)
+
+    def write(self, filename, data):
+        with open(filename, "wb") as f:
+            f.write(data)
+
+    @mock.patch("pycdlib.headervd.time")  # pycdlib puts the time it is written in the volume descriptor
+    def test_same_as_pycdlib(self, fake_time):
+        fake_time.time.return_value = 1.5e9
+        for disc_num in range(self.ar.num_discs):
+            iso, any_files = self.ar._build_iso(disc_num)  # The same image so the other times in it are the same
+            iso.write("pycdlib.iso")
+            expected = Path("pycdlib.iso").read_bytes()
+            for threads in (1, 3):
+                write_image(iso, "threads.iso", threads)
+                self.assertEqual(expected, Path("threads.iso").read_bytes())
+            iso.close()
+            filename = self.ar.write_iso(disc_num=disc_num, copy_threads=2)
+            self.assertEqual(self.ar.image_size(disc_num), os.path.getsize(filename))
+
+    def test_short_source(self):
+        entry = next(entry for entry in self.ar.hash_db.files(0)
+                     if not entry.is_packed and not entry.is_split and entry.size > 100)
+        iso, any_files = self.ar._build_iso(0)
+        with open(entry.file_system_path, "r+b") as f:  # Changed since the image was laid out
+            f.truncate(entry.size - 100)
+        with self.assertRaises(odarchiveError):
+            write_image(iso, "short.iso", 2)
+        iso.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
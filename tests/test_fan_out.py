@@ -0,0 +1,97 @@
+"""
+Tests for spreading the numbered ISO 9660 directories and files of a disc over bucket directories.
+"""
+from collections import Counter
+import os
+from pathlib import Path, PurePosixPath
+import shutil
+import tempfile
+import unittest
+
+import pycdlib
+
+from odarchive import Archiver, odarchiveError
+from odarchive.image_size import fan_out_cost
+from odarchive.iso_names import FAN_OUT, FanOut, fan_out_levels
+from odarchive.restore import Disc
+
+
+class TestFanOut(unittest.TestCase):
+
+    def test_levels(self):
+        self.assertEqual(0, fan_out_levels(FAN_OUT))
+        self.assertEqual(1, fan_out_levels(FAN_OUT + 1))
+        self.assertEqual(2, fan_out_levels(FAN_OUT ** 2 + 1))
+        with self.assertRaises(odarchiveError):
+            fan_out_levels(FAN_OUT ** 6 + 1)
+
+    def test_flat(self):
+        fan_out = FanOut("/DATA", "F", FAN_OUT)
+        self.assertEqual(([], "/DATA/00000999"), fan_out.place(999))
+
+    def test_place(self):
+        fan_out = FanOut("/DATA", "F", 1234567)
+        self.assertEqual((["/DATA/F001", "/DATA/F001/234"], "/DATA/F001/234/01234567"), fan_out.place(1234567))
+        self.assertEqual(([], "/DATA/F001/234/01234000"), fan_out.place(1234000))
+        self.assertEqual((["/DATA/F001/235"], "/DATA/F001/235/01235000"), fan_out.place(1235000))
+
+    def test_bounded(self):
+        fan_out = FanOut("/DATA", "D", 10 ** 4, fan_out=10)
+        self.assertEqual(3, fan_out.levels)
+        children = Counter()
+        for number in range(10 ** 4):
+            buckets, iso_path = fan_out.place(number)
+            for path in buckets + [iso_path]:
+                children[str(PurePosixPath(path).parent)] += 1
+        self.assertEqual(10, max(children.values()))
+        self.assertEqual(1 + 10 + 100 + 1000, len(children))
+
+    def test_cost(self):
+        self.assertEqual(0, fan_out_cost(FAN_OUT * 2048))
+        self.assertLess(fan_out_cost(25 * 10 ** 9), 25 * 10 ** 9 // 500)
+
+
+class TestFanOutImage(unittest.TestCase):
+
+    def setUp(self):
+        self.start_dir = os.getcwd()
+        self.work_dir = tempfile.mkdtemp()
+        os.chdir(self.work_dir)
+        self.num_files = FAN_OUT + 50
+        for i in range(self.num_files):  # Each in its own directory so directories fan out too
+            os.makedirs(f"usb/dir{i}")
+            with open(f"usb/dir{i}/file{i}.txt", "w") as f:
+                f.write(f"File number {i}")
+        self.ar = Archiver()
+        self.ar.create_file_database(Path("usb"))
+        self.ar.convert_to_hash_database()
+
+    def tearDown(self):
+        os.chdir(self.start_dir)
+        shutil.rmtree(self.work_dir)
+
+    def test_write(self):
+        self.ar.segment("cd")
+        self.ar.save()
+        self.assertEqual(1, self.ar.num_discs)
+        filename = self.ar.write_iso(disc_num=0)
+        self.assertEqual(self.ar.image_size(0), os.path.getsize(filename))
+        self.assertLessEqual(os.path.getsize(filename), self.ar.hash_db.disc_usage(0))
+        iso = pycdlib.PyCdlib()
+        iso.open(filename)
+        try:
+            names = [child.file_identifier().decode("ascii") for child in iso.list_children(iso_path="/DATA")
+                     if not child.is_dot() and not child.is_dotdot()]
+            self.assertEqual(["D000", "D001", "F000", "F001"], sorted(names))
+            for bucket in names:
+                children = list(iso.list_children(iso_path=f"/DATA/{bucket}"))
+                self.assertLessEqual(len(children) - 2, FAN_OUT)
+        finally:
+            iso.close()
+        with Disc(filename) as disc:
+            for i in (0, FAN_OUT - 1, FAN_OUT, self.num_files - 1):
+                self.assertEqual(f"File number {i}".encode("ascii"), disc.read(f"/DATA/dir{i}/file{i}.txt"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+"""
+Tests for writing the duplicates of a file to its disc as UDF hard links to the one copy of its data.
+"""
+import os
+from pathlib import Path
+import random
+import shutil
+import tempfile
+import threading
+import unittest
+
+import pycdlib
+
+from odarchive import Archiver
+from odarchive.file_parts import part_name
+from odarchive.segmenter import LOCALITY
+
+DISC_SIZE = 700000
+
+
+class TestHardLinks(unittest.TestCase):
+
+    def setUp(self):
+        self.start_dir = os.getcwd()
+        self.work_dir = tempfile.mkdtemp()
+        os.chdir(self.work_dir)
+        rng = random.Random(1)
+        for this_dir in ("usb/photos", "usb/copy/photos", "usb/many"):
+            os.makedirs(this_dir)
+        self.photo = b"a photo" * 1000
+        self.large = bytes(rng.getrandbits(8) for _ in range(250000))  # Split over discs
+        for this_dir in ("usb/photos", "usb/copy/photos"):
+            self.write(f"{this_dir}/photo.jpg", self.photo)
+            self.write(f"{this_dir}/large.bin", self.large)
+            self.write(f"{this_dir}/small.txt", b"packed")
+        for i in range(120):  # Enough links for the UDF directory to span sectors
+            self.write(f"usb/many/a copy of the photo with a long name {i:03}.jpg", self.photo)
+        self.ar = Archiver()
+        self.ar.create_file_database(Path("usb"))
+        self.ar.convert_to_hash_database()
+
+    def tearDown(self):
+        os.chdir(self.start_dir)
+        shutil.rmtree(self.work_dir)
+
+    def write(self, filename, data):
+        with open(filename, "wb") as f:
+            f.write(data)
+
+    def segment_locality(self, ar, size):
+        """Segments with the locality strategy, failing rather than hanging if it never finishes"""
+        thread = threading.Thread(target=lambda: ar.segment(size, strategy=LOCALITY), daemon=True)
+        thread.start()
+        thread.join(30)
+        self.assertFalse(thread.is_alive(), "locality segmenting hung")
+
+    def test_locality_with_duplicates_in_sub_directory(self):
+        # The links of a directory's duplicate in its sub directory once made the directory tree a cycle
+        os.makedirs("src/a/b")
+        self.write("src/a/0.txt", b"same")
+        self.write("src/a/b/copy.txt", b"same")
+        self.write("src/a/b/other.txt", b"other")
+        ar = Archiver()
+        ar.create_file_database(Path("src"))
+        ar.convert_to_hash_database()
+        self.segment_locality(ar, "cd")
+        self.assertEqual({0}, {entry.disc_num for entry in ar.hash_db.files()})
+
+    def test_locality(self):
+        self.segment_locality(self.ar, DISC_SIZE)
+        self.assertEqual(0, self.ar.hash_db.disc_totals(None).num_files)
+        for disc_num in range(self.ar.num_discs):
+            self.assertLessEqual(self.ar.hash_db.disc_usage(disc_num), DISC_SIZE)
+
+    def test_links(self):
+        self.ar.segment(DISC_SIZE, pack_threshold=100)
+        self.ar.save()
+        photo = next(entry for entry in self.ar.hash_db.files() if entry.size == len(self.photo))
+        large = next(entry for entry in self.ar.hash_db.files() if entry.is_split)
+        self.assertEqual(121, len(photo.link_paths()))
+        extents = {}
+        for disc_num in range(self.ar.num_discs):
+            filename = self.ar.write_iso(disc_num=disc_num)
+            self.assertEqual(self.ar.image_size(disc_num), os.path.getsize(filename))
+            self.assertLessEqual(os.path.getsize(filename), self.ar.hash_db.disc_usage(disc_num))
+            iso = pycdlib.PyCdlib()
+            iso.open(filename)
+            try:
+                if photo.disc_num == disc_num:
+                    for udf_path in [photo.udf_absolute_path] + photo.link_paths():
+                        record = iso.get_record(udf_path=str(udf_path))
+                        extents.setdefault("photo", set()).add(record.inode.extent_location())
+                        self.assertEqual(len(self.photo), record.get_data_length())
+                for part in large.parts:
+                    if part.disc_num == disc_num:
+                        link_path = large.link_paths(part.part_num)[0]
+                        self.assertTrue(link_path.name.startswith(part_name("large.bin", part.part_num)))
+                        part_record = iso.get_record(udf_path=str(large.part_udf_path(part)))
+                        self.assertEqual(part_record.inode.extent_location(),
+                                         iso.get_record(udf_path=str(link_path)).inode.extent_location())
+                # Packed files are only in the container
+                with self.assertRaises(pycdlib.pycdlibexception.PyCdlibException):
+                    iso.get_record(udf_path="/DATA/copy/photos/small.txt")
+            finally:
+                iso.close()
+        self.assertEqual(1, len(extents["photo"]))  # One copy of the data
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -55,6 +55,7 @@ Is segmented    = True
   Disc segment size = cd, 737,280,000 bytes
   Catalogue size = 0 bytes
   Number of discs = 1
+  Disc 0 fill = 582,718 bytes (0.08%)
 Number of files = 6
   Largest file  = 33
 Number of dirs  = 2
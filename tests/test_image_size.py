@@ -0,0 +1,124 @@
+"""
+Tests that the model of the image size matches what pycdlib writes.
+"""
+from io import BytesIO
+import os
+from pathlib import Path, PurePosixPath
+import random
+import tempfile
+import unittest
+
+import pycdlib
+
+from odarchive import Archiver, interpret_disc_capacity, odarchiveError
+from odarchive.image_size import ImageLayout, base_disc_size, directory_cost, file_cost
+
+from utils import test_1_clean
+
+
+def build_tree(rng, num_dirs, num_files):
+    """Returns lists of (iso_path, udf_path) for directories and (size, iso_path, udf_path) for files laid out
+    the same way as write_iso"""
+    dirs = [("/DATA", "/DATA")]
+    for i in range(1, num_dirs + 1):
+        parent = rng.choice(dirs)[1]
+        name = "".join(rng.choice("abcxyzé€漢 ") for _ in range(rng.randint(1, 60))) + str(i)
+        dirs.append((f"/DATA/{i:08}", f"{parent}/{name}"))
+    files = []
+    for i in range(num_files):
+        parent = rng.choice(dirs)[1]
+        name = "".join(rng.choice("defé漢.") for _ in range(rng.randint(1, 100))) + str(i)
+        files.append((rng.choice((0, 1, 2047, 2048, 2049, 10000)), f"/DATA/{i:08}", f"{parent}/{name}"))
+    return dirs, files
+
+
+class TestImageLayout(unittest.TestCase):
+
+    def test_matches_pycdlib(self):
+        rng = random.Random(1)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            filename = os.path.join(temp_dir, "test.iso")
+            for num_dirs, num_files in ((0, 0), (0, 3), (5, 60), (80, 600)):
+                dirs, files = build_tree(rng, num_dirs, num_files)
+                iso = pycdlib.PyCdlib()
+                iso.new(interchange_level=3, udf="2.60")
+                layout = ImageLayout()
+                iso.add_fp(BytesIO(b"readme"), 6, "/README.MKD;1", udf_path="/readme.mkd")
+                layout.add_file(6, "/README.MKD;1", "/readme.mkd")
+                for iso_path, udf_path in dirs:
+                    iso.add_directory(iso_path, udf_path=udf_path)
+                    layout.add_directory(iso_path, udf_path)
+                for size, iso_path, udf_path in files:
+                    iso.add_fp(BytesIO(b"x" * size), size, iso_path, udf_path=udf_path)
+                    layout.add_file(size, iso_path, udf_path)
+                iso.write(filename)
+                iso.close()
+                self.assertEqual(os.path.getsize(filename), layout.size(), f"{num_dirs} dirs, {num_files} files")
+
+    def test_upper_bound(self):
+        """Costing one file at a time is an upper bound but not by much"""
+        rng = random.Random(2)
+        for num_dirs, num_files in ((0, 1), (10, 100), (200, 3000)):
+            dirs, files = build_tree(rng, num_dirs, num_files)
+            layout = ImageLayout()
+            layout.add_file(1000, "/README.MKD;1", "/readme.mkd")
+            estimate = base_disc_size({"readme.mkd": 1000})
+            for iso_path, udf_path in dirs:
+                layout.add_directory(iso_path, udf_path)
+                if udf_path != "/DATA":
+                    estimate += directory_cost(PurePosixPath(udf_path).name)
+            for size, iso_path, udf_path in files:
+                layout.add_file(size, iso_path, udf_path)
+                estimate += file_cost(size, PurePosixPath(udf_path).name)
+            self.assertGreaterEqual(estimate, layout.size())
+            self.assertLess(estimate - layout.size(), 20 * 2048 + num_dirs * 3 * 2048)
+
+    def test_bluray_capacity(self):
+        self.assertEqual(25025314816, interpret_disc_capacity("bd"))
+
+    def test_bad_capacity(self):
+        self.assertEqual(1000, interpret_disc_capacity("1000"))
+        with self.assertRaises(odarchiveError):
+            interpret_disc_capacity("dvd9")
+
+
+class TestArchiveImageSize(unittest.TestCase):
+
+    def setUp(self):
+        self.start_dir = os.getcwd()
+        os.chdir(Path(__file__).parents[0] / "test_1_files")
+        test_1_clean()
+        self.ar = Archiver()
+        self.ar.create_file_database(Path("usb"))
+        self.ar.convert_to_hash_database()
+
+    def tearDown(self):
+        test_1_clean()
+        os.chdir(self.start_dir)
+
+    def check_discs(self, size):
+        usage = self.ar.hash_db.disc_usage()
+        for disc_num in range(self.ar.num_discs):
+            self.ar.write_iso(disc_num=disc_num)
+            actual = os.path.getsize(f"new_{disc_num:04}.iso")
+            self.assertEqual(actual, self.ar.image_size(disc_num))
+            self.assertLessEqual(actual, usage[disc_num])
+            self.assertLess(actual, size)
+
+    def test_full_catalogue(self):
+        """The catalogue doesn't need to be saved before segmenting"""
+        self.ar.segment(583000)
+        self.ar.save()
+        self.assertEqual(2, self.ar.num_discs)
+        self.assertLessEqual(os.path.getsize("catalogue.json"), self.ar.estimate_catalogue_size())
+        self.check_discs(583000)
+
+    def test_sharded_catalogue(self):
+        self.ar.segment(583000, sharded=True)
+        self.ar.save()
+        self.ar.save_index()
+        self.check_discs(583000)
+
+
+if __name__ == "__main__":
+    unittest.main()
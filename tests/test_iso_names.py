@@ -0,0 +1,115 @@
+"""
+Tests for allocating ISO 9660 names and keeping the mapping from UDF paths.
+"""
+import os
+from pathlib import Path, PurePosixPath
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from odarchive import Archiver, load_archiver_from_checkpoint, load_archiver_from_json, DB_FILENAME
+from odarchive.iso_names import BridgeNames, iso9660_file_name, NameAllocator, translate
+from odarchive.tools import build_iso_path, DirLevel
+
+
+class TestNameAllocator(unittest.TestCase):
+
+    def test_translate(self):
+        self.assertEqual("FOURTH__TXT", translate("fourthé.txt"))
+        self.assertEqual(("FOURTH_", "TXT"), iso9660_file_name("fourthé.txt"))
+        self.assertEqual(("A_LONG_F", "HTML"), iso9660_file_name("a long file name.html"))
+
+    def test_clashes(self):
+        allocator = NameAllocator()
+        names = [allocator.allocate("/DATA", "LONGNAME", "TXT") for _ in range(1200)]
+        self.assertEqual(len(names), len(set(names)))
+        self.assertEqual(["LONGNAME.TXT;1", "LONGN000.TXT;1", "LONGN001.TXT;1"], names[:3])
+        self.assertEqual("LONGN999.TXT;1", names[1000])
+        self.assertEqual("LONG0000.TXT;1", names[1001])  # Widened and still 8 characters
+        self.assertTrue(all(len(name.split(".")[0]) <= 8 for name in names))
+        # Other directories and extensions have their own names
+        self.assertEqual("LONGNAME.TXT;1", allocator.allocate("/DATA/DIR", "LONGNAME", "TXT"))
+        self.assertEqual("LONGNAME.DOC;1", allocator.allocate("/DATA", "LONGNAME", "DOC"))
+        self.assertEqual("LONGNAME", allocator.allocate("/DATA", "LONGNAME", is_dir=True))
+        # A name that is already taken is skipped
+        allocator.reserve("/DATA", "SHORT000.TXT;1")
+        allocator.allocate("/DATA", "SHORT", "TXT")
+        self.assertEqual("SHORT001.TXT;1", allocator.allocate("/DATA", "SHORT", "TXT"))
+
+    def test_tools_build_iso_path(self):
+        root = DirLevel("/", "/", "/")
+        names = [build_iso_path(root, "longfilename.txt", 1, False) for _ in range(1500)]
+        self.assertNotIn(None, names)
+        self.assertEqual(len(names), len(set(names)))
+        self.assertEqual("/LONG0000.TXT;1", names[1001])
+
+
+class TestBridgeNames(unittest.TestCase):
+
+    def setUp(self):
+        self.start_dir = os.getcwd()
+        self.work_dir = tempfile.mkdtemp()
+        os.chdir(self.work_dir)
+        os.makedirs("usb/Photos 2018")
+        os.makedirs("usb/photos_2018")
+        for i, name in enumerate(("Photos 2018/holiday.jpg", "Photos 2018/Holiday.jpg", "photos_2018/holiday.jpg",
+                                  "photos_2018/other.jpg")):
+            with open(f"usb/{name}", "wb") as f:
+                f.write(bytes([i]) * 100)
+        self.ar = Archiver()
+        self.ar.create_file_database(Path("usb"))
+        self.ar.convert_to_hash_database()
+
+    def tearDown(self):
+        os.chdir(self.start_dir)
+        shutil.rmtree(self.work_dir)
+
+    def iso_paths(self, ar):
+        return {str(entry.udf_absolute_path): entry.iso9660_path for entry in ar.hash_db.files()}
+
+    def test_unique(self):
+        iso_paths = self.iso_paths(self.ar)
+        self.assertEqual(4, len(set(iso_paths.values())))
+        self.assertEqual({"/DATA/PHOTOS_2018", "/DATA/PHOTOS_2018000"},
+                         {str(PurePosixPath(iso_path).parent) for iso_path in iso_paths.values()})
+        # Only one of the directories and one of the holiday photos in it had to be renamed
+        changed = self.ar.hash_db.entries.bridge_names.changed()
+        self.assertEqual(2, len(changed))
+        self.assertIn("/DATA/PHOTOS_2018000", changed.values())
+        self.assertTrue(any(iso_path.endswith("/HOLID000.JPG;1") for iso_path in changed.values()))
+
+    def test_saved(self):
+        iso_paths = self.iso_paths(self.ar)
+        self.ar.save()
+        self.ar.save_checkpoint()
+        self.assertEqual(iso_paths, self.iso_paths(load_archiver_from_checkpoint()))
+        with open(DB_FILENAME) as f:
+            loaded = load_archiver_from_json(json_data=f.read())
+        self.assertEqual(iso_paths, self.iso_paths(loaded))
+
+    def test_stable_when_adding(self):
+        iso_paths = self.iso_paths(self.ar)
+        self.ar.save_checkpoint()
+        ar = load_archiver_from_checkpoint()
+        with open("usb/photos_2018/HOLIDAY.jpg", "wb") as f:  # Clashes with the existing photos
+            f.write(b"new")
+        ar.add_new_files()
+        new_paths = self.iso_paths(ar)
+        self.assertEqual(5, len(set(new_paths.values())))
+        for udf_path, iso_path in iso_paths.items():
+            self.assertEqual(iso_path, new_paths[udf_path])
+        ar.save_checkpoint()
+        self.assertEqual(new_paths, self.iso_paths(load_archiver_from_checkpoint()))
+
+    def test_not_allocated_to_save(self):
+        self.ar.save_checkpoint()
+        ar = load_archiver_from_checkpoint()
+        with mock.patch.object(BridgeNames, "_allocate_all") as allocate:
+            ar.save_checkpoint()
+            ar.save()
+        allocate.assert_not_called()  # Nothing has been added so the names loaded are saved again
+
+
+if __name__ == "__main__":
+    unittest.main()
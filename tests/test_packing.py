@@ -0,0 +1,156 @@
+"""
+Tests for packing small files into a container on each disc.
+"""
+import io
+import os
+from pathlib import Path
+import random
+import shutil
+import tempfile
+import unittest
+
+from odarchive import (Archiver, odarchiveError, load_archiver_from_checkpoint, load_archiver_from_discs,
+                       load_archiver_from_json, DB_FILENAME)
+from odarchive.packing import PackFile
+
+DISC_SIZE = 700000
+THRESHOLD = 1000
+
+
+class TestPackFile(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.contents = [b"abc", b"", b"defgh", b"i"]
+        self.files = []
+        for i, content in enumerate(self.contents):
+            filename = os.path.join(self.work_dir, f"f{i}")
+            with open(filename, "wb") as f:
+                f.write(content)
+            self.files.append((filename, len(content)))
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_read(self):
+        with PackFile(self.files) as f:
+            self.assertEqual(9, f.size)
+            self.assertEqual(b"abcdefghi", f.read())
+            f.seek(2)
+            self.assertEqual(b"cde", f.read(3))
+            self.assertEqual(5, f.tell())
+            f.seek(-2, io.SEEK_END)
+            self.assertEqual(b"hi", f.read(10))
+            self.assertEqual(b"", f.read())
+
+    def test_short_file(self):
+        filename, size = self.files[2]
+        with open(filename, "wb") as f:
+            f.write(b"de")
+        with PackFile(self.files) as f:
+            with self.assertRaises(odarchiveError):
+                f.read()
+
+
+class TestPackedArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.start_dir = os.getcwd()
+        self.work_dir = tempfile.mkdtemp()
+        os.chdir(self.work_dir)
+        rng = random.Random(1)
+        for i in range(8):
+            os.makedirs(f"usb/dir{i}")
+        for i in range(120):
+            self.write(f"usb/dir{i % 8}/small{i}.txt", bytes(rng.getrandbits(8) for _ in range(rng.randrange(500))))
+        for i in range(4):
+            self.write(f"usb/dir{i}/big{i}.bin", bytes([i]) * 20000)
+        self.write("usb/dir0/copy0.txt", open("usb/dir1/small1.txt", "rb").read())
+
+    def tearDown(self):
+        os.chdir(self.start_dir)
+        shutil.rmtree(self.work_dir)
+
+    def write(self, filename, data):
+        with open(filename, "wb") as f:
+            f.write(data)
+
+    def archiver(self):
+        ar = Archiver()
+        ar.create_file_database(Path("usb"))
+        ar.convert_to_hash_database()
+        return ar
+
+    def write_isos(self, ar):
+        ar.save()
+        filenames = []
+        for disc_num in range(ar.num_discs):
+            ar.write_iso(disc_num=disc_num)
+            filenames.append(f"new_{disc_num:04}.iso")
+        return filenames
+
+    def test_fewer_discs(self):
+        unpacked = self.archiver()
+        unpacked.segment(DISC_SIZE)
+        ar = self.archiver()
+        ar.segment(DISC_SIZE, pack_threshold=THRESHOLD)
+        self.assertLess(ar.num_discs, unpacked.num_discs)
+        self.assertLess(sum(ar.hash_db.disc_usage()), sum(unpacked.hash_db.disc_usage()))
+        packed = [entry for entry in ar.hash_db.files() if entry.is_packed]
+        self.assertEqual(120, len(packed))  # The copy shares its entry
+        self.assertFalse(any(entry.size >= THRESHOLD for entry in packed))
+        planned = self.archiver()  # Fresh as the offsets are known once segmented
+        planned.hash_db.pack_threshold = THRESHOLD
+        plan = planned.plan([DISC_SIZE])[0]
+        self.assertEqual(ar.num_discs, plan.num_discs)
+
+    def test_offsets(self):
+        ar = self.archiver()
+        ar.segment(DISC_SIZE, pack_threshold=THRESHOLD)
+        for disc_num in range(ar.num_discs):
+            offset = 0
+            for entry in ar.hash_db.packed_files(disc_num):
+                self.assertEqual(offset, entry.pack_offset)
+                offset += entry.size
+        # Segmenting again without packing clears them
+        ar.segment(DISC_SIZE, pack_threshold=0)
+        self.assertFalse(any(entry.is_packed for entry in ar.hash_db.files()))
+
+    def test_write_and_restore(self):
+        for sharded in (False, True):
+            ar = self.archiver()
+            ar.segment(DISC_SIZE, sharded=sharded, pack_threshold=THRESHOLD)
+            if sharded:
+                ar.save_index()
+            filenames = self.write_isos(ar)
+            for disc_num, filename in enumerate(filenames):
+                self.assertEqual(ar.image_size(disc_num), os.path.getsize(filename))
+                self.assertLess(os.path.getsize(filename), DISC_SIZE)
+            restore_dir = f"restored_{sharded}"
+            loaded, discs = load_archiver_from_discs(filenames)
+            restored = loaded.restore(discs, restore_dir)
+            self.assertEqual(125, len(restored))
+            for path in Path("usb").rglob("*"):
+                if path.is_file():
+                    self.assertEqual(path.read_bytes(), (Path(restore_dir) / path.relative_to("usb")).read_bytes())
+            for filename in filenames:
+                os.remove(filename)
+
+    def test_saved_offsets(self):
+        ar = self.archiver()
+        ar.segment(DISC_SIZE, pack_threshold=THRESHOLD)
+        ar.save()
+        ar.save_checkpoint()
+        offsets = {entry.file_hash: entry.pack_offset for entry in ar.hash_db.files()}
+        loaded = load_archiver_from_checkpoint()
+        self.assertEqual(THRESHOLD, loaded.hash_db.pack_threshold)
+        self.assertEqual(offsets, {entry.file_hash: entry.pack_offset for entry in loaded.hash_db.files()})
+        with open(DB_FILENAME) as f:
+            loaded = load_archiver_from_json(json_data=f.read())
+        self.assertEqual(offsets, {entry.file_hash: entry.pack_offset for entry in loaded.hash_db.files()})
+        # The catalogue size allowed for each packed entry covers its offset
+        self.assertLessEqual(len(ar.catalogue_json().encode("utf-8")), ar.estimate_catalogue_size())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,181 @@
+"""
+Tests for the Reed-Solomon parity of a disc and repairing an image from it.
+"""
+import errno
+import os
+from pathlib import Path
+import random
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from odarchive import Archiver, interpret_disc_capacity, load_archiver_from_discs, odarchiveError
+from odarchive import parity
+from odarchive.journal import hash_image
+from odarchive.parity import image_capacity, np, ParityLayout, parity_rows, repair_image, SECTOR_SIZE
+
+DISC_SIZE = 1200000
+
+
+class TestParityLayout(unittest.TestCase):
+
+    def test_capacity(self):
+        disc_size = interpret_disc_capacity("dvd")
+        for fraction in (0.01, 0.05, 0.2):
+            capacity = image_capacity(disc_size, fraction)
+            layout = ParityLayout(capacity // SECTOR_SIZE, parity_rows(fraction))
+            self.assertLessEqual(layout.size, disc_size)
+            self.assertGreater(ParityLayout(capacity // SECTOR_SIZE + 1, parity_rows(fraction)).size, disc_size)
+            self.assertAlmostEqual(fraction, layout.parity_sectors / layout.total_sectors, delta=0.002)
+        self.assertEqual(disc_size, image_capacity(disc_size, 0))
+        with self.assertRaises(odarchiveError):
+            image_capacity(disc_size, 0.6)
+
+    def test_codewords(self):
+        layout = ParityLayout(1000, 13)
+        self.assertEqual(5, layout.groups)
+        self.assertEqual(200, layout.rows)
+        places = {layout.codeword(index) for index in range(layout.covered)}
+        self.assertEqual(layout.covered, len(places))  # Each sector has a place of its own in a codeword
+        self.assertEqual({0, 1, 2, 3, 4}, {layout.codeword(index)[0] for index in range(995, 1000)})
+        self.assertLess(max(power for group, power in places), 255)
+        for index in (0, 999, 1000, layout.covered - 1):
+            self.assertEqual(index, layout.covered_index(layout.sector(index)))
+        self.assertIsNone(layout.covered_index(layout.header))
+        self.assertEqual(layout.size, ParityLayout.from_header(layout.header_bytes()).size)
+        self.assertIsNone(ParityLayout.from_header(bytes(SECTOR_SIZE)))
+
+
+@unittest.skipUnless(np, "NumPy is needed for parity")
+class TestParity(unittest.TestCase):
+
+    def setUp(self):
+        self.start_dir = os.getcwd()
+        self.work_dir = tempfile.mkdtemp()
+        os.chdir(self.work_dir)
+        rng = random.Random(1)
+        for i in range(3):
+            os.makedirs(f"usb/dir{i}")
+        for i in range(30):
+            self.write(f"usb/dir{i % 3}/file{i}.bin", bytes(rng.getrandbits(8) for _ in range(rng.randrange(30000))))
+        self.write("usb/large.bin", bytes(rng.getrandbits(8) for _ in range(250000)))  # Split over discs
+        self.ar = Archiver()
+        self.ar.create_file_database(Path("usb"))
+        self.ar.convert_to_hash_database()
+        self.ar.segment(DISC_SIZE, parity=0.1)
+        self.ar.save()
+        self.isos = [self.ar.write_iso(disc_num=disc_num) for disc_num in range(self.ar.num_discs)]
+
+    def tearDown(self):
+        os.chdir(self.start_dir)
+        shutil.rmtree(self.work_dir)
+
+    def write(self, filename, data):
+        with open(filename, "wb") as f:
+            f.write(data)
+
+    def damage(self, filename, sectors):
+        with open(filename, "r+b") as f:
+            for sector in sectors:
+                f.seek(sector * SECTOR_SIZE)
+                f.write(b"\xff" * SECTOR_SIZE)
+
+    def test_capacity(self):
+        plain = Archiver()
+        plain.create_file_database(Path("usb"))
+        plain.convert_to_hash_database()
+        plain.segment(DISC_SIZE)
+        self.assertGreaterEqual(plain.hash_db.capacity() - self.ar.hash_db.capacity(),
+                                DISC_SIZE - image_capacity(DISC_SIZE, 0.1))
+        self.assertGreater(self.ar.num_discs, 1)
+        for disc_num, filename in enumerate(self.isos):
+            self.assertEqual(self.ar.image_size(disc_num), os.path.getsize(filename))
+            self.assertLessEqual(os.path.getsize(filename), DISC_SIZE)
+
+    def test_image_still_reads(self):
+        ar, discs = load_archiver_from_discs(self.isos)
+        restored = ar.restore(discs, "restored")
+        for path in restored:
+            self.assertEqual((Path("usb") / path.relative_to("restored")).read_bytes(), path.read_bytes())
+        self.assertTrue(self.ar.scrub(self.isos[:1])[0].passed)
+
+    def test_stream(self):
+        with open("streamed.iso", "wb") as f:
+            with self.assertRaises(odarchiveError):
+                self.ar.stream_iso(f, 0)  # The disc was sized for parity that a stream can't have
+            stream = self.ar.stream_iso(f, 0, without_parity=True)
+        self.assertEqual(repair_image(self.isos[0]).layout.data_sectors * SECTOR_SIZE, stream.size)
+
+    def test_good(self):
+        report = repair_image(self.isos[0])
+        self.assertTrue(report.passed, report.summary())
+        self.assertEqual([], report.bad_sectors)
+
+    def test_repair(self):
+        image_hash = hash_image(self.isos[0])
+        layout = repair_image(self.isos[0]).layout
+        burst = range(200, 200 + layout.groups * (layout.parity_rows - 1))  # Leaves a sector for the one below
+        self.assertEqual(2, layout.crc_sectors)
+        bad = list(burst) + [layout.header, layout.parity_start + 3, layout.crc_start, layout.crc_copy_start + 1]
+        self.damage(self.isos[0], bad)
+        report = repair_image(self.isos[0], "repaired.iso")
+        self.assertTrue(report.passed, report.summary())
+        self.assertEqual(sorted(bad), report.bad_sectors)
+        self.assertEqual(sorted(bad), report.repaired)
+        self.assertEqual(image_hash, hash_image("repaired.iso"))
+        self.assertTrue(self.ar.verify_iso("repaired.iso", 0).passed)
+
+    def test_unrecoverable(self):
+        layout = repair_image(self.isos[0]).layout
+        lost = [sector for sector in range(layout.data_sectors) if sector % layout.groups == 1]
+        self.damage(self.isos[0], lost[:layout.parity_rows + 1] + [0])
+        report = repair_image(self.isos[0])
+        self.assertFalse(report.passed)
+        self.assertEqual(lost[:layout.parity_rows + 1], report.unrecoverable)
+        self.assertEqual([0], report.repaired)  # In another codeword
+        self.assertIn(f"{layout.parity_rows + 1} sectors can't be repaired", report.summary())
+
+    def test_read_errors(self):
+        image_hash = hash_image(self.isos[1])
+        layout = repair_image(self.isos[1]).layout
+        bad = set(range(30, 40)) | {layout.trailer}
+        pread = os.pread
+
+        def failing_pread(fd, size, position):
+            if any(position <= sector * SECTOR_SIZE < position + size for sector in bad):
+                raise OSError(errno.EIO, "Input/output error")
+            return pread(fd, size, position)
+
+        copy_image = parity._copy_image
+
+        def failing_copy(image, output, report):  # Only the disc has read errors, not the copy
+            with mock.patch("os.pread", side_effect=failing_pread):
+                copy_image(image, output, report)
+
+        with mock.patch.object(parity, "_copy_image", side_effect=failing_copy):
+            report = repair_image(self.isos[1], "repaired.iso")
+        self.assertTrue(report.passed, report.summary())
+        self.assertEqual(sorted(bad), sorted(set(report.unreadable_sectors)))
+        self.assertEqual(image_hash, hash_image("repaired.iso"))
+
+    def test_truncated(self):
+        image_hash = hash_image(self.isos[0])
+        size = os.path.getsize(self.isos[0])
+        with open(self.isos[0], "r+b") as f:
+            f.truncate(size - 5 * SECTOR_SIZE)  # The trailer and some of the CRC table
+        report = repair_image(self.isos[0])
+        self.assertTrue(report.passed, report.summary())
+        self.assertEqual(image_hash, hash_image(self.isos[0]))
+
+    def test_write_all_isos(self):
+        filenames = self.ar.write_all_isos(job_name="all", processes=1)
+        for disc_num, filename in enumerate(filenames):
+            self.assertEqual(self.ar.image_size(disc_num), os.path.getsize(filename))
+            self.assertTrue(repair_image(filename).passed)
+        # The journal has the size and hash of the whole image with its parity
+        self.assertEqual(filenames, self.ar.write_all_isos(job_name="all", processes=1, verify=True))
+
+
+if __name__ == "__main__":
+    unittest.main()
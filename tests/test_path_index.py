@@ -0,0 +1,87 @@
+"""
+Tests for getting a single file from its disc through the path index.
+"""
+import importlib
+from io import BytesIO
+import os
+from pathlib import Path
+import random
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from odarchive import Archiver, odarchiveError
+from odarchive.path_index import get_file, lookup_path, PATH_INDEX_FILENAME
+
+restore_module = importlib.import_module("odarchive.restore")  # odarchive.restore is also the restore command
+
+DISC_SIZE = 700000
+
+
+class TestPathIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.start_dir = os.getcwd()
+        self.work_dir = tempfile.mkdtemp()
+        os.chdir(self.work_dir)
+        rng = random.Random(1)
+        for i in range(3):
+            os.makedirs(f"usb/dir{i}/sub")
+        for i in range(30):
+            self.write(f"usb/dir{i % 3}/file{i}.bin", bytes(rng.getrandbits(8) for _ in range(rng.randrange(30000))))
+        for i in range(20):
+            self.write(f"usb/dir{i % 3}/sub/small {i}.txt", f"small file {i}".encode())
+        self.write("usb/large.bin", bytes(rng.getrandbits(8) for _ in range(250000)))  # Split over discs
+        shutil.copy("usb/dir0/file0.bin", "usb/dir1/copy.bin")
+        self.write("usb/empty.txt", b"")
+        self.ar = Archiver()
+        self.ar.create_file_database(Path("usb"))
+        self.ar.convert_to_hash_database()
+        self.ar.segment(DISC_SIZE, pack_threshold=100)
+        self.ar.save()
+        self.ar.save_path_index()
+        for disc_num in range(self.ar.num_discs):
+            self.ar.write_iso(disc_num=disc_num)
+        self.paths = sorted(str(path.relative_to("usb")) for path in Path("usb").rglob("*") if path.is_file())
+
+    def tearDown(self):
+        os.chdir(self.start_dir)
+        shutil.rmtree(self.work_dir)
+
+    def write(self, filename, data):
+        with open(filename, "wb") as f:
+            f.write(data)
+
+    def test_lookup(self):
+        for path in self.paths:
+            location = lookup_path(path)
+            self.assertEqual(os.path.getsize(Path("usb") / path), location["size"])
+        self.assertEqual(lookup_path("dir0/file0.bin")["hash"], lookup_path("/dir1/copy.bin")["hash"])
+        self.assertIn("parts", lookup_path("large.bin"))
+        self.assertIn("pack_offset", lookup_path("dir0/sub/small 0.txt"))
+        for path in ("", "a", "dir0", "dir0/file0.bi", "dir0/file0.bin0", "zzz"):
+            self.assertIsNone(lookup_path(path))
+        self.assertEqual(len(self.paths), len(Path(PATH_INDEX_FILENAME).read_text(encoding="utf-8").splitlines()))
+
+    def test_get(self):
+        for path in self.paths:
+            outfp = BytesIO()
+            get_file(path, outfp)
+            self.assertEqual((Path("usb") / path).read_bytes(), outfp.getvalue())
+        with self.assertRaises(odarchiveError):
+            get_file("not/there.txt", BytesIO())
+
+    def test_one_image(self):
+        path = next(path for path in self.paths if "udf_path" in lookup_path(path) and lookup_path(path)["disc_num"])
+        with mock.patch.object(restore_module.Disc, "__init__", autospec=True,
+                               side_effect=restore_module.Disc.__init__) as disc_init:
+            get_file(path, BytesIO())
+        self.assertEqual([f"new_{lookup_path(path)['disc_num']:04}.iso"], [call.args[1] for call in
+                                                                            disc_init.call_args_list])
+        with self.assertRaises(odarchiveError):  # The wrong disc
+            get_file(path, BytesIO(), images="new_0000.iso")
+
+
+if __name__ == "__main__":
+    unittest.main()
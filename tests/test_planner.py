@@ -0,0 +1,85 @@
+"""
+Tests for planning the number of discs needed for several disc sizes.
+"""
+import os
+from pathlib import Path
+import random
+import shutil
+import tempfile
+import unittest
+
+from odarchive import Archiver, DISC_SIZES
+from odarchive.planner import format_plan_table
+
+
+def make_tree(rng, num_dirs, num_files):
+    dirs = ["usb"]
+    for i in range(num_dirs):
+        this_dir = os.path.join(rng.choice(dirs), f"dir{i}")
+        os.makedirs(this_dir)
+        dirs.append(this_dir)
+    for i in range(num_files):
+        with open(os.path.join(rng.choice(dirs), f"file{i}.bin"), "wb") as f:
+            f.write(bytes([i % 256]) * rng.choice((10, 3000, 20000, 90000)))
+
+
+class TestPlanner(unittest.TestCase):
+
+    def setUp(self):
+        self.start_dir = os.getcwd()
+        self.work_dir = tempfile.mkdtemp()
+        os.chdir(self.work_dir)
+        os.makedirs("usb")
+        make_tree(random.Random(1), 10, 150)
+
+    def tearDown(self):
+        os.chdir(self.start_dir)
+        shutil.rmtree(self.work_dir)
+
+    def archiver(self, priority_rules=()):
+        ar = Archiver()
+        ar.set_priority_rules(priority_rules)
+        ar.create_file_database(Path("usb"))
+        ar.convert_to_hash_database()
+        return ar
+
+    def check_same_as_segment(self, ar, sizes, sharded=False):
+        ar.catalogue_mode = "sharded" if sharded else "full"
+        plans = ar.plan(sizes)
+        for size, plan in zip(sizes, plans):
+            ar = self.archiver(ar.priority_rules)  # Fresh as segmenting can split files
+            ar.segment(size, sharded=sharded)
+            self.assertEqual(ar.num_discs, plan.num_discs, f"Size {size:,}")
+            if not sharded:  # Sharded fills are estimated with the largest disc number
+                self.assertEqual(ar.hash_db.disc_usage(), plan.fills, f"Size {size:,}")
+            self.assertTrue(all(fill < size for fill in plan.fills))
+
+    def test_same_as_segment(self):
+        sizes = [700000, 850000, 1000000, 3000000, 30000000]
+        self.check_same_as_segment(self.archiver(), sizes)
+        self.check_same_as_segment(self.archiver(), sizes, sharded=True)
+
+    def test_tiers(self):
+        self.check_same_as_segment(self.archiver(["0:path:dir3/*", "1:ext:txt"]), [850000, 3000000])
+
+    def test_split_files(self):
+        ar = self.archiver()
+        plan = ar.plan([650000])[0]
+        self.assertGreater(plan.split_files, 0)
+        ar.segment(650000)
+        self.assertEqual(ar.num_discs, plan.num_discs)
+        # No part of a file can fit on a disc that is all overhead
+        plan = ar.plan([ar.hash_db.disc_overhead()])[0]
+        self.assertIsNone(plan.num_discs)
+
+    def test_named_sizes(self):
+        plans = self.archiver().plan()
+        self.assertEqual(list(DISC_SIZES), [plan.size for plan in plans])
+        self.assertTrue(all(plan.num_discs == 1 for plan in plans))
+        table = format_plan_table(plans)
+        self.assertIn("bd-xx", table)
+        self.assertEqual(len(DISC_SIZES) + 1, len(table.split("\n")))
+
+
+if __name__ == "__main__":
+    unittest.main()
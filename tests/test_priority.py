@@ -0,0 +1,99 @@
+"""
+Tests for priority tiers that put critical files on the first discs.
+"""
+import os
+from pathlib import Path, PurePosixPath
+import shutil
+import tempfile
+import time
+import unittest
+
+from odarchive import Archiver, odarchiveError, load_archiver_from_checkpoint
+from odarchive.priority import PriorityRule, PriorityRules
+
+DISC_SIZE = 700000
+
+
+class TestPriorityRules(unittest.TestCase):
+
+    def test_rules(self):
+        now = time.time()
+        rules = PriorityRules(["0:path:Photos/*", "1:ext:JPG, raw", "2:newer:30"])
+        self.assertEqual(0, rules.tier([PurePosixPath("Photos/2018/a.txt")], now))
+        self.assertEqual(1, rules.tier([PurePosixPath("other/a.jpg")], now))
+        self.assertEqual(1, rules.tier([PurePosixPath("other/a.RAW")], now - 100 * 86400))
+        self.assertEqual(2, rules.tier([PurePosixPath("other/a.txt")], now - 86400))
+        self.assertEqual(3, rules.tier([PurePosixPath("other/a.txt")], now - 100 * 86400))
+        # A duplicate is in the best tier of any of its paths
+        self.assertEqual(0, rules.tier([PurePosixPath("other/a.txt"), PurePosixPath("Photos/a.txt")], now))
+        self.assertTrue(PriorityRule.from_spec("0:older:365").matches("a", now - 400 * 86400, now))
+        self.assertEqual(0, PriorityRules().tier([PurePosixPath("a")], now))
+
+    def test_bad_rules(self):
+        for spec in ("path:*", "x:path:*", "-1:path:*", "0:colour:red", "0:path:"):
+            with self.assertRaises(odarchiveError):
+                PriorityRules([spec])
+
+
+class TestPrioritySegment(unittest.TestCase):
+
+    def setUp(self):
+        self.start_dir = os.getcwd()
+        self.work_dir = tempfile.mkdtemp()
+        os.chdir(self.work_dir)
+        for directory in ("usb/Photos", "usb/other"):
+            os.makedirs(directory)
+        for i in range(30):
+            self.write(f"usb/other/file{i}.bin", 3000, i)
+        for i in range(10):
+            self.write(f"usb/Photos/photo{i}.jpg", 3000, 100 + i)
+
+    def tearDown(self):
+        os.chdir(self.start_dir)
+        shutil.rmtree(self.work_dir)
+
+    def write(self, filename, size, seed):
+        with open(filename, "wb") as f:
+            f.write(bytes([seed]) * size)
+
+    def disc_nums(self, ar):
+        result = {}
+        for entry in ar.hash_db.files():
+            result.setdefault(entry.filename.parent.name, set()).add(entry.disc_num)
+        return result
+
+    def test_tiers_on_own_discs(self):
+        ar = Archiver()
+        ar.set_priority_rules(["0:path:Photos/*"])
+        ar.create_file_database(Path("usb"))
+        ar.convert_to_hash_database()
+        ar.segment(DISC_SIZE)
+        disc_nums = self.disc_nums(ar)
+        self.assertEqual({0}, disc_nums["Photos"])
+        self.assertNotIn(0, disc_nums["other"])
+        self.assertGreater(len(disc_nums["other"]), 1)
+
+    def test_burn_first_tier_early(self):
+        """The first tier is segmented and written before the rest are hashed"""
+        ar = Archiver()
+        ar.set_priority_rules(["0:ext:jpg"])
+        ar.create_file_database(Path("usb"))
+        ar.convert_to_hash_database(max_tier=0)
+        self.assertEqual(10, len(ar.hash_db.entries))
+        ar.segment(DISC_SIZE)
+        ar.save()
+        ar.write_iso(disc_num=0)
+        ar.locked = True
+        ar.save_checkpoint()
+        ar = load_archiver_from_checkpoint()
+        self.assertEqual(["0:ext:jpg"], ar.priority_rules)
+        self.assertEqual(30, ar.add_new_files())
+        new_discs = ar.segment_new_files()
+        self.assertEqual(1, new_discs.start)
+        disc_nums = self.disc_nums(ar)
+        self.assertEqual({0}, disc_nums["Photos"])
+        self.assertTrue(disc_nums["other"] <= set(new_discs))
+
+
+if __name__ == "__main__":
+    unittest.main()
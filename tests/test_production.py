@@ -0,0 +1,140 @@
+"""
+Tests for producing the images of a set on a bounded scratch space while they are consumed.
+"""
+import os
+from pathlib import Path
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from odarchive import Archiver, odarchiveError, load_archiver_from_discs
+from odarchive.journal import Journal
+from odarchive.production import command_consumer, produce_images
+
+DISC_SIZE = 700000
+
+
+class TestProduction(unittest.TestCase):
+
+    def setUp(self):
+        self.start_dir = os.getcwd()
+        self.work_dir = tempfile.mkdtemp()
+        os.chdir(self.work_dir)
+        for i in range(4):
+            os.makedirs(f"usb/dir{i}")
+        for i in range(40):
+            with open(f"usb/dir{i % 4}/file{i}.bin", "wb") as f:
+                f.write(bytes([i]) * (3000 + i))
+        os.makedirs("consumed")
+        self.ar = Archiver()
+        self.ar.create_file_database(Path("usb"))
+        self.ar.convert_to_hash_database()
+        self.ar.segment(DISC_SIZE)
+        self.ar.save()
+        self.sizes = [self.ar.image_size(disc_num) for disc_num in range(self.ar.num_discs)]
+        self.budget = 2 * max(self.sizes)
+        self.peak = 0
+
+    def tearDown(self):
+        os.chdir(self.start_dir)
+        shutil.rmtree(self.work_dir)
+
+    def consume(self, disc_num, filename):
+        """Keeps a copy of the image and how much space the images took at most"""
+        self.peak = max(self.peak, sum(path.stat().st_size for path in Path(".").glob("new_*.iso*")))
+        shutil.copy(filename, "consumed")
+        return True
+
+    def test_produce(self):
+        self.assertGreater(self.ar.num_discs, 2)
+        self.assertEqual(list(range(self.ar.num_discs)), self.ar.produce_isos(self.consume, self.budget))
+        self.assertLessEqual(self.peak, self.budget)
+        self.assertEqual([], list(Path(".").glob("new_*.iso*")))  # All deleted once consumed
+        filenames = [f"consumed/new_{disc_num:04}.iso" for disc_num in range(self.ar.num_discs)]
+        self.assertEqual(self.sizes, [os.path.getsize(filename) for filename in filenames])
+        ar, discs = load_archiver_from_discs(filenames)
+        self.assertEqual(40, len(ar.restore(discs, "restored")))
+        self.assertEqual([], self.ar.produce_isos(self.consume, self.budget))  # Nothing left to do
+
+    def test_consumer_fails(self):
+        def fail_disc_1(disc_num, filename):
+            return disc_num != 1 and self.consume(disc_num, filename)
+
+        with self.assertRaises(odarchiveError):
+            self.ar.produce_isos(fail_disc_1, self.budget)
+        self.assertFalse(os.path.exists("new_0000.iso"))
+        self.assertTrue(os.path.exists("new_0001.iso"))  # Kept for another go
+        journal = Journal("new.journal")
+        self.assertTrue(journal.is_consumed(0, self.ar.disc_contents_hash(0)))
+        self.assertFalse(journal.is_consumed(1, self.ar.disc_contents_hash(1)))
+        with mock.patch.object(Archiver, "master_iso", autospec=True, side_effect=Archiver.master_iso) as master:
+            self.assertEqual(list(range(1, self.ar.num_discs)), self.ar.produce_isos(self.consume, self.budget))
+        # The image of disc 1 is consumed without being mastered again
+        self.assertNotIn(1, [call.args[2] for call in master.call_args_list])
+        self.assertEqual([], list(Path(".").glob("new_*.iso*")))
+
+    def test_command(self):
+        consumed = self.ar.produce_isos(command_consumer("cp {path} consumed/disc{disc_num}.iso"), self.budget)
+        self.assertEqual(list(range(self.ar.num_discs)), consumed)
+        self.assertEqual(self.sizes, [os.path.getsize(f"consumed/disc{disc_num}.iso") for disc_num in consumed])
+        self.assertFalse(command_consumer("false")(0, "new_0000.iso"))
+
+    def test_budget_too_small(self):
+        with self.assertRaises(odarchiveError):
+            self.ar.produce_isos(self.consume, max(self.sizes) - 1)
+
+
+
+class TestProduceImages(unittest.TestCase):
+    """produce_images on its own with images of a given size"""
+
+    def setUp(self):
+        self.start_dir = os.getcwd()
+        self.work_dir = tempfile.mkdtemp()
+        os.chdir(self.work_dir)
+        self.journal = Journal("job.journal")
+        self.consumed = []
+
+    def tearDown(self):
+        os.chdir(self.start_dir)
+        shutil.rmtree(self.work_dir)
+
+    def master(self, disc_num, filename):
+        with open(filename, "wb") as f:
+            f.write(bytes(100))
+        return 100, f"hash{disc_num}"
+
+    def consume(self, disc_num, filename):
+        self.consumed.append(disc_num)
+        return True
+
+    def produce(self, discs, budget):
+        """Runs produce_images, failing rather than hanging if it never finishes"""
+        result = []
+        thread = threading.Thread(target=lambda: result.append(
+            produce_images(discs, self.master, self.consume, budget, self.journal)), daemon=True)
+        thread.start()
+        thread.join(10)
+        self.assertFalse(thread.is_alive(), "produce_images hung")
+        return result[0]
+
+    def test_later_disc_written(self):
+        # Eg after an interrupted write_all_isos disc 1 is written but disc 0 isn't and both won't fit at once
+        self.journal.record(1, "contents1", "disc1.iso", *self.master(1, "disc1.iso"), complete=True)
+        discs = [(0, "disc0.iso", 100, "contents0"), (1, "disc1.iso", 100, "contents1")]
+        self.assertEqual([1, 0], self.produce(discs, 150))
+        self.assertEqual([1, 0], self.consumed)
+        self.assertEqual([], list(Path(".").glob("*.iso")))
+
+    def test_written_over_budget(self):
+        for disc_num in (1, 2):
+            self.journal.record(disc_num, f"contents{disc_num}", f"disc{disc_num}.iso",
+                                *self.master(disc_num, f"disc{disc_num}.iso"), complete=True)
+        discs = [(disc_num, f"disc{disc_num}.iso", 100, f"contents{disc_num}") for disc_num in range(3)]
+        self.assertEqual([1, 2, 0], self.produce(discs, 150))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,141 @@
+"""
+Tests for scrubbing whole images and discs against the catalogue.
+"""
+import errno
+import itertools
+import json
+import os
+from pathlib import Path
+import random
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import pycdlib
+
+from odarchive import Archiver
+from odarchive.restore import Disc
+from odarchive.scrub import reports_json, scrub_image
+
+DISC_SIZE = 700000
+
+
+class TestScrub(unittest.TestCase):
+
+    def setUp(self):
+        self.start_dir = os.getcwd()
+        self.work_dir = tempfile.mkdtemp()
+        os.chdir(self.work_dir)
+        rng = random.Random(1)
+        for i in range(3):
+            os.makedirs(f"usb/dir{i}")
+        for i in range(30):
+            self.write(f"usb/dir{i % 3}/file{i}.bin", bytes(rng.getrandbits(8) for _ in range(rng.randrange(30000))))
+        for i in range(20):
+            self.write(f"usb/dir{i % 3}/small{i}.txt", f"small file {i}".encode())
+        self.write("usb/large.bin", bytes(rng.getrandbits(8) for _ in range(250000)))  # Split over discs
+        self.ar = Archiver()
+        self.ar.create_file_database(Path("usb"))
+        self.ar.convert_to_hash_database()
+        self.ar.segment(DISC_SIZE, pack_threshold=100)
+        self.ar.save()
+        self.isos = [self.ar.write_iso(disc_num=disc_num) for disc_num in range(self.ar.num_discs)]
+
+    def tearDown(self):
+        os.chdir(self.start_dir)
+        shutil.rmtree(self.work_dir)
+
+    def write(self, filename, data):
+        with open(filename, "wb") as f:
+            f.write(data)
+
+    def location(self, disc_num):
+        """Where the data of a whole file on a disc is in its image"""
+        entry = next(entry for entry in self.ar.hash_db.files(disc_num)
+                     if entry.size > 5000 and not entry.is_packed and not entry.is_split)
+        iso = pycdlib.PyCdlib()
+        iso.open(self.isos[disc_num])
+        try:
+            return entry, iso.get_record(udf_path=str(entry.udf_absolute_path)).inode.extent_location() * 2048
+        finally:
+            iso.close()
+
+    def test_good(self):
+        reports = self.ar.scrub(self.isos, workers=2, sample_bytes=50 * 2048)
+        self.assertEqual(self.isos, [report.image for report in reports])
+        for disc_num, report in enumerate(reports):
+            self.assertTrue(report.passed, report.summary())
+            self.assertEqual(disc_num, report.disc_num)
+            self.assertEqual(os.path.getsize(self.isos[disc_num]), report.bytes_read)
+            self.assertEqual(report.bytes_read, report.samples[-1][0])
+            self.assertGreaterEqual(len(report.samples), report.bytes_read // (50 * 2048))
+        data = json.loads(reports_json(reports))
+        self.assertEqual([], data[0]["mismatches"])
+        self.assertEqual({"offset", "seconds", "mb_per_s"}, set(data[0]["throughput"][0]))
+
+    def test_throughput(self):
+        clock = itertools.count(0.0, 0.5)
+        report = scrub_image(self.isos[0], self.ar._file_checks(0), 0, sample_bytes=4 * 1024 * 1024,
+                             clock=lambda: next(clock))
+        self.assertEqual(1, len(report.samples))  # The image is smaller than one sample
+        offset, seconds, rate = report.samples[0]
+        self.assertEqual(os.path.getsize(self.isos[0]), offset)
+        self.assertEqual(0.5, seconds)
+        self.assertAlmostEqual(offset / 1024 / 1024 / 0.5, rate)
+
+    def test_mismatch(self):
+        entry, location = self.location(1)
+        with open(self.isos[1], "r+b") as f:
+            f.seek(location + 100)
+            f.write(b"rot")
+        reports = self.ar.scrub(self.isos)
+        self.assertTrue(reports[0].passed)
+        self.assertFalse(reports[1].passed)
+        self.assertEqual([str(entry.filename)], [check.name for check in reports[1].failures])
+        self.assertEqual("does not match its hash", reports[1].failures[0].error)
+
+    def test_unreadable(self):
+        entry, location = self.location(0)
+        bad_sector = location // 2048 + 1
+        pread = os.pread
+
+        def failing_pread(fd, size, position):
+            if position <= bad_sector * 2048 < position + size:
+                raise OSError(errno.EIO, "Input/output error")
+            return pread(fd, size, position)
+
+        with mock.patch("os.pread", side_effect=failing_pread):
+            report = self.ar.scrub(self.isos[:1])[0]
+        self.assertEqual([bad_sector], report.unreadable_sectors)
+        self.assertEqual([(str(entry.filename), "has unreadable sectors")],
+                         [(check.name, check.error) for check in report.failures])
+        self.assertEqual(os.path.getsize(self.isos[0]), report.bytes_read)  # Read on past it
+        self.assertEqual([bad_sector], json.loads(reports_json([report]))[0]["unreadable_sectors"])
+
+    def test_truncated(self):
+        size = os.path.getsize(self.isos[0])
+        with open(self.isos[0], "r+b") as f:
+            f.truncate(size - 50000)
+        report = self.ar.scrub(self.isos[:1])[0]
+        self.assertFalse(report.passed)
+        self.assertTrue(report.errors[0].startswith("can't tell which disc it is"))  # The UDF anchor is at the end
+        self.assertEqual(size - 50000, report.bytes_read)  # Still all read
+
+    def test_mounted(self):
+        checks = list(self.ar._file_checks(1))
+        with Disc(self.isos[1]) as disc:
+            for udf_path in {check.udf_path for check in checks}:
+                path = Path("mounted") / udf_path.lstrip("/")
+                path.parent.mkdir(parents=True, exist_ok=True)
+                with open(path, "wb") as f:
+                    disc.copy_to(udf_path, f)
+        report = scrub_image("mounted", checks, 1)
+        self.assertTrue(report.passed, report.summary())
+        os.remove(Path("mounted") / checks[0].udf_path.lstrip("/"))
+        report = scrub_image("mounted", self.ar._file_checks(1), 1)
+        self.assertIn("is missing", [check.error for check in report.failures])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,213 @@
+"""
+Tests for the strategies for packing files onto discs.
+"""
+import os
+from pathlib import Path, PurePosixPath
+import random
+import unittest
+
+from odarchive import odarchiveError
+from odarchive.file_db import FileDatabase
+from odarchive.hash_db import HashDatabase
+from odarchive.image_size import directory_cost
+from odarchive.segmenter import (FreeSpaceTree, balance, pack, subtree_chunks, NEXT_FIT, FIRST_FIT, BEST_FIT,
+                                 LOCALITY, SEGMENT_STRATEGIES)
+
+
+def disc_fills(sizes, assignment):
+    fills = [0] * (max(assignment) + 1)
+    for size, disc_num in zip(sizes, assignment):
+        fills[disc_num] += size
+    return fills
+
+
+class TestPackers(unittest.TestCase):
+
+    def test_free_space_tree(self):
+        tree = FreeSpaceTree()
+        for free in (5, 3, 9, 1, 7):
+            tree.add_disc(free)
+        self.assertEqual(0, tree.first_fit(4))
+        self.assertEqual(2, tree.first_fit(6))
+        self.assertIsNone(tree.first_fit(10))
+        tree.use(2, 5)
+        self.assertEqual(4, tree.first_fit(6))
+        self.assertEqual(4, tree.free(2))
+
+    def test_interleaved_sizes(self):
+        """Large and small files interleaved waste space with next fit"""
+        sizes = [60, 10, 60, 10, 60, 10, 60, 10]
+        self.assertEqual(4, max(pack(sizes, 100, NEXT_FIT)) + 1)
+        self.assertEqual(4, max(pack(sizes, 100, FIRST_FIT)) + 1)
+        sizes = [60, 50, 40, 30, 20]
+        self.assertEqual(3, max(pack(sizes, 100, NEXT_FIT)) + 1)
+        self.assertEqual(2, max(pack(sizes, 100, FIRST_FIT)) + 1)
+        self.assertEqual(2, max(pack(sizes, 100, BEST_FIT)) + 1)
+
+    def test_random_sizes(self):
+        rng = random.Random(1)
+        sizes = [rng.choice((rng.randint(1, 1000), rng.randint(10000, 50000))) for _ in range(5000)]
+        capacity = 250000
+        num_discs = {}
+        for strategy in SEGMENT_STRATEGIES:
+            for balanced in (False, True):
+                assignment = pack(sizes, capacity, strategy, balanced)
+                fills = disc_fills(sizes, assignment)
+                self.assertLessEqual(max(fills), capacity)
+                num_discs[strategy, balanced] = len(fills)
+        self.assertLess(num_discs[FIRST_FIT, False], num_discs[NEXT_FIT, False])
+        self.assertLess(num_discs[BEST_FIT, False], num_discs[NEXT_FIT, False])
+        for strategy in SEGMENT_STRATEGIES:
+            self.assertEqual(num_discs[strategy, False], num_discs[strategy, True], "Balancing keeps disc count")
+
+    def test_balance(self):
+        sizes = [50, 40, 5, 5]
+        assignment = [0, 0, 1, 1]
+        result = balance(sizes, assignment, 100)
+        self.assertEqual([50, 50], sorted(disc_fills(sizes, result)))
+
+    def test_groups(self):
+        """A group is only charged once on each disc it is on"""
+        rng = random.Random(2)
+        sizes = [rng.randint(1, 1000) for _ in range(2000)]
+        groups = [(f"dir{rng.randint(0, 50)}",) for _ in sizes]
+        group_costs = {group: 2000 for entry_groups in groups for group in entry_groups}
+        capacity = 50000
+        for strategy in SEGMENT_STRATEGIES:
+            for balanced in (False, True):
+                assignment = pack(sizes, capacity, strategy, balanced, groups, group_costs)
+                fills = disc_fills(sizes, assignment)
+                disc_groups = [set() for _ in fills]
+                for entry_groups, disc_num in zip(groups, assignment):
+                    disc_groups[disc_num].update(entry_groups)
+                for disc_num, these_groups in enumerate(disc_groups):
+                    self.assertLessEqual(fills[disc_num] + 2000 * len(these_groups), capacity)
+        # Items in the same group share its cost
+        self.assertEqual([0, 0], pack([10, 10], 100, NEXT_FIT, False, [("a",), ("a",)], {"a": 70}))
+        self.assertEqual([0, 1], pack([10, 10], 100, NEXT_FIT, False, [("a",), ("b",)], {"a": 70, "b": 70}))
+
+    def test_locality(self):
+        """Directories that fit on a disc are kept together, only a larger one is split"""
+        rng = random.Random(3)
+        groups = []
+        sizes = []
+        for project in range(20):
+            for sub in range(3):
+                for _ in range(rng.randint(1, 20)):
+                    groups.append((f"/DATA/p{project}/s{sub}", f"/DATA/p{project}"))
+                    sizes.append(rng.randint(100, 1000))
+        for _ in range(300):  # One project larger than a disc
+            groups.append((f"/DATA/big/s{rng.randint(0, 5)}", "/DATA/big"))
+            sizes.append(rng.randint(100, 1000))
+        group_costs = {group: 100 for entry_groups in groups for group in entry_groups}
+        capacity = 40000
+        for balanced in (False, True):
+            assignment = pack(sizes, capacity, LOCALITY, balanced, groups, group_costs)
+            project_discs = {}
+            disc_groups = [set() for _ in range(max(assignment) + 1)]
+            for entry_groups, disc_num in zip(groups, assignment):
+                project_discs.setdefault(entry_groups[-1], set()).add(disc_num)
+                disc_groups[disc_num].update(entry_groups)
+            fills = disc_fills(sizes, assignment)
+            for disc_num, these_groups in enumerate(disc_groups):
+                self.assertLessEqual(fills[disc_num] + 100 * len(these_groups), capacity)
+            for project, disc_nums in project_discs.items():
+                if project != "/DATA/big":
+                    self.assertEqual(1, len(disc_nums), project)
+            self.assertLess(len(project_discs["/DATA/big"]), 10)
+        # Scattered by next fit in catalogue order
+        rng.shuffle(groups)
+        assignment = pack(sizes, capacity, NEXT_FIT, False, groups, group_costs)
+        self.assertGreater(len({disc_num for entry_groups, disc_num in zip(groups, assignment)
+                                if entry_groups[-1] == "/DATA/p0"}), 1)
+
+    def test_subtree_chunks(self):
+        groups = [("/a/x", "/a"), ("/a/x", "/a"), ("/a",), ("/b",), ()]
+        sizes = [40, 40, 10, 30, 5]
+        costs = {"/a": 1, "/a/x": 1, "/b": 1}
+        self.assertEqual([[4, 2, 0, 1, 3]], subtree_chunks(sizes, groups, costs, 200))
+        # /a doesn't fit so its own file then /a/x are chunks on their own
+        self.assertEqual([[4], [2], [0, 1], [3]], subtree_chunks(sizes, groups, costs, 90))
+
+    def test_subtree_chunks_links(self):
+        # Item 0 is in /a with a hard link in /b, which is charged to it but isn't its parent
+        groups = [("/DATA/a", "/DATA/b"), ("/DATA/a",), ("/DATA/b",)]
+        chains = [("/DATA/a",), ("/DATA/a",), ("/DATA/b",)]
+        costs = {"/DATA/a": 1, "/DATA/b": 1}
+        chunks = subtree_chunks([10, 40, 40], groups, costs, 100, chains)
+        self.assertEqual([0, 1, 2], sorted(i for chunk in chunks for i in chunk))  # Each item once
+        self.assertEqual([[0, 1], [2]], subtree_chunks([10, 40, 40], groups, costs, 60, chains))
+        assignment = pack([10, 40, 40], 100, LOCALITY, True, groups, costs, chains)
+        self.assertEqual(3, len(assignment))
+
+    def test_too_large(self):
+        for strategy in SEGMENT_STRATEGIES:
+            with self.assertRaises(odarchiveError):
+                pack([10, 200], 100, strategy)
+        with self.assertRaises(odarchiveError):
+            pack([10], 100, "worst-fit")
+
+
+class TestSegmentStrategies(unittest.TestCase):
+
+    def setUp(self):
+        self.start_dir = os.getcwd()
+        os.chdir(Path(__file__).parents[0] / "test_1_files")
+        file_db = FileDatabase(Path("usb"))
+        file_db.update()
+        file_db.calculate_file_hash()
+        self.hash_db = HashDatabase(file_db, PurePosixPath("/DATA"))
+
+    def tearDown(self):
+        os.chdir(self.start_dir)
+
+    def test_strategies(self):
+        for strategy in SEGMENT_STRATEGIES:
+            self.hash_db.segment(580000, 0, strategy=strategy)
+            # Only two files fit on each disc
+            self.assertEqual(1, self.hash_db.last_disc_number)
+            usage = self.hash_db.disc_usage()
+            # testDir is only on one disc
+            expected = 2 * self.hash_db.disc_overhead() + directory_cost("testDir")
+            expected += sum(self.hash_db.size_on_disc(entry) for entry in self.hash_db.files())
+            self.assertEqual(expected, sum(usage))
+            self.assertTrue(all(used < 580000 for used in usage))
+
+    def test_fill_info(self):
+        self.hash_db.segment(580000, 0, strategy=FIRST_FIT)
+        self.assertIn("Disc 0 fill = 578,527 bytes (99.75%)", self.hash_db.get_info())
+        self.assertIn("Disc 1 fill = 567,913 bytes (97.92%)", self.hash_db.get_info(1))
+        self.assertNotIn("Disc 0 fill", self.hash_db.get_info(1))
+        on_disc = list(self.hash_db.files(1))
+        self.assertIn(f"Number of files = {len(on_disc)}\n", self.hash_db.get_info(1))  # Not counted twice
+        self.assertIn(f"Data size       = {sum(entry.size for entry in on_disc):,} bytes", self.hash_db.get_info(1))
+
+    def scanned(self, disc_num):
+        return [entry for entry in self.hash_db.entries.values() if entry.on_disc(disc_num)]
+
+    def test_disc_index(self):
+        self.assertEqual(len(self.hash_db.entries), self.hash_db.disc_totals(None).num_files)  # Not segmented yet
+        for strategy in SEGMENT_STRATEGIES:
+            self.hash_db.segment(580000, 0, strategy=strategy)
+            self.assertEqual(0, self.hash_db.disc_totals(None).num_files)
+            for disc_num in range(self.hash_db.last_disc_number + 1):
+                entries = self.scanned(disc_num)
+                self.assertEqual(entries, list(self.hash_db.files(disc_num)))  # In catalogue order
+                totals = self.hash_db.disc_totals(disc_num)
+                self.assertEqual(len(entries), totals.num_files)
+                self.assertEqual(sum(entry.size for entry in entries), totals.size)
+        # Moving an entry or giving it another path updates the index
+        entry = self.scanned(0)[0]
+        entry.disc_num = 1
+        self.assertNotIn(entry, list(self.hash_db.files(0)))
+        self.assertEqual(self.scanned(1), list(self.hash_db.files(1)))
+        num_dirs = self.hash_db.disc_totals(1).num_dirs
+        entry.add_path("/DATA/newDir/copy.txt")
+        self.assertEqual(num_dirs + 1, self.hash_db.disc_totals(1).num_dirs)
+
+    def test_top_level_discs(self):
+        self.hash_db.segment(580000, 0, strategy=LOCALITY)
+        discs = self.hash_db.top_level_discs()
+        self.assertEqual(["/DATA", "/DATA/testDir"], list(discs))
+        self.assertEqual(1, len(discs["/DATA/testDir"]))
+        self.assertIn(f"/DATA/testDir = 1 discs", self.hash_db.get_directory_info())
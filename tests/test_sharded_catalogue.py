@@ -0,0 +1,110 @@
+"""
+Tests for sharded catalogues where each disc only has a catalogue of its own files plus a global index.
+"""
+from io import BytesIO
+import json
+import os
+from pathlib import Path
+import unittest
+
+import pycdlib
+
+from odarchive import (Archiver, odarchiveError, load_archiver_from_json, load_archiver_from_shards,
+                       load_index_from_json, DB_FILENAME, INDEX_FILENAME)
+
+from utils import test_1_clean
+
+
+class TestShardedCatalogue(unittest.TestCase):
+
+    def setUp(self):
+        """Delete files on setup so that can review at end"""
+        self.start_dir = os.getcwd()
+        os.chdir(Path(__file__).parents[0] / "test_1_files")
+        test_1_clean()
+        self.ar = Archiver()
+        self.ar.create_file_database(Path("usb"))
+        self.ar.convert_to_hash_database()
+        self.ar.segment(583000, sharded=True)
+        self.ar.save()
+        self.ar.save_index()
+
+    def tearDown(self):
+        os.chdir(self.start_dir)
+
+    def save_shards(self):
+        filenames = []
+        for disc_num in range(self.ar.num_discs):
+            filename = f"catalogue_{disc_num:04}.json"
+            self.ar.save(filename, disc_num=disc_num)
+            filenames.append(filename)
+        return filenames
+
+    def test_catalogue_size(self):
+        """Catalogue size of the entries should match what is saved so segmentation is accurate"""
+        with open(DB_FILENAME, encoding="utf-8") as f:
+            saved = json.load(f)
+        for file_hash, entry in self.ar.hash_db.entries.items():
+            text = json.dumps({"files": {file_hash: saved["files"][file_hash]}}, ensure_ascii=False,
+                              sort_keys=True, indent=4)
+            lines = text.split("\n")[2:-2]  # Just the entry
+            self.assertEqual(len("\n".join(lines).encode("utf-8")) + 2, entry.catalogue_size())
+
+    def test_shards(self):
+        self.assertTrue(self.ar.is_sharded)
+        self.assertEqual(2, self.ar.num_discs)
+        num_entries = 0
+        for disc_num, filename in enumerate(self.save_shards()):
+            shard = load_archiver_from_json(filename)
+            self.assertEqual(disc_num, shard.shard)
+            self.assertEqual(2, shard.num_discs)
+            for entry in shard.hash_db.entries.values():
+                self.assertEqual(disc_num, entry.disc_num)
+            num_entries += len(shard.hash_db.entries)
+        self.assertEqual(len(self.ar.hash_db.entries), num_entries)
+
+    def test_shard_cannot_be_saved(self):
+        shard = load_archiver_from_json(self.save_shards()[1])
+        with self.assertRaisesRegex(odarchiveError, "shard of disc 1"):
+            shard.save("shard.json")
+
+    def test_merge_shards(self):
+        ar = load_archiver_from_shards(self.save_shards())
+        self.assertEqual(set(self.ar.hash_db.entries), set(ar.hash_db.entries))
+        for file_hash, entry in self.ar.hash_db.entries.items():
+            self.assertEqual(entry.disc_num, ar.hash_db.entries[file_hash].disc_num)
+            self.assertEqual(entry.filenames, ar.hash_db.entries[file_hash].filenames)
+        self.assertEqual(1, ar.last_disc_num)
+
+    def test_merge_missing_shard(self):
+        with self.assertRaises(odarchiveError):
+            load_archiver_from_shards(self.save_shards()[:1])
+
+    def test_index(self):
+        index = load_index_from_json(INDEX_FILENAME)
+        self.assertEqual(2, index.num_discs)
+        for file_hash, entry in self.ar.hash_db.entries.items():
+            self.assertEqual(entry.disc_num, index.disc_for_hash(file_hash))
+        self.assertIsNone(index.disc_for_hash("0" * 128))
+        self.assertEqual([0, 1], index.discs_for_path("/DATA"))
+        testdir_disc = self.ar.hash_db.entries[
+            "0d3c937eee199c1d6b5af02f87ee9776ffb8538913bc28bdc44f294e8b405f02795e2cfdc6e52121cb6cb1a07c58883898bb820c"
+            "01c510e005fa2be1481866a4"].disc_num
+        self.assertEqual([testdir_disc], index.discs_for_path("/DATA/testDir"))
+
+    def test_write_iso(self):
+        self.ar.write_iso(disc_num=1)
+        iso = pycdlib.PyCdlib()
+        iso.open("new_0001.iso")
+        try:
+            extracted = BytesIO()
+            iso.get_file_from_iso_fp(extracted, udf_path=f"/{DB_FILENAME}")
+            shard = load_archiver_from_json(json_data=extracted.getvalue().decode("utf-8"))
+            extracted = BytesIO()
+            iso.get_file_from_iso_fp(extracted, udf_path=f"/{INDEX_FILENAME}")
+            index = load_index_from_json(json_data=extracted.getvalue().decode("utf-8"))
+        finally:
+            iso.close()
+        self.assertEqual(1, shard.shard)
+        self.assertEqual(len(list(self.ar.hash_db.files(1))), len(shard.hash_db.entries))
+        self.assertEqual(2, index.num_discs)
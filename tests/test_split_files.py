@@ -0,0 +1,160 @@
+"""
+Tests for splitting files that are larger than a disc into parts and joining them back together on restore.
+"""
+import json
+import os
+from pathlib import Path
+import random
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from odarchive import (Archiver, odarchiveError, load_archiver_from_checkpoint, load_archiver_from_discs,
+                       load_archiver_from_json, DB_FILENAME)
+from odarchive.file_parts import FileSlice, split_file
+from odarchive.restore import BulkRestore
+
+DISC_SIZE = 600000
+
+
+class TestSplitFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.start_dir = os.getcwd()
+        self.work_dir = tempfile.mkdtemp()
+        os.chdir(self.work_dir)
+        os.makedirs("usb/big")
+        rng = random.Random(1)
+        self.big = bytes(rng.getrandbits(8) for _ in range(50000))
+        with open("usb/big/video.raw", "wb") as f:
+            f.write(self.big)
+        with open("usb/small.txt", "wb") as f:
+            f.write(b"small")
+        self.ar = Archiver()
+        self.ar.create_file_database(Path("usb"))
+        self.ar.convert_to_hash_database()
+
+    def tearDown(self):
+        os.chdir(self.start_dir)
+        shutil.rmtree(self.work_dir)
+
+    def big_entry(self, ar=None):
+        ar = ar or self.ar
+        return next(entry for entry in ar.hash_db.files() if entry.filename.name == "video.raw")
+
+    def write_isos(self):
+        self.ar.save()
+        filenames = []
+        for disc_num in range(self.ar.num_discs):
+            self.ar.write_iso(disc_num=disc_num)
+            filenames.append(f"new_{disc_num:04}.iso")
+        return filenames
+
+    def test_split_quietly(self):
+        with mock.patch("builtins.print") as printed:
+            self.ar.segment(DISC_SIZE)
+        printed.assert_not_called()  # Nothing on stdout unless asked for, it may be carrying an image
+        with mock.patch("builtins.print") as printed:
+            self.ar.segment(DISC_SIZE - 2048, verbose=True)
+        self.assertIn("Splitting", printed.call_args.args[0])
+
+    def test_split(self):
+        self.ar.segment(DISC_SIZE)
+        entry = self.big_entry()
+        self.assertTrue(entry.is_split)
+        self.assertEqual(3, self.ar.num_discs)
+        offset = 0
+        for part in entry.parts:
+            self.assertEqual(offset, part.offset)
+            offset += part.size
+        self.assertEqual(len(self.big), offset)
+        self.assertEqual({0, 1, 2}, entry.disc_nums)
+        self.assertEqual(entry.parts[0].disc_num, entry.disc_num)
+        for disc_num, used in enumerate(self.ar.hash_db.disc_usage()):
+            self.assertLess(used, DISC_SIZE)
+            # Only the bytes of the part on each disc are in its totals
+            self.assertIn(entry, list(self.ar.hash_db.files(disc_num)))
+            part_size = sum(part.size for part in entry.parts if part.disc_num == disc_num)
+            self.assertLessEqual(part_size, self.ar.hash_db.disc_totals(disc_num).size)
+        self.assertEqual(len(self.big) + 5, sum(self.ar.hash_db.disc_totals(disc_num).size for disc_num in range(3)))
+        # Resegmenting onto a disc the file fits on joins it back together
+        self.ar.segment("cd")
+        self.assertFalse(self.big_entry().is_split)
+        self.assertEqual([0], sorted(self.ar.hash_db.entries.disc_nums()))
+
+    def test_file_slice(self):
+        parts = split_file("usb/big/video.raw", len(self.big), 20480)
+        self.assertEqual([20480, 20480, 9040], [part.size for part in parts])
+        part = parts[1]
+        with FileSlice("usb/big/video.raw", part.offset, part.size) as f:
+            self.assertEqual(self.big[20480:20490], f.read(10))
+            f.seek(0)
+            self.assertEqual(self.big[20480:40960], f.read())
+            self.assertEqual(b"", f.read())
+
+    def test_catalogue(self):
+        self.ar.segment(DISC_SIZE)
+        self.ar.save()
+        ar = load_archiver_from_json(DB_FILENAME)
+        loaded = self.big_entry(ar)
+        entry = self.big_entry()
+        self.assertEqual([vars(part) for part in entry.parts], [vars(part) for part in loaded.parts])
+        self.assertEqual(2, ar.last_disc_num)
+        # The size of the entry in the catalogue is used for sharded catalogues
+        with open(DB_FILENAME, encoding="utf-8") as f:
+            saved = json.load(f)
+        text = json.dumps({"files": {entry.file_hash: saved["files"][entry.file_hash]}}, ensure_ascii=False,
+                          sort_keys=True, indent=4)
+        lines = text.split("\n")[2:-2]  # Just the entry
+        self.assertEqual(len("\n".join(lines).encode("utf-8")) + 2, entry.catalogue_size())
+
+    def test_checkpoint(self):
+        self.ar.segment(DISC_SIZE)
+        self.ar.save_checkpoint()
+        ar = load_archiver_from_checkpoint()
+        self.assertEqual([vars(part) for part in self.big_entry().parts],
+                         [vars(part) for part in self.big_entry(ar).parts])
+        ar = load_archiver_from_checkpoint(disc_num=1)
+        self.assertEqual(["video.raw"], [entry.filename.name for entry in ar.hash_db.files()])
+
+    def test_restore(self):
+        self.ar.segment(DISC_SIZE)
+        self.ar.locked = True
+        isos = self.write_isos()
+        for disc_num, iso in enumerate(isos):
+            self.assertEqual(os.path.getsize(iso), self.ar.image_size(disc_num))
+            self.assertLess(os.path.getsize(iso), DISC_SIZE)
+        ar, discs = load_archiver_from_discs(isos)
+        restored = ar.restore(discs, "restored")
+        self.assertEqual(2, len(restored))
+        with open("restored/big/video.raw", "rb") as f:
+            self.assertEqual(self.big, f.read())
+        # Without all the parts a split file is not restored
+        del discs[1]
+        restored = ar.restore(discs, "partial")
+        self.assertEqual([Path("partial/small.txt")], restored)
+
+    def test_restore_sharded(self):
+        self.ar.segment(DISC_SIZE, sharded=True)
+        self.ar.save_index()
+        self.ar.locked = True
+        ar, discs = load_archiver_from_discs(self.write_isos())
+        ar.restore(discs, "restored")
+        with open("restored/big/video.raw", "rb") as f:
+            self.assertEqual(self.big, f.read())
+
+    def test_corrupt_part(self):
+        self.ar.segment(DISC_SIZE)
+        self.ar.locked = True
+        isos = self.write_isos()
+        entry = self.big_entry()
+        entry.parts[1].file_hash = "0" * 128
+        os.makedirs("restored")
+        with self.assertRaisesRegex(odarchiveError, "Part 1 of"):
+            BulkRestore([(entry, [Path("restored/video.raw")])], dict(enumerate(isos))).run()
+        self.assertFalse(os.path.exists("restored/video.raw"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+"""
+Tests for streaming ISO images without writing them to a file first.
+"""
+import hashlib
+import io
+import os
+from pathlib import Path
+import random
+import shutil
+import tempfile
+import threading
+import unittest
+
+from odarchive import Archiver, odarchiveError, load_archiver_from_discs
+from odarchive.stream import ImageStream
+
+DISC_SIZE = 700000
+
+
+class Unseekable:
+    """Only has write, like a pipe or socket"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def getvalue(self):
+        return b"".join(self.chunks)
+
+
+class TestImageStream(unittest.TestCase):
+
+    def test_out_of_order_metadata(self):
+        rng = random.Random(1)
+        size = 40 * 2048
+        data_start = 10 * 2048
+        writes = [(rng.randrange(data_start - 100), bytes([rng.randrange(1, 256)]) * rng.randrange(1, 100))
+                  for _ in range(50)]
+        writes.append((size - 2048, b"anchor"))
+        rng.shuffle(writes)
+        writes += [(data_start + 2048 * i, bytes([i + 1]) * 3000) for i in range(0, 20, 2)]
+        expected = io.BytesIO()
+        out = Unseekable()
+        with ImageStream(out, data_start, size, buffer_size=4096) as stream:
+            for position, data in writes:
+                for f in (expected, stream):
+                    f.seek(position)
+                    f.write(data)
+        expected.seek(size - 1)
+        expected.write(b"\0")
+        self.assertEqual(expected.getvalue(), out.getvalue())
+        self.assertEqual(size, stream.size)
+        self.assertEqual(hashlib.sha512(expected.getvalue()).hexdigest(), stream.hexdigest())
+        self.assertTrue(all(len(chunk) == 4096 for chunk in out.chunks))
+
+    def test_write_back(self):
+        stream = ImageStream(Unseekable(), 2048, 10 * 2048, buffer_size=2048)
+        stream.seek(4096)
+        stream.write(b"data")
+        stream.seek(2048)
+        with self.assertRaises(odarchiveError):
+            stream.write(b"too late")
+        with self.assertRaises(odarchiveError):
+            ImageStream(Unseekable(), 2048, 10 * 2048, buffer_size=1000)
+
+
+class TestStreamIso(unittest.TestCase):
+
+    def setUp(self):
+        self.start_dir = os.getcwd()
+        self.work_dir = tempfile.mkdtemp()
+        os.chdir(self.work_dir)
+        for i in range(3):
+            os.makedirs(f"usb/dir{i}")
+        for i in range(30):
+            with open(f"usb/dir{i % 3}/file{i}.bin", "wb") as f:
+                f.write(bytes([i]) * (100 * i + 3000))
+        self.ar = Archiver()
+        self.ar.create_file_database(Path("usb"))
+        self.ar.convert_to_hash_database()
+        self.ar.segment(DISC_SIZE, pack_threshold=4000)
+        self.ar.save()
+
+    def tearDown(self):
+        os.chdir(self.start_dir)
+        shutil.rmtree(self.work_dir)
+
+    def test_stream_and_restore(self):
+        filenames = []
+        for disc_num in range(self.ar.num_discs):
+            out = Unseekable()
+            stream = self.ar.stream_iso(out, disc_num, buffer_size=8192)
+            image = out.getvalue()
+            self.assertEqual(self.ar.image_size(disc_num), len(image))
+            self.assertEqual(hashlib.sha512(image).hexdigest(), stream.hexdigest())
+            filename = f"streamed_{disc_num}.iso"
+            with open(filename, "wb") as f:
+                f.write(image)
+            filenames.append(filename)
+        ar, discs = load_archiver_from_discs(filenames)
+        self.assertEqual(30, len(ar.restore(discs, "restored")))
+        for path in Path("usb").rglob("*.bin"):
+            self.assertEqual(path.read_bytes(), (Path("restored") / path.relative_to("usb")).read_bytes())
+
+    def test_pipe(self):
+        read_fd, write_fd = os.pipe()
+        received = []
+        reader = threading.Thread(target=lambda: received.append(os.fdopen(read_fd, "rb").read()))
+        reader.start()
+        with os.fdopen(write_fd, "wb") as f:
+            stream = self.ar.stream_iso(f, 0)
+        reader.join()
+        self.assertEqual(stream.size, len(received[0]))
+        self.assertEqual(hashlib.sha512(received[0]).hexdigest(), stream.hexdigest())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+"""
+Tests for the SHA512SUM manifest on each disc and verifying written images.
+"""
+import hashlib
+import os
+from pathlib import Path
+import random
+import shutil
+import tempfile
+import unittest
+
+from odarchive import (Archiver, odarchiveError, load_archiver_from_checkpoint, load_archiver_from_json,
+                       DB_FILENAME, HASH_FILENAME)
+from odarchive.manifest import manifest_line, manifest_line_size, parse_manifest
+from odarchive.restore import Disc
+
+DISC_SIZE = 700000
+
+
+class TestManifest(unittest.TestCase):
+
+    def test_lines(self):
+        file_hash = "ab" * 64
+        self.assertEqual(f"{file_hash}  DATA/dir/a file.txt\n", manifest_line(file_hash, "/DATA/dir/a file.txt"))
+        escaped = manifest_line(file_hash, "/DATA/back\\slash\nnew line")
+        self.assertEqual(f"\\{file_hash}  DATA/back\\\\slash\\nnew line\n", escaped)
+        self.assertEqual({"DATA/dir/a file.txt": file_hash, "DATA/back\\slash\nnew line": file_hash},
+                         parse_manifest(manifest_line(file_hash, "/DATA/dir/a file.txt") + escaped))
+        self.assertEqual(len(escaped.encode("utf-8")), manifest_line_size("/DATA/back\\slash\nnew line"))
+        with self.assertRaises(odarchiveError):
+            parse_manifest("not a hash  DATA/file\n")
+
+
+class TestVerify(unittest.TestCase):
+
+    def setUp(self):
+        self.start_dir = os.getcwd()
+        self.work_dir = tempfile.mkdtemp()
+        os.chdir(self.work_dir)
+        rng = random.Random(1)
+        for i in range(3):
+            os.makedirs(f"usb/dir{i}")
+        for i in range(30):
+            self.write(f"usb/dir{i % 3}/file{i}.bin", bytes([i]) * (5000 + 100 * i))
+        for i in range(40):
+            self.write(f"usb/dir{i % 3}/small{i}.txt", bytes(rng.getrandbits(8) for _ in range(rng.randrange(600))))
+        self.write("usb/large.bin", bytes(rng.getrandbits(8) for _ in range(250000)))  # Split over discs
+        self.ar = Archiver()
+        self.ar.create_file_database(Path("usb"))
+        self.ar.convert_to_hash_database()
+
+    def tearDown(self):
+        os.chdir(self.start_dir)
+        shutil.rmtree(self.work_dir)
+
+    def write(self, filename, data):
+        with open(filename, "wb") as f:
+            f.write(data)
+
+    def write_isos(self, **kwargs):
+        self.ar.segment(DISC_SIZE, pack_threshold=1000, **kwargs)
+        self.ar.save()
+        return [self.ar.write_iso(disc_num=disc_num) for disc_num in range(self.ar.num_discs)]
+
+    def test_manifest_on_disc(self):
+        filenames = self.write_isos(manifest=True)
+        for disc_num, filename in enumerate(filenames):
+            self.assertEqual(self.ar.image_size(disc_num), os.path.getsize(filename))
+            with Disc(filename) as disc:
+                manifest = parse_manifest(disc.read(f"/{HASH_FILENAME}").decode("utf-8"))
+                self.assertTrue(manifest)
+                for path, file_hash in manifest.items():
+                    self.assertEqual(file_hash, hashlib.sha512(disc.read(f"/{path}")).hexdigest())
+            report = self.ar.verify_iso(filename, disc_num)
+            self.assertTrue(report.passed, report.summary())
+            self.assertEqual(len(list(self.ar.hash_db.units(disc_num))), len(report.checks))
+        # Split parts are listed but packed files are only in the container
+        manifests = "".join(self.ar.manifest(disc_num) for disc_num in range(self.ar.num_discs))
+        self.assertIn("large.bin.part0000", manifests)
+        self.assertNotIn("small", manifests)
+
+    def test_manifest_saved(self):
+        self.ar.segment(DISC_SIZE, manifest=True)
+        self.ar.save()
+        self.ar.save_checkpoint()
+        self.assertTrue(load_archiver_from_checkpoint().hash_db.manifest)
+        with open(DB_FILENAME) as f:
+            self.assertTrue(load_archiver_from_json(json_data=f.read()).hash_db.manifest)
+        # Kept when segmenting again unless turned off
+        self.ar.segment(DISC_SIZE)
+        self.assertTrue(self.ar.hash_db.manifest)
+        self.ar.segment(DISC_SIZE, manifest=False)
+        self.assertFalse(self.ar.hash_db.manifest)
+
+    def test_without_manifest(self):
+        filenames = self.write_isos()
+        self.assertNotIn(HASH_FILENAME.encode("ascii"), Path(filenames[0]).read_bytes())
+        self.assertTrue(self.ar.verify_iso(filenames[0], 0).passed)
+
+    def test_corrupt(self):
+        filenames = self.write_isos(manifest=True)
+        entry = next(entry for entry in self.ar.hash_db.files(0) if entry.filename.name.startswith("file")
+                     and entry.filename.name != "file0.bin")  # Not all zeros like the padding
+        with open(filenames[0], "r+b") as f:
+            f.seek(f.read().index(Path("usb", entry.relative_filename).read_bytes()) + 3000)
+            f.write(b"\xff")
+        report = self.ar.verify_iso(filenames[0], 0, threads=3)
+        self.assertFalse(report.passed)
+        self.assertEqual([str(entry.filename)], [check.name for check in report.failures])
+        self.assertIn("FAIL", report.summary())
+        # Cut short
+        with open(filenames[1], "r+b") as f:
+            f.truncate(self.ar._image_layout(1).data_start() + 2048)
+        self.assertFalse(self.ar.verify_iso(filenames[1], 1).passed)
+
+    def test_wrong_manifest(self):
+        filenames = self.write_isos(manifest=True)
+        line = self.ar.manifest(0).splitlines()[0].encode("utf-8")
+        with open(filenames[0], "r+b") as f:
+            f.seek(Path(filenames[0]).read_bytes().index(line))
+            f.write(b"0" if line[:1] != b"0" else b"1")
+        report = self.ar.verify_iso(filenames[0], 0)
+        self.assertFalse(report.passed)
+        self.assertTrue(any(HASH_FILENAME in error for error in report.errors))
+
+
+if __name__ == "__main__":
+    unittest.main()
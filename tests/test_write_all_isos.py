@@ -0,0 +1,154 @@
+"""
+Tests for mastering every disc of an archive at once in worker processes.
+"""
+import json
+import os
+from pathlib import Path
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from odarchive import Archiver, odarchiveError, load_archiver_from_discs
+from odarchive.journal import hash_image, Journal
+
+DISC_SIZE = 700000
+
+
+class TestWriteAllIsos(unittest.TestCase):
+
+    def setUp(self):
+        self.start_dir = os.getcwd()
+        self.work_dir = tempfile.mkdtemp()
+        os.chdir(self.work_dir)
+        for i in range(4):
+            os.makedirs(f"usb/dir{i}")
+        for i in range(40):
+            with open(f"usb/dir{i % 4}/file{i}.bin", "wb") as f:
+                f.write(bytes([i]) * (3000 + i))
+        self.ar = Archiver()
+        self.ar.create_file_database(Path("usb"))
+        self.ar.convert_to_hash_database()
+
+    def tearDown(self):
+        os.chdir(self.start_dir)
+        shutil.rmtree(self.work_dir)
+
+    def check_restore(self, filenames):
+        ar, discs = load_archiver_from_discs(filenames)
+        self.assertEqual(40, len(ar.restore(discs, "restored")))
+        for path in Path("usb").rglob("*.bin"):
+            self.assertEqual(path.read_bytes(), (Path("restored") / path.relative_to("usb")).read_bytes())
+
+    def test_write_all(self):
+        self.ar.segment(DISC_SIZE)
+        self.ar.save()
+        self.assertGreater(self.ar.num_discs, 2)
+        filenames = self.ar.write_all_isos(processes=3, max_io=1)
+        self.assertEqual([f"new_{disc_num:04}.iso" for disc_num in range(self.ar.num_discs)], filenames)
+        for disc_num, filename in enumerate(filenames):
+            self.assertEqual(self.ar.image_size(disc_num), os.path.getsize(filename))
+        self.check_restore(filenames)
+
+    def test_sharded(self):
+        self.ar.segment(DISC_SIZE, sharded=True)
+        self.ar.save()
+        self.ar.save_index()
+        self.check_restore(self.ar.write_all_isos(processes=2))
+
+    def test_not_ready(self):
+        with self.assertRaises(odarchiveError):
+            self.ar.write_all_isos()  # Not segmented
+        self.ar.segment(DISC_SIZE)
+        with self.assertRaises(odarchiveError):
+            self.ar.write_all_isos()  # No catalogue saved to put on the discs
+
+
+class TestResume(unittest.TestCase):
+
+    def setUp(self):
+        self.start_dir = os.getcwd()
+        self.work_dir = tempfile.mkdtemp()
+        os.chdir(self.work_dir)
+        os.makedirs("usb")
+        for i in range(30):
+            with open(f"usb/file{i}.bin", "wb") as f:
+                f.write(bytes([i]) * (3000 + i))
+        self.ar = Archiver()
+        self.ar.create_file_database(Path("usb"))
+        self.ar.convert_to_hash_database()
+        self.ar.segment(DISC_SIZE)
+        self.ar.save()
+        self.filenames = self.ar.write_all_isos(processes=2)
+        self.mtimes = [os.stat(filename).st_mtime_ns for filename in self.filenames]
+
+    def tearDown(self):
+        os.chdir(self.start_dir)
+        shutil.rmtree(self.work_dir)
+
+    def rewritten(self, **kwargs):
+        self.assertEqual(self.filenames, self.ar.write_all_isos(processes=2, **kwargs))
+        return [disc_num for disc_num, filename in enumerate(self.filenames)
+                if os.stat(filename).st_mtime_ns != self.mtimes[disc_num]]
+
+    def test_complete(self):
+        self.assertGreater(len(self.filenames), 1)
+        journal = Journal("new.journal")
+        for disc_num, filename in enumerate(self.filenames):
+            record = journal.records[disc_num]
+            self.assertTrue(record["complete"])
+            self.assertEqual(os.path.getsize(filename), record["size"])
+        self.assertFalse(any(Path(".").glob("*.part")))
+        self.assertEqual([], self.rewritten())
+
+    def test_missing_and_truncated(self):
+        os.remove(self.filenames[0])
+        with open(self.filenames[1], "r+b") as f:
+            f.truncate(4096)
+        self.assertEqual([0, 1], self.rewritten())
+        for disc_num, filename in enumerate(self.filenames):
+            self.assertEqual(self.ar.image_size(disc_num), os.path.getsize(filename))
+
+    def test_verify(self):
+        with open(self.filenames[1], "r+b") as f:
+            f.seek(-4096, os.SEEK_END)
+            f.write(b"corrupt")
+        self.mtimes[1] = os.stat(self.filenames[1]).st_mtime_ns
+        self.assertEqual([], self.rewritten())  # Same size so only hashing finds it
+        self.assertEqual([1], self.rewritten(verify=True))
+        self.check_restore()
+
+    def test_verify_hashes_once(self):
+        os.remove(self.filenames[-1])
+        with mock.patch("odarchive.journal.hash_image", side_effect=hash_image) as hashed:
+            self.assertEqual([len(self.filenames) - 1], self.rewritten(verify=True))
+        self.assertEqual(len(self.filenames) - 1, hashed.call_count)
+
+    def test_changed_plan(self):
+        self.ar.save()  # A new guid so everything is written again
+        self.assertEqual(list(range(len(self.filenames))), self.rewritten())
+
+    def test_interrupted_journal(self):
+        with open("new.journal", "a") as f:
+            f.write('{"disc_num": 0, "comp')  # Cut short when the machine died
+        self.assertEqual([], self.rewritten())
+
+    def test_append_after_torn_record(self):
+        with open("new.journal", "a") as f:
+            f.write('{"disc_num": 0, "comp')
+        os.remove(self.filenames[1])
+        self.assertEqual([1], self.rewritten())
+        with open("new.journal") as f:
+            lines = f.read().splitlines()
+        self.assertNotIn('{"disc_num": 0, "comp', "".join(lines))  # Cut off rather than joined on to
+        journal = Journal("new.journal")
+        self.assertEqual(len(lines), len([json.loads(line) for line in lines]))
+        self.assertTrue(journal.is_complete(1, self.ar.disc_contents_hash(1)))
+
+    def check_restore(self):
+        ar, discs = load_archiver_from_discs(self.filenames)
+        self.assertEqual(30, len(ar.restore(discs, "restored")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -8,12 +8,17 @@ def test_1_clean():
         "usb.iso",
         "usb.db",
         "catalogue.json",
+        "catalogue_0000.json",
+        "catalogue_0001.json",
+        "catalogue_0002.json",
+        "index.json",
         "new.iso",
         "new_0000.iso",
         "new_0001.iso",
         "new_0002.iso",
         "archiver.pickle",
         "archiver.dill",
+        "archiver.checkpoint",
         "archiver.json",
     ):
         try: